@@ -7,6 +7,7 @@ from add_parent_path import add_parent_path
 add_parent_path(1)
 
 import os
+import tempfile
 from uuid import uuid4
 from datetime import datetime
 
@@ -16,15 +17,24 @@ from streamlit_extras.bottom_container import bottom
 from streamlit_msal import Msal
 
 from docloader import FileCacheDocLoader
+from promptcache import system_prompts
+from responsecache import ResponseCache, load_embedder
+from ragapi import RAGAPI, ContextRetriever
+from rag.embeddings import load_embedding_model
 import constants as const
 from dal.s3 import S3Client
-from dal.db import PostgresDb
+from dal.db import PostgresDb, get_shared_db
+from dal.migrations import SchemaOutOfDateError
 from dal.models import AuthModel, AppSettingsModel
-from dal.chatlogger import ChatLogger
-from utils import get_roster, stream_text, generate_chat_history_export, generate_all_chats_export
+from dal.chatlogger import ChatLogger, ChatLogWriter, user_log_generation
+from utils import stream_text, generate_chat_history_export, generate_all_chats_export
 from llm.azureopenaillm import AzureOpenAILLM
 from llm.ollamallm import OllamaLLM
+from llm.resilience import ResilientLLM, RetryPolicy
+from llm.routingllm import Route, RoutingLLM, start_health_checks
+from llm.scheduler import LLMScheduler, get_scheduler
 from llmapi import LLMAPI
+from authorization import get_authorization_index
 from dal.user_preferences import get_preferences, save_preferences
 
 def set_context(mode:str, context:str):
@@ -43,52 +53,198 @@ def set_context(mode:str, context:str):
         st.session_state.ai.clear_history()
         # Apply context injection to system prompt based on mode and context (v2.1.0)
         if 'config' in st.session_state:
-            # Get base prompt from config based on mode
-            if mode == "Tutor":
-                base_system_prompt = st.session_state.config.tutor_prompt
-            else:
-                base_system_prompt = st.session_state.config.answer_prompt
-
             # Get context-enhanced system prompt
-            enhanced_system_prompt = get_context_injection(context, base_system_prompt)
+            enhanced_system_prompt = get_context_injection(mode, context)
             st.session_state.ai.system_prompt = enhanced_system_prompt
+            st.session_state.ai.cache_scope = (mode, context)
+            st.session_state.ai.retriever = get_context_retriever(context)
             logger.info(f"System prompt updated: mode={mode}, context={context}")
 
+def get_database() -> PostgresDb:
+    """Process-wide database engine and connection pool, shared by every session."""
+    # Strip quotes from DATABASE_URL if present (handles .env file format)
+    db_url = os.environ["DATABASE_URL"].strip("'").strip('"')
+    return get_shared_db(
+        db_url,
+        run_migrations=os.environ.get("DB_AUTO_MIGRATE", "false").lower() == "true",
+        pool_size=int(os.environ.get("DB_POOL_SIZE", "10")),
+        max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", "20")),
+        pool_timeout=float(os.environ.get("DB_POOL_TIMEOUT", "30")),
+        pool_recycle=int(os.environ.get("DB_POOL_RECYCLE", "1800")),
+        pool_pre_ping=os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true"
+    )
+
+@st.cache_resource
+def get_chat_log_writer() -> ChatLogWriter:
+    """
+    Process-wide write-behind queue for chat logs, shared by every session. Batches the
+    database rejects are kept in CHATLOG_SPILL_DIR and inserted once it accepts writes again.
+    """
+    return ChatLogWriter(
+        get_database(),
+        batch_size=int(os.environ.get("CHATLOG_BATCH_SIZE", "100")),
+        flush_interval=float(os.environ.get("CHATLOG_FLUSH_INTERVAL", "1.0")),
+        max_queue_size=int(os.environ.get("CHATLOG_QUEUE_SIZE", "10000")),
+        spill_dir=os.environ.get("CHATLOG_SPILL_DIR", os.path.join(tempfile.gettempdir(), "ist256-chatlog-spill"))
+    )
+
+@st.cache_resource
+def get_response_cache() -> ResponseCache:
+    """
+    Process-wide cache of answers to first-turn questions. RESPONSE_CACHE_SIMILARITY > 0
+    also reuses answers to similar questions (TF-IDF, or RESPONSE_CACHE_EMBEDDING_MODEL if set).
+    """
+    embedding_model = os.environ.get("RESPONSE_CACHE_EMBEDDING_MODEL", "")
+    return ResponseCache(
+        max_entries=int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "2048")),
+        ttl_seconds=float(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", "86400")),
+        similarity_threshold=float(os.environ.get("RESPONSE_CACHE_SIMILARITY", "0")),
+        embedder=load_embedder(embedding_model) if embedding_model else None
+    )
+
+@st.cache_resource
+def get_rag_api() -> RAGAPI:
+    """
+    Process-wide retrieval index over the assignment documents. Uses the index artifact the ETL
+    publishes in RAG_INDEX_DIR (default <LOCAL_FILE_CACHE>/index) when there is one;
+    RAG_EMBEDDING_MODEL must name the model the index was embedded with to use its embeddings.
+    """
+    embedding_model = os.environ.get("RAG_EMBEDDING_MODEL", "")
+    return RAGAPI(
+        FileCacheDocLoader(os.environ['LOCAL_FILE_CACHE']),
+        encoder=load_embedding_model(embedding_model) if embedding_model else None,
+        index_dir=os.environ.get("RAG_INDEX_DIR", os.path.join(os.environ['LOCAL_FILE_CACHE'], "index")),
+        encoder_model=embedding_model
+    )
+
+def context_retrieval_enabled() -> bool:
+    return os.environ.get("CONTEXT_RETRIEVAL", "true").lower() == "true"
+
+def get_context_retriever(context: str) -> ContextRetriever | None:
+    """Sends the relevant sections of the assignment with each question, instead of the whole document in the system prompt."""
+    if context == "General Python" or not context_retrieval_enabled():
+        return None
+    return get_rag_api().retriever(
+        context,
+        n_results=int(os.environ.get("RAG_TOP_K", "4")),
+        history_turns=int(os.environ.get("RAG_HISTORY_TURNS", "2"))
+    )
+
+def get_llm_scheduler() -> LLMScheduler:
+    """Process-wide LLM rate limiter / fair queue (0 = unlimited for the per-minute limits)."""
+    return get_scheduler(
+        max_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", "16")),
+        requests_per_minute=int(os.environ.get("LLM_REQUESTS_PER_MINUTE", "0")),
+        tokens_per_minute=int(os.environ.get("LLM_TOKENS_PER_MINUTE", "0")),
+        expected_completion_tokens=int(os.environ.get("LLM_EXPECTED_COMPLETION_TOKENS", "500"))
+    )
+
+def create_llm_backend(kind: str, config: AppSettingsModel, model: str | None = None, max_attempts: int | None = None):
+    """
+    AzureOpenAILLM or OllamaLLM with retries and a shared circuit breaker (policy from app settings).
+    max_attempts overrides config.retry_max_attempts (the router uses 1 and retries across routes instead).
+    """
+    if kind == "azure":
+        backend = AzureOpenAILLM(
+            endpoint=os.environ["AZURE_OPENAI_ENDPOINT"],
+            api_key=os.environ["AZURE_OPENAI_API_KEY"],
+            api_version=os.environ["AZURE_OPENAI_API_VERSION"],
+            model=model or config.ai_model,
+            temperature=config.temperature
+        )
+    elif kind == "ollama":
+        backend = OllamaLLM(
+            host_url=os.environ["OLLAMA_HOST"],
+            model=model or config.ai_model,
+            temperature=config.temperature
+        )
+    else:
+        raise ValueError(f"Unknown LLM backend: {kind}")
+    return ResilientLLM(
+        backend,
+        RetryPolicy(
+            max_attempts=max_attempts or config.retry_max_attempts,
+            base_delay=config.retry_base_delay,
+            max_delay=config.retry_max_delay,
+            failure_threshold=config.circuit_failure_threshold,
+            reset_timeout=config.circuit_reset_seconds
+        ),
+        name=kind
+    )
+
+def create_llm_router(config: AppSettingsModel) -> RoutingLLM:
+    """
+    LLM=router: LLM_ROUTES lists backend:weight pairs, e.g. "azure:2,ollama:1".
+    The first backend uses config.ai_model; ollama uses OLLAMA_MODEL when it isn't first.
+    A failing route isn't retried on its own (that would wait out a Retry-After before
+    failing over); the router moves to the next route at once and only backs off and
+    goes round again, up to config.retry_max_attempts times, once every route has failed.
+    """
+    routes, probes = [], []
+    for i, entry in enumerate(os.environ.get("LLM_ROUTES", "azure:1,ollama:1").split(",")):
+        kind, _, weight = entry.strip().partition(":")
+        model = None if i == 0 or kind != "ollama" else os.environ.get("OLLAMA_MODEL", "llama3")
+        routes.append(Route(kind, create_llm_backend(kind, config, model, max_attempts=1), float(weight or 1)))
+        # the health checks get their own backend objects (same pooled clients), so a probe never
+        # replaces the last_usage this session logs with its answer
+        probes.append(Route(kind, create_llm_backend(kind, config, model, max_attempts=1), float(weight or 1)))
+    policy = RetryPolicy(
+        max_attempts=config.retry_max_attempts,
+        base_delay=config.retry_base_delay,
+        max_delay=config.retry_max_delay
+    )
+    router = RoutingLLM(routes, cooldown=float(os.environ.get("LLM_ROUTE_COOLDOWN_SECONDS", "30")), policy=policy)
+    start_health_checks(probes, interval=float(os.environ.get("LLM_ROUTE_HEALTH_INTERVAL", "60")))
+    return router
+
+def load_app_settings() -> AppSettingsModel:
+    """Load AppSettingsModel via the process-wide S3 cache (copied, so sessions can't mutate the shared one)."""
+    config = st.session_state.s3_client.get_cached_object(
+        os.environ["S3_BUCKET"],
+        os.environ["CONFIG_FILE"],
+        parser=AppSettingsModel.from_yaml_string,
+        fallback_file_path=os.environ.get("CONFIG_FILE_FALLBACK","/app/data/config.yaml")
+    )
+    return config.model_copy()
+
 def calculate_icon_offset(mode, context):
     base_offset = 0 if mode == "Tutor" else 2
     if context != "General Python":
         base_offset +=1
     return base_offset
 
-def get_context_injection(context: str, system_prompt: str) -> str:
+def get_context_injection(mode: str, context: str) -> str:
     """
     Returns enhanced system prompt with context injection if applicable.
 
+    Prompts are rendered once per (mode, context, prompt text, document version)
+    and shared across sessions via promptcache.system_prompts.
+
     Args:
+        mode: The AI mode ("Tutor" or "Answer"), selects the base prompt from config
         context: The assignment context or "General Python"
-        system_prompt: The base system prompt (from config based on mode)
 
     Returns:
-        Complete system prompt with context prepended if applicable
+        Complete system prompt: the mode prompt, then the assignment content if applicable
+        (only its name with CONTEXT_RETRIEVAL, which sends the relevant sections per question)
     """
-    if context != "General Python":
-        try:
-            content = st.session_state.file_cache.load_cached_document(context)
-            context_injection = const.CONTEXT_PROMPT_TEMPLATE.format(
-                assignment=context,
-                content=content
-            )
-            logger.info(f"Context injected: {context}, size: {len(content)} chars")
-            return context_injection + "\n\n" + system_prompt
-        except FileNotFoundError:
-            logger.error(f"Assignment file not found: {context}")
-            st.warning(f"Assignment content for '{context}' is not available. Using general mode.")
-            return system_prompt
-        except Exception as e:
-            logger.error(f"Error loading assignment {context}: {e}")
-            st.warning(f"Unable to load assignment context. Please try again or select 'General Python'.")
-            return system_prompt
+    # Get base prompt from config based on mode
+    if mode == "Tutor":
+        system_prompt = st.session_state.config.tutor_prompt
     else:
+        system_prompt = st.session_state.config.answer_prompt
+
+    try:
+        prompt = system_prompts.get(mode, context, system_prompt, st.session_state.file_cache, full_document=not context_retrieval_enabled())
+        st.session_state.system_prompt_tokens = prompt.tokens
+        return prompt.text
+    except FileNotFoundError:
+        logger.error(f"Assignment file not found: {context}")
+        st.warning(f"Assignment content for '{context}' is not available. Using general mode.")
+        return system_prompt
+    except Exception as e:
+        logger.error(f"Error loading assignment {context}: {e}")
+        st.warning(f"Unable to load assignment context. Please try again or select 'General Python'.")
         return system_prompt
 
 # ----------------- Page And Sidebar Setup -----------------
@@ -132,36 +288,24 @@ with st.sidebar:
         if 'validated' not in st.session_state or st.session_state.validated  not in ["roster", "exception"]:
             st.session_state.auth_data = auth_data
             st.session_state.auth_model = AuthModel.from_auth_data(auth_data)
-            # Load lists
-            admin_users = [ user.lower().strip() for user in os.environ.get("ADMIN_USERS","").split(",") ]
-            exception_users = [ user.lower().strip() for user in os.environ.get("ROSTER_EXCEPTION_USERS","").split(",") ]
             # Load whitelist filename from config (requires config to be loaded first)
             if 'config' not in st.session_state:
-                config_yaml = st.session_state.s3_client.get_text_file(
-                    os.environ["S3_BUCKET"],
-                    os.environ["CONFIG_FILE"],
-                    fallback_file_path=os.environ.get("CONFIG_FILE_FALLBACK","/app/data/config.yaml")
-                )
-                config = AppSettingsModel.from_yaml_string(config_yaml)
-                st.session_state.config = config
+                st.session_state.config = load_app_settings()
 
             whitelist_file = st.session_state.config.whitelist if st.session_state.config.whitelist else "whitelist.txt"
-            valid_users = [user.lower().strip() for user in get_roster(
-                os.environ["S3_HOST"],
-                os.environ["S3_ACCESS_KEY"],
-                os.environ["S3_SECRET_KEY"],
-                os.environ["S3_BUCKET"],
-                whitelist_file
-            )]
+            try:
+                # served from the process-wide S3 cache (normalized emails)
+                valid_users = st.session_state.s3_client.get_whitelist(os.environ["S3_BUCKET"], whitelist_file)
+            except Exception as e:
+                logger.error(f"Failed to fetch whitelist from s3://{os.environ['S3_BUCKET']}/{whitelist_file}: {e}")
+                logger.warning("Returning empty whitelist - all users will be denied access unless in exception list")
+                valid_users = ()
             # ----------------- Authorization -----------------
             email = st.session_state.auth_model.email
-            # Validate user type
-            if email in admin_users:
-                st.session_state.validated = "admin"
-            elif email in exception_users:
-                st.session_state.validated = "exception"
-            elif email in valid_users:
-                st.session_state.validated = "roster"
+            # Validate user type (admin, exception, roster) against the shared index
+            role = get_authorization_index(valid_users).role_for(email)
+            if role is not None:
+                st.session_state.validated = role
             else:
                 # ------------------ Unauthorized -----------------
                 st.error(const.UNAUTHORIZED_MESSAGE)
@@ -199,12 +343,15 @@ with st.sidebar:
 # ----------------- Load Up the Initial Session State -----------------
 # s3 client config - already initialized earlier (before auth)
 
-# database connection
+# database connection - one shared engine/pool per process, schema created on first use
 if 'db' not in st.session_state:
-    # Strip quotes from DATABASE_URL if present (handles .env file format)
-    db_url = os.environ["DATABASE_URL"].strip("'").strip('"')
-    db = PostgresDb(db_url)
-    st.session_state.db = db
+    try:
+        st.session_state.db = get_database()
+    except SchemaOutOfDateError as e:
+        # writing logs against an old schema would fail (or store them in the old format)
+        st.error("The chat service is being upgraded. Please try again later.")
+        logger.error(f"Refusing to start: {e}")
+        st.stop()
 
 # Load User Preferences (v1.0.10) - after db is initialized
 if 'preferences_loaded' not in st.session_state:
@@ -235,13 +382,7 @@ context_list = ["General Python"]  + st.session_state.file_cache.get_doc_list()
 # chat configuration based on settings (v2.1.0 - prompts now in config)
 # IMPORTANT: Must be loaded BEFORE set_context() so prompts are available
 if 'config' not in st.session_state:
-    config_yaml = st.session_state.s3_client.get_text_file(
-        os.environ["S3_BUCKET"],
-        os.environ["CONFIG_FILE"],
-        fallback_file_path=os.environ.get("CONFIG_FILE_FALLBACK","/app/data/config.yaml")
-    )
-    config = AppSettingsModel.from_yaml_string(config_yaml)
-    st.session_state.config = config
+    st.session_state.config = load_app_settings()
 
 # Apply pending preferences now that file_cache and config are loaded (v1.0.10)
 if "new_session_context" not in st.session_state:
@@ -259,47 +400,50 @@ if "new_session_context" not in st.session_state:
 
 # chat logger setup (prepared for v1.0.6)
 if 'chat_logger' not in st.session_state:
+    # Write-behind logging: rows are batched by a shared background writer (disable with CHATLOG_WRITE_BEHIND=false)
+    chat_log_writer = None
+    if os.environ.get("CHATLOG_WRITE_BEHIND", "true").lower() == "true":
+        chat_log_writer = get_chat_log_writer()
+        st.session_state.chat_log_writer = chat_log_writer
     chat_logger = ChatLogger(
         st.session_state.db,
         model=st.session_state.config.ai_model,
-        rag=True  # Always true in v2.0 (context always available)
+        rag=True,  # Always true in v2.0 (context always available)
+        writer=chat_log_writer
     )
     st.session_state.chat_logger = chat_logger
 
 # LLM backend initialization (v1.0.4, updated v2.1.0)
 if 'ai' not in st.session_state:
     try:
-        # Get system prompt from config based on mode (v2.1.0)
-        if st.session_state.mode == "Tutor":
-            base_system_prompt = st.session_state.config.tutor_prompt
+        # Get system prompt from config based on mode, with context injection (v2.1.0)
+        system_prompt = get_context_injection(st.session_state.mode, st.session_state.context)
+
+        # Select backend based on LLM environment variable (azure, ollama, or router across several)
+        if os.environ["LLM"] == "router":
+            backend = create_llm_router(st.session_state.config)
         else:
-            base_system_prompt = st.session_state.config.answer_prompt
-
-        # Apply context injection to system prompt
-        system_prompt = get_context_injection(st.session_state.context, base_system_prompt)
-
-        # Select backend based on LLM environment variable
-        if os.environ["LLM"] == "azure":
-            backend = AzureOpenAILLM(
-                endpoint=os.environ["AZURE_OPENAI_ENDPOINT"],
-                api_key=os.environ["AZURE_OPENAI_API_KEY"],
-                api_version=os.environ["AZURE_OPENAI_API_VERSION"],
-                model=st.session_state.config.ai_model,
-                temperature=st.session_state.config.temperature
-            )
-        else:  # ollama
-            backend = OllamaLLM(
-                host_url=os.environ["OLLAMA_HOST"],
-                model=st.session_state.config.ai_model,
-                temperature=st.session_state.config.temperature
-            )
+            backend = create_llm_backend(os.environ["LLM"], st.session_state.config)
+
+        # Shared answers to first-turn questions (disable with RESPONSE_CACHE=false)
+        response_cache = None
+        if os.environ.get("RESPONSE_CACHE", "true").lower() == "true":
+            response_cache = get_response_cache()
+            st.session_state.response_cache = response_cache
 
         # Initialize LLMAPI wrapper
         ai = LLMAPI(
             llm=backend,
             model=st.session_state.config.ai_model,
             temperature=st.session_state.config.temperature,
-            system_prompt=system_prompt
+            system_prompt=system_prompt,
+            max_prompt_tokens=st.session_state.config.max_prompt_tokens,
+            summarize_evicted=st.session_state.config.summarize_history,
+            scheduler=get_llm_scheduler(),
+            user_id=st.session_state.auth_model.email,
+            response_cache=response_cache,
+            cache_scope=(st.session_state.mode, st.session_state.context),
+            retriever=get_context_retriever(st.session_state.context)
         )
         st.session_state.ai = ai
         logger.info(f"Initialized LLM: backend={os.environ['LLM']}, model={st.session_state.config.ai_model}")
@@ -364,15 +508,17 @@ else:  # Chat (default page)
     if st.session_state.new_session_context:
 
         with st.chat_message("assistant", avatar=avatars["assistant"]):
-            with st.spinner("Preparing your session..."):
-                # Get user's firstname with fallback
-                firstname = st.session_state.auth_model.firstname if hasattr(st.session_state.auth_model, 'firstname') and st.session_state.auth_model.firstname else "Student"
-
-                if st.session_state.mode == "Tutor":
-                    greeting = f"Hello {firstname}! I am in `Tutor` mode. I will provide guided learning for your `{st.session_state.context}` questions.\n"
-                else:
-                    greeting = f"Hello {firstname}! I am in `Answer` mode. I will provide direct answers to your `{st.session_state.context}` questions.\n"
-                st.write_stream(stream_text(greeting))
+            # Get user's firstname with fallback
+            firstname = st.session_state.auth_model.firstname if hasattr(st.session_state.auth_model, 'firstname') and st.session_state.auth_model.firstname else "Student"
+            mode_key = "Tutor" if st.session_state.mode == "Tutor" else "Answer"
+            greeting = const.GREETINGS[mode_key].format(firstname=firstname, context=st.session_state.context)
+
+            # Rendered instantly by default; GREETING_STREAM_RATE (chars/sec) > 0 streams it instead
+            greeting_rate = float(os.environ.get("GREETING_STREAM_RATE", "0"))
+            if greeting_rate > 0:
+                st.write_stream(stream_text(greeting, chars_per_second=greeting_rate))
+            else:
+                st.markdown(greeting)
 
         st.session_state.new_session_context = False
 
@@ -414,15 +560,27 @@ else:  # Chat (default page)
                 else:
                     st.button("📥 Download Chat Session", disabled=True, help="No messages to download yet")
             with col4:
-                # Download all chats (v1.0.8)
-                all_chats_text = generate_all_chats_export(st.session_state.db, st.session_state.auth_model.email)
-                st.download_button(
-                    label="📥 Download All Chat Sessions",
-                    data=all_chats_text,
-                    file_name=f"all_chats_{st.session_state.auth_model.email.split('@')[0]}_{datetime.now().strftime('%Y%m%d')}.txt",
-                    mime="text/plain",
-                    help="Download all your chat sessions from the database"
-                )
+                # Download all chats (v1.0.8) - built only on request, cached until this user logs a new message
+                email = st.session_state.auth_model.email
+                export_key = (email, user_log_generation(email))
+                cached_export = st.session_state.get("all_chats_export")
+                if cached_export is not None and cached_export[0] == export_key:
+                    st.download_button(
+                        label="📥 Download All Chat Sessions",
+                        data=cached_export[1],
+                        file_name=f"all_chats_{email.split('@')[0]}_{datetime.now().strftime('%Y%m%d')}.txt",
+                        mime="text/plain",
+                        help="Download all your chat sessions from the database"
+                    )
+                elif st.button("📥 Prepare All Chat Sessions", help="Gather all your chat sessions from the database for download"):
+                    with st.spinner("Gathering your chat history..."):
+                        # make sure queued log rows are in the database before reading them back
+                        if 'chat_log_writer' in st.session_state:
+                            st.session_state.chat_log_writer.flush(timeout=5)
+                        all_chats_text = generate_all_chats_export(st.session_state.db, email)
+                    st.session_state.all_chats_export = (export_key, all_chats_text)
+                    logger.info(f"All chats export prepared: user={email}, size={len(all_chats_text)}")
+                    st.rerun()
             if set_mode:
                 # Save preferences before setting new context (v1.0.10)
                 try:
@@ -468,8 +626,14 @@ else:  # Chat (default page)
         with st.chat_message("assistant", avatar=avatars["assistant"]):
             with st.spinner("Thinking..."):
                 try:
-                    # Stream response from LLM
-                    response_stream = st.session_state.ai.stream_response(prompt)
+                    # Stream response from LLM; show the place in line while the scheduler holds the request
+                    queue_status = st.empty()
+                    def show_queue_position(position: int):
+                        if position > 0:
+                            queue_status.info(f"⏳ Lots of students are asking questions right now. You're #{position} in line...")
+                        else:
+                            queue_status.empty()
+                    response_stream = st.session_state.ai.stream_response(prompt, on_queue=show_queue_position)
                     full_response = st.write_stream(response_stream)
 
                     # Record response in conversation history
@@ -484,7 +648,9 @@ else:  # Chat (default page)
                             st.session_state.sessionid,
                             st.session_state.auth_model.email,
                             st.session_state.context,
-                            full_response
+                            full_response,
+                            model=st.session_state.ai.last_request.get("model"),
+                            usage=st.session_state.ai.last_usage
                         )
                         logger.debug(f"Logged assistant response: session={st.session_state.sessionid}, context={st.session_state.context}")
                     except Exception as log_error:
@@ -493,7 +659,9 @@ else:  # Chat (default page)
                 except Exception as e:
                     # Enhanced error handling with user-friendly messages (v1.0.8)
                     error_str = str(e).lower()
-                    if "timeout" in error_str:
+                    if "circuit open" in error_str:
+                        user_message = "The AI service is having trouble right now. Please try again in a minute."
+                    elif "timeout" in error_str:
                         user_message = "The AI is taking longer than usual. Please try again in a moment."
                     elif "rate limit" in error_str or "429" in error_str:
                         user_message = "The AI service is busy. Please wait a moment and try again."
@@ -0,0 +1,98 @@
+import os
+import threading
+from typing import FrozenSet, Iterable, List, Optional, Sequence
+
+from loguru import logger
+
+ROLE_ADMIN = "admin"
+ROLE_EXCEPTION = "exception"
+ROLE_ROSTER = "roster"
+
+
+def normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+
+def parse_email_list(csv: str) -> FrozenSet[str]:
+    """Parse a comma-separated env var (ADMIN_USERS, ROSTER_EXCEPTION_USERS) into normalized emails."""
+    return frozenset(normalize_email(email) for email in csv.split(",") if email.strip())
+
+
+class AuthorizationIndex:
+    '''
+    Immutable lookup of admin, exception and whitelist users. Membership is a
+    frozenset lookup, so role_for() is O(1) regardless of whitelist size.
+    '''
+
+    def __init__(self, admin_users: Iterable[str], exception_users: Iterable[str], whitelist_users: Iterable[str]):
+        self._admin_users = frozenset(normalize_email(e) for e in admin_users if e.strip())
+        self._exception_users = frozenset(normalize_email(e) for e in exception_users if e.strip())
+        self._whitelist_users = frozenset(normalize_email(e) for e in whitelist_users if e.strip())
+
+    def role_for(self, email: str) -> Optional[str]:
+        """Return "admin", "exception", "roster" or None (unauthorized), checked in that order."""
+        email = normalize_email(email)
+        if email in self._admin_users:
+            return ROLE_ADMIN
+        if email in self._exception_users:
+            return ROLE_EXCEPTION
+        if email in self._whitelist_users:
+            return ROLE_ROSTER
+        return None
+
+    @property
+    def admin_users(self) -> List[str]:
+        return sorted(self._admin_users)
+
+    @property
+    def exception_users(self) -> List[str]:
+        return sorted(self._exception_users)
+
+    @property
+    def whitelist_users(self) -> List[str]:
+        return sorted(self._whitelist_users)
+
+
+# (admin_csv, exception_csv, whitelist object, index) - replaced as a whole, never mutated
+_current = None
+_current_lock = threading.Lock()
+
+def get_authorization_index(whitelist: Sequence[str]) -> AuthorizationIndex:
+    '''
+    Return the process-wide AuthorizationIndex for the current env lists and
+    whitelist. The index is rebuilt only when the whitelist object changes
+    (the S3 cache hands out the same tuple until the file changes) or the
+    ADMIN_USERS / ROSTER_EXCEPTION_USERS env vars change.
+    '''
+    global _current
+    admin_csv = os.environ.get("ADMIN_USERS", "")
+    exception_csv = os.environ.get("ROSTER_EXCEPTION_USERS", "")
+
+    current = _current
+    if current is not None and current[0] == admin_csv and current[1] == exception_csv and current[2] is whitelist:
+        return current[3]
+
+    with _current_lock:
+        current = _current
+        if current is not None and current[0] == admin_csv and current[1] == exception_csv and current[2] is whitelist:
+            return current[3]
+        index = AuthorizationIndex(parse_email_list(admin_csv), parse_email_list(exception_csv), whitelist)
+        _current = (admin_csv, exception_csv, whitelist, index)
+        logger.info(f"Rebuilt authorization index: admins={len(index.admin_users)}, exceptions={len(index.exception_users)}, whitelist={len(whitelist)}")
+        return index
+
+
+if __name__ == '__main__':
+    # Microbenchmark: list membership (previous approach) vs. AuthorizationIndex.role_for
+    import random
+    import timeit
+
+    for size in [10_000, 50_000, 100_000]:
+        whitelist = [f"student{i:06d}@syr.edu" for i in range(size)]
+        index = AuthorizationIndex([], [], whitelist)
+        probes = [random.choice(whitelist) for _ in range(500)] + [f"nobody{i}@syr.edu" for i in range(500)]
+
+        list_time = timeit.timeit(lambda: [p in whitelist for p in probes], number=5) / (5 * len(probes))
+        index_time = timeit.timeit(lambda: [index.role_for(p) for p in probes], number=5) / (5 * len(probes))
+        build_time = timeit.timeit(lambda: AuthorizationIndex([], [], whitelist), number=5) / 5
+        print(f"whitelist={size:>7}: list lookup={list_time * 1e6:9.2f}us  index lookup={index_time * 1e6:6.3f}us  index build={build_time * 1e3:7.2f}ms")
@@ -47,6 +47,22 @@ Here is the full assignment content:
 ---
 
 '''
+# With retrieval (chat/ragapi.py) the system prompt names the assignment and the
+# relevant sections travel with each question instead of the whole document
+CONTEXT_RETRIEVAL_PROMPT_TEMPLATE='''
+You are assisting with the assignment: {assignment}
+
+Each question from the student includes the sections of the assignment that are
+relevant to it. Base your answers on them and on the course material.
+'''
+RAG_PROMPT_TEMPLATE='''ASSIGNMENT SECTIONS ({assignment}):
+
+{documents}
+
+---
+
+QUESTION:
+{query}'''
 # CONTEXT_PROMPT_TEMPLATE_NO_CONTENT='''
 # I would like to ask you questions about the assignment: {assignment}. 
 # Please acknowledge that you are ready to answer questions about this assignment.
@@ -57,17 +73,12 @@ Here is the full assignment content:
 # '''
 
 
-# RAG_PROMPT_TEMPLATE='''
-# INSTRUCTIONS:
-# Answer the question based on the document and your understanding of Python programming. 
-# If you write python code, make sure to explain what it does.
+# Pre-written session greetings, filled in with the student's first name and context
+GREETINGS = {
+    "Tutor": "Hello {firstname}! I am in `Tutor` mode. I will provide guided learning for your `{context}` questions.\n",
+    "Answer": "Hello {firstname}! I am in `Answer` mode. I will provide direct answers to your `{context}` questions.\n",
+}
 
-# DOCUMENT:
-# {documents}
-
-# QUESTION:
-# {query}
-# '''
 ABOUT_PROMPT='''
 ### What is this?
 This app is an AI Tutor Bot designed for IST256, an introductory programming course in Python.
@@ -1,17 +1,125 @@
 import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from loguru import logger
+
+
+class _CachedDocument:
+    def __init__(self, text: str, mtime_ns: int, size: int):
+        self.text = text
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.checked_at = time.monotonic()
+
+    @property
+    def version(self) -> Tuple[int, int]:
+        return (self.mtime_ns, self.size)
+
+
+class _DirectoryCache:
+    '''
+    Shared state for one cache directory: the precomputed doc list and an LRU
+    of document contents keyed by path and validated by (mtime, size).
+    The filesystem is only consulted once per check_interval seconds per
+    directory/document, so steady-state reruns cost no syscalls.
+    '''
+
+    def __init__(self, folder: str, max_bytes: int, check_interval: float):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.docs: "OrderedDict[str, _CachedDocument]" = OrderedDict()
+        self.total_bytes = 0
+        self.doc_list: List[str] = []
+        self.dir_mtime_ns = None
+        self.dir_checked_at = 0.0
+
+    def _fresh(self, checked_at: float) -> bool:
+        return time.monotonic() - checked_at < self.check_interval
+
+    def get_doc_list(self) -> List[str]:
+        if self.dir_mtime_ns is not None and self._fresh(self.dir_checked_at):
+            return self.doc_list
+        with self.lock:
+            if self.dir_mtime_ns is not None and self._fresh(self.dir_checked_at):
+                return self.doc_list
+            mtime_ns = os.stat(self.folder).st_mtime_ns
+            if mtime_ns != self.dir_mtime_ns:
+                self.doc_list = sorted([f.replace(".md","") for f in os.listdir(self.folder) if f.endswith(".md") and (f.find("LAB") != -1 or f.find("HW") != -1)])
+                self.dir_mtime_ns = mtime_ns
+                # files were added/removed - drop everything, documents reload lazily
+                self.docs.clear()
+                self.total_bytes = 0
+                logger.info(f"Doc list rebuilt: folder={self.folder}, docs={len(self.doc_list)}")
+            self.dir_checked_at = time.monotonic()
+            return self.doc_list
+
+    def load(self, filespec: str) -> _CachedDocument:
+        doc = self.docs.get(filespec)
+        if doc is not None and self._fresh(doc.checked_at):
+            with self.lock:
+                if filespec in self.docs:
+                    self.docs.move_to_end(filespec)
+            return doc
+
+        with self.lock:
+            stat = os.stat(filespec)
+            doc = self.docs.get(filespec)
+            if doc is not None and doc.version == (stat.st_mtime_ns, stat.st_size):
+                doc.checked_at = time.monotonic()
+                self.docs.move_to_end(filespec)
+                return doc
+
+            with open(filespec, "r") as file:
+                text = file.read()
+            if doc is not None:
+                self.total_bytes -= doc.size
+            doc = _CachedDocument(text, stat.st_mtime_ns, stat.st_size)
+            self.docs[filespec] = doc
+            self.docs.move_to_end(filespec)
+            self.total_bytes += doc.size
+            while self.total_bytes > self.max_bytes and len(self.docs) > 1:
+                _, evicted = self.docs.popitem(last=False)
+                self.total_bytes -= evicted.size
+            logger.info(f"Cached document: file={filespec}, size={doc.size}, cache_bytes={self.total_bytes}")
+            return doc
+
+
+_directories: Dict[str, _DirectoryCache] = {}
+_directories_lock = threading.Lock()
+
 
 class FileCacheDocLoader:
 
-    def __init__(self, file_cache):
+    def __init__(self, file_cache, max_bytes: int|None=None, check_interval: float|None=None):
         self._file_cache = file_cache
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("DOC_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+        if check_interval is None:
+            check_interval = float(os.environ.get("DOC_CACHE_CHECK_INTERVAL", "30"))
+        # one cache per directory, shared by every loader (and session) in the process
+        key = os.path.abspath(file_cache)
+        with _directories_lock:
+            if key not in _directories:
+                _directories[key] = _DirectoryCache(key, max_bytes, check_interval)
+            self._cache = _directories[key]
+
+    def _filespec(self, key) -> str:
+        return os.path.join(self._file_cache, key) + ".md"
 
     def load_cached_document(self, key) -> str:
-        filespec = os.path.join(self._file_cache, key) + ".md"
-        with open(filespec, "r") as file:
-            return file.read()
-        
+        return self._cache.load(self._filespec(key)).text
+
+    def document_version(self, key) -> Tuple[int, int]:
+        """(mtime_ns, size) of the cached copy of a document, loading it if needed."""
+        return self._cache.load(self._filespec(key)).version
+
     def get_doc_list(self):
-        return sorted([f.replace(".md","") for f in os.listdir(self._file_cache) if f.endswith(".md") and (f.find("LAB") != -1 or f.find("HW") != -1)])
+        return self._cache.get_doc_list()
 
 if __name__=='__main__':
     folder = os.environ['LOCAL_FILE_CACHE']
@@ -1,14 +1,18 @@
 import os
-import json
-from datetime import datetime
-from typing import List, Tuple
+from datetime import datetime, time, timedelta
+from typing import Optional, Tuple
 import streamlit as st
 import pandas as pd
 from loguru import logger
-from sqlmodel import select
 
 from dal.db import PostgresDb
-from dal.models import LogModel
+from dal.logstats import count_logs, get_log_stats
+from dal.logexport import (CONTENT_TYPES, export_file_extension, export_logs_to_tempfile, get_watermark,
+                           incremental_filter, log_select, parquet_available, set_watermark, watermark_name)
+from dal.models import LogFilterModel
+
+# Watermark name used by the "only new rows since last export" option (one per filter, see watermark_name)
+EXPORT_WATERMARK = "admin-export"
 
 
 def generate_timestamp_filename(base: str, extension: str) -> str:
@@ -17,67 +21,27 @@ def generate_timestamp_filename(base: str, extension: str) -> str:
     return f"{base}_{now}.{extension}"
 
 
-def fetch_all_logs(db: PostgresDb) -> List[LogModel]:
-    """Fetch all chat logs from database ordered by timestamp."""
-    try:
-        with db.get_session() as session:
-            statement = select(LogModel).order_by(LogModel.timestamp)
-            results = session.exec(statement).all()
-            return list(results)
-    except Exception as e:
-        logger.error(f"Failed to fetch logs: {e}")
-        raise
-
-
 def get_log_count(db: PostgresDb) -> int:
-    """Get total count of chat logs in database."""
+    """Get total count of chat logs in database (COUNT(*), no rows are fetched)."""
     try:
-        with db.get_session() as session:
-            statement = select(LogModel)
-            results = session.exec(statement).all()
-            return len(list(results))
+        return count_logs(db)
     except Exception as e:
         logger.error(f"Failed to count logs: {e}")
         raise
 
 
-def export_logs_to_csv(logs: List[LogModel]) -> Tuple[str, str]:
-    """Convert logs to CSV format.
+def export_logs_to_file(db: PostgresDb, export_format: str, compress: bool, log_filter: Optional[LogFilterModel] = None) -> Tuple[str, str, int]:
+    """Stream logs matching log_filter (default: all) into a temp file.
 
     Returns:
-        Tuple of (csv_data, filename)
+        Tuple of (temp_file_path, download_filename, row_count)
     """
     try:
-        # Convert to list of dicts
-        data = [log.model_dump() for log in logs]
-        # Create DataFrame
-        df = pd.DataFrame(data)
-        # Generate CSV
-        csv_data = df.to_csv(index=False)
-        # Generate filename
-        filename = generate_timestamp_filename("chat_logs", "csv")
-        return csv_data, filename
+        path, rows = export_logs_to_tempfile(db, export_format, compress=compress, statement=log_select(log_filter))
+        filename = generate_timestamp_filename("chat_logs", export_file_extension(export_format, compress))
+        return path, filename, rows
     except Exception as e:
-        logger.error(f"Failed to generate CSV: {e}")
-        raise
-
-
-def export_logs_to_json(logs: List[LogModel]) -> Tuple[str, str]:
-    """Convert logs to JSON format.
-
-    Returns:
-        Tuple of (json_data, filename)
-    """
-    try:
-        # Convert to list of dicts
-        data = [log.model_dump() for log in logs]
-        # Serialize to JSON with indentation
-        json_data = json.dumps(data, indent=2)
-        # Generate filename
-        filename = generate_timestamp_filename("chat_logs", "json")
-        return json_data, filename
-    except Exception as e:
-        logger.error(f"Failed to generate JSON: {e}")
+        logger.error(f"Failed to generate {export_format} export: {e}")
         raise
 
 
@@ -90,61 +54,137 @@ def show_export():
         st.stop()
 
     st.title("Export Chat Logs")
-    st.markdown("Export all chat logs from the database.")
+    st.markdown("Export chat logs from the database, optionally filtered.")
 
     # Get database instance
     db = st.session_state.db
 
-    # Display statistics
+    # Display statistics (aggregated in the database, cached for a minute)
+    use_estimate = st.checkbox(
+        "Use estimated total",
+        value=False,
+        help="Read the approximate row count from Postgres statistics instead of counting, and break down "
+             "by context and model over the last 30 days only, so no query scans the whole table"
+    )
     try:
-        log_count = get_log_count(db)
-        st.metric("Total Log Entries", log_count)
+        stats = get_log_stats(db, use_estimate=use_estimate)
+        log_count = stats.total
+        label = "Total Log Entries (estimated)" if stats.estimated else "Total Log Entries"
+        st.metric(label, f"{log_count:,}")
+        st.caption(f"Stats as of {stats.generated_at.strftime('%Y-%m-%d %H:%M:%S')} UTC")
 
         if log_count == 0:
             st.warning("No chat logs found in the database.")
             st.stop()
+
+        with st.expander("📊 Breakdown", expanded=False):
+            st.markdown("**Messages per day (last 30 days, UTC)**")
+            st.bar_chart(pd.Series(stats.by_day, name="messages"))
+            window = f" (last {stats.breakdown_days} days)" if stats.breakdown_days else ""
+            col1, col2 = st.columns(2)
+            with col1:
+                st.markdown(f"**By context{window}**")
+                st.dataframe(pd.Series(stats.by_context, name="messages").sort_values(ascending=False))
+            with col2:
+                st.markdown(f"**By model{window}**")
+                st.dataframe(pd.Series(stats.by_model, name="messages").sort_values(ascending=False))
     except Exception as e:
         st.error("Unable to connect to database. Please try again.")
         logger.error(f"Database connection error: {e}")
         st.stop()
 
+    # Filters (applied in the database query)
+    st.subheader("Filters")
+    col1, col2 = st.columns(2)
+    with col1:
+        date_range = st.date_input("Date range (UTC)", value=(), help="Leave empty to export all dates")
+        contexts = st.multiselect("Contexts", options=sorted(stats.by_context.keys()))
+        roles = st.multiselect("Roles", options=["user", "assistant", "system"])
+    with col2:
+        userid = st.text_input("User email", value="", help="Export a single user's logs")
+        models = st.multiselect("Models", options=sorted(stats.by_model.keys()))
+    log_filter = LogFilterModel(
+        contexts=contexts,
+        models=models,
+        roles=roles,
+        userid=userid.strip() or None
+    )
+    if len(date_range) > 0:
+        log_filter.start = datetime.combine(date_range[0], time.min)
+        # end date is inclusive in the widget, exclusive in the filter
+        log_filter.end = datetime.combine(date_range[-1], time.min) + timedelta(days=1)
+
+    since_last = st.checkbox(
+        "Only new rows since last export",
+        value=False,
+        help="Export rows added after the previous incremental export with the same filters, then advance "
+             "that watermark once the file has been saved to S3 or downloaded"
+    )
+    watermark = watermark_name(EXPORT_WATERMARK, log_filter)
+    if since_last:
+        st.caption(f"Last incremental export with these filters ended at log id {get_watermark(db, watermark):,}")
+
     # Export format selection
     st.subheader("Export Format")
-    export_format = st.radio(
+    format_labels = {"CSV": "csv", "JSON Lines": "ndjson"}
+    if parquet_available():
+        format_labels["Parquet"] = "parquet"
+    export_label = st.radio(
         "Choose format:",
-        options=["CSV", "JSON"],
+        options=list(format_labels.keys()),
+        horizontal=True,
+        help="CSV for Excel/spreadsheets, JSON Lines (one object per line) for programmatic access, Parquet for pandas/analytics"
+    )
+    export_format = format_labels[export_label]
+    compress = st.checkbox("Compress (gzip)", value=True, disabled=export_format == "parquet",
+                           help="Parquet files are always compressed internally")
+    destination = st.radio(
+        "Destination:",
+        options=["Download", "Save to S3"],
         horizontal=True,
-        help="CSV for Excel/spreadsheets, JSON for programmatic access"
+        help="Large exports are best saved to S3; downloads are held in memory by the browser session"
     )
 
     # Export button
     if st.button("Generate Export", type="primary"):
-        with st.spinner(f"Generating {export_format} export..."):
+        with st.spinner(f"Generating {export_label} export..."):
+            path = None
             try:
-                # Fetch all logs
-                logs = fetch_all_logs(db)
+                if since_last:
+                    # Snapshot the id range now so rows logged during the export go to the next one
+                    log_filter = incremental_filter(db, watermark, log_filter)
 
-                # Generate export
-                if export_format == "CSV":
-                    data, filename = export_logs_to_csv(logs)
-                    mime_type = "text/csv"
-                else:
-                    data, filename = export_logs_to_json(logs)
-                    mime_type = "application/json"
+                # Stream logs to a temp file (constant memory regardless of table size)
+                path, filename, rows = export_logs_to_file(db, export_format, compress, log_filter)
+                mime_type = "application/gzip" if compress and export_format != "parquet" else CONTENT_TYPES[export_format]
 
                 # Log the export action
-                userid = st.session_state.get("userid", "unknown")
-                logger.info(f"Admin {userid} generated {export_format} export: {len(logs)} rows")
-
-                # Provide download button
-                st.download_button(
-                    label=f"📥 Download {export_format}",
-                    data=data,
-                    file_name=filename,
-                    mime=mime_type
-                )
-                st.success(f"Export generated successfully! Click above to download {filename}")
+                admin = st.session_state.auth_model.email if "auth_model" in st.session_state else "unknown"
+                logger.info(f"Admin {admin} generated {export_label} export: {rows} rows, destination={destination}, filter={log_filter.model_dump(exclude_defaults=True)}")
+
+                if destination == "Save to S3":
+                    object_key = f"exports/{filename}"
+                    st.session_state.s3_client.put_file(os.environ["S3_BUCKET"], object_key, path, content_type=mime_type)
+                    # the upload has completed, so the rows are delivered
+                    if since_last:
+                        set_watermark(db, watermark, log_filter.max_id)
+                    st.success(f"Export saved to s3://{os.environ['S3_BUCKET']}/{object_key} ({rows:,} rows)")
+                else:
+                    # Provide download button; an incremental export's watermark advances when it is clicked
+                    with open(path, "rb") as f:
+                        st.download_button(
+                            label=f"📥 Download {export_label}",
+                            data=f,
+                            file_name=filename,
+                            mime=mime_type,
+                            on_click=set_watermark if since_last else None,
+                            args=(db, watermark, log_filter.max_id) if since_last else None
+                        )
+                    st.success(f"Export generated successfully ({rows:,} rows)! Click above to download {filename}")
 
             except Exception as e:
                 st.error("Failed to generate export. Please try again or contact support.")
                 logger.error(f"Export generation failed: {e}")
+            finally:
+                if path and os.path.exists(path):
+                    os.remove(path)
@@ -1,39 +1,89 @@
+import asyncio
+import re
+import time
+from typing import Callable, NamedTuple
+
+from loguru import logger
+
+from llm.aio import iterate_sync, run_sync
 from llm.llmbase import LLMBase
+from llm.scheduler import LLMScheduler
+from llm.tokens import count_message_tokens, count_tokens
+from ragapi import ContextRetriever
+from responsecache import ResponseCache
+
+SUMMARY_PROMPT = (
+    "Summarize the earlier part of this tutoring conversation in a few sentences. "
+    "Keep the student's goals, what was already explained, and any code they are working on."
+)
+
+class QueuePosition(NamedTuple):
+    '''Emitted by _astream while the request waits for a scheduler slot (0 = started).'''
+    position: int
+
 
 class LLMAPI:
     def __init__(
-            self, 
-            llm: LLMBase, 
-            model: str|None=None, 
-            temperature: str|None=None, 
-            system_prompt: str|None=None
+            self,
+            llm: LLMBase,
+            model: str|None=None,
+            temperature: str|None=None,
+            system_prompt: str|None=None,
+            max_prompt_tokens: int|None=None,
+            summarize_evicted: bool=False,
+            use_async: bool=True,
+            scheduler: LLMScheduler|None=None,
+            user_id: str="anonymous",
+            response_cache: ResponseCache|None=None,
+            cache_scope: tuple=("", ""),
+            retriever: ContextRetriever|None=None
         ):
         self._llm = llm
         self._model = model if model != None else llm.model
         self._temperature = temperature if temperature != None else llm.temperature
+        # History policy: when max_prompt_tokens is set, the oldest turns are evicted
+        # (system message always kept) and optionally folded into a rolling summary
+        self._max_prompt_tokens = max_prompt_tokens if max_prompt_tokens else None
+        self._summarize_evicted = summarize_evicted
+        self._summary = None
+        # stream through the shared event loop (llm/aio.py) instead of a blocking client per session
+        self._use_async = use_async
+        # process-wide rate limits / fair queuing (llm/scheduler.py); None sends immediately
+        self._scheduler = scheduler
+        self._user_id = user_id
+        # shared answers to first-turn questions (chat/responsecache.py), per (mode, context)
+        self._response_cache = response_cache
+        self.cache_scope = cache_scope
+        # adds the relevant assignment sections to each outgoing question (chat/ragapi.py)
+        self.retriever = retriever
         self._messages = [
             {
-                "role": "system", 
-                "content": "You are a helpful AI assistant." if system_prompt == None else system_prompt 
+                "role": "system",
+                "content": "You are a helpful AI assistant." if system_prompt == None else system_prompt
             }
         ]
+        # token count per entry in self._messages, kept in step with it
+        self._message_tokens = [count_message_tokens(self._messages[0])]
+        self._last_request = self._request_info(0, 0, 0)
 
     def _add_to_messages(self, role, content):
-        self._messages.append(
-            {
+        message = {
               "role": role,
               "content": content
             }
-        )
+        self._messages.append(message)
+        self._message_tokens.append(count_message_tokens(message))
 
     def clear_history(self):
-        # just system prompt 
-        self._messages = [ self._messages[0] ]         
+        # just system prompt
+        self._messages = [ self._messages[0] ]
+        self._message_tokens = [ self._message_tokens[0] ]
+        self._summary = None
 
     @property
     def history(self):
         return self._messages
-    
+
     @property
     def system_prompt(self):
         return [m for m in self._messages if m['role'] == "system"]
@@ -42,25 +92,325 @@ class LLMAPI:
     def system_prompt(self, value):
         index = [i for i, m in enumerate(self._messages) if m['role'] == "system"][0]
         self._messages[index]['content'] = value
+        self._message_tokens[index] = count_message_tokens(self._messages[index])
+
+    @property
+    def prompt_tokens(self) -> int:
+        """Tokens in the current history (system prompt, summary and turns)."""
+        total = sum(self._message_tokens)
+        if self._summary:
+            total += count_message_tokens(self._summary_message())
+        return total
+
+    @property
+    def last_request(self) -> dict:
+        """
+        Most recent request: prompt_tokens (as reported by the backend once it has answered,
+        estimated before), messages, evicted_messages, model (the backend/model that answered
+        when routed), and after the answer: completion_tokens, cached_tokens (prompt tokens
+        served from the provider's prompt cache) and ttft_ms (time to first token).
+        """
+        return self._last_request
+
+    @property
+    def last_usage(self) -> dict:
+        """Usage fields of the most recent request, as logged with the assistant response."""
+        return {key: self._last_request.get(key) for key in ("prompt_tokens", "completion_tokens", "cached_tokens", "ttft_ms")}
+
+    def _request_info(self, prompt_tokens, messages, evicted_messages, model=None):
+        return {
+            "prompt_tokens": prompt_tokens,
+            "messages": messages,
+            "evicted_messages": evicted_messages,
+            "model": model or self._model,
+            "completion_tokens": None,
+            "cached_tokens": None,
+            "ttft_ms": None
+        }
+
+    def _summary_message(self):
+        return {"role": "system", "content": f"Summary of the earlier conversation:\n{self._summary}"}
+
+    def _evict(self, reserve: int = 0) -> list:
+        '''
+        Evict the oldest turns until the history (summary included) plus reserve
+        (the retrieved sections sent with the question) fits in max_prompt_tokens.
+        The system message and the latest user message are never evicted; if they
+        alone leave no room for the summary, it is dropped. Returns the evicted messages.
+        '''
+        if self._max_prompt_tokens is None:
+            return []
+        budget = self._max_prompt_tokens - reserve
+        evicted = []
+        while self.prompt_tokens > budget and len(self._messages) > 2:
+            # drop a whole turn (user + assistant) where possible
+            evicted.append(self._messages.pop(1))
+            self._message_tokens.pop(1)
+            if len(self._messages) > 2 and self._messages[1]["role"] == "assistant":
+                evicted.append(self._messages.pop(1))
+                self._message_tokens.pop(1)
+        if self._summary and self.prompt_tokens > budget:
+            logger.warning(f"History summary dropped, no room in budget={self._max_prompt_tokens}")
+            self._summary = None
+        return evicted
+
+    def _summary_request(self, evicted):
+        transcript = "\n\n".join(f"{m['role'].upper()}: {m['content']}" for m in evicted)
+        if self._summary:
+            transcript = f"PREVIOUS SUMMARY: {self._summary}\n\n{transcript}"
+        return [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": transcript}
+        ]
+
+    def _fold_into_summary(self, evicted):
+        try:
+            self._summary = self._llm.generate_text(messages=self._summary_request(evicted), model=self._model, temperature=0.0)
+        except Exception as e:
+            logger.error(f"History summary failed, evicted turns dropped: {e}")
+
+    async def _afold_into_summary(self, evicted):
+        try:
+            self._summary = await self._llm.agenerate_text(messages=self._summary_request(evicted), model=self._model, temperature=0.0)
+        except Exception as e:
+            logger.error(f"History summary failed, evicted turns dropped: {e}")
+
+    def _summarize(self, evicted, reserve: int = 0) -> list:
+        '''
+        Fold evicted turns into the summary. The new summary counts against the
+        budget too, so turns it pushes out are folded in as well. Returns every evicted message.
+        '''
+        pending, evicted = evicted, list(evicted)
+        while pending:
+            self._fold_into_summary(pending)
+            pending = self._evict(reserve)
+            evicted += pending
+        return evicted
+
+    async def _asummarize(self, evicted, reserve: int = 0) -> list:
+        pending, evicted = evicted, list(evicted)
+        while pending:
+            await self._afold_into_summary(pending)
+            pending = self._evict(reserve)
+            evicted += pending
+        return evicted
+
+    def _request_messages(self):
+        if not self._summary:
+            return self._messages
+        return [self._messages[0], self._summary_message()] + self._messages[1:]
 
     def record_response(self, assistant_reponse):
         self._add_to_messages("assistant", assistant_reponse)
 
-    def stream_response(self, user_query, ignore_history=False):
+    @staticmethod
+    def _augment_tokens(user_query, augmented) -> int:
+        '''Tokens the retrieved sections add to the question.'''
+        if augmented is None:
+            return 0
+        return count_message_tokens({"role": "user", "content": augmented}) - count_message_tokens({"role": "user", "content": user_query})
+
+    def _start_request(self, user_query, ignore_history, reserve=0):
+        '''Add the user turn and apply the history budget, less reserve. Returns the evicted messages.'''
         self._add_to_messages("user", user_query)
+        return [] if ignore_history else self._evict(reserve)
+
+    def _finish_request(self, user_query, ignore_history, evicted, augmented=None):
+        '''Build the request messages and record last_request (after any summary fold).'''
         if not ignore_history:
-            messages = self._messages
+            messages = self._request_messages()
         else:
             messages = self.system_prompt + [{"role": "user", "content": user_query}]
+        evicted = len(evicted)
+        prompt_tokens = sum(count_message_tokens(m) for m in messages) if ignore_history else self.prompt_tokens
+        if augmented is not None:
+            # the outgoing question carries the sections; the history keeps the plain question
+            prompt_tokens += self._augment_tokens(user_query, augmented)
+            messages = messages[:-1] + [{"role": "user", "content": augmented}]
+
+        self._last_request = self._request_info(prompt_tokens, len(messages), evicted)
+        logger.info(f"LLM request: prompt_tokens={self._last_request['prompt_tokens']}, messages={len(messages)}, evicted={evicted}, budget={self._max_prompt_tokens}")
+        return messages
+
+    def _cache_lookup(self, user_query, ignore_history):
+        '''
+        The cache's answer if this is a first-turn question (no prior history) and it has one.
+        With an embedder this encodes the question, so the async path runs it on a worker thread.
+        '''
+        if self._response_cache is None or not self._first_turn(ignore_history):
+            return None
+        mode, context = self.cache_scope
+        return self._response_cache.get(mode, context, self._cache_key_prompt(), user_query)
+
+    def _cached_response(self, user_query, ignore_history, cached):
+        '''Record a request served from the cache and return its text; None on a miss.'''
+        if cached is None:
+            return None
+        mode, context = self.cache_scope
+        self._start_request(user_query, ignore_history)
+        self._last_request = self._request_info(0, 0, 0, model=f"cache/{cached.model}")
+        logger.info(f"LLM request served from cache: context={context}, similarity={cached.similarity:.3f}")
+        return cached.text
+
+    def _first_turn(self, ignore_history):
+        return ignore_history or (len(self._messages) == 1 and not self._summary)
+
+    def _cache_response(self, user_query, first_turn, completion):
+        if self._response_cache is not None and first_turn:
+            mode, context = self.cache_scope
+            self._response_cache.put(mode, context, self._cache_key_prompt(), user_query, "".join(completion), self._last_request["model"])
+
+    @staticmethod
+    def _replay(text):
+        # word-sized chunks, so a cached answer streams like a live one (only faster)
+        return re.findall(r"\S+\s*|\s+", text)
+
+    def _record_completion(self, completion, started, first_token_at):
+        '''After a finished stream: which backend answered, its reported token usage and the time to first token.'''
+        # RoutingLLM (llm/routingllm.py) reports which backend served the request
+        route = getattr(self._llm, "last_route", None)
+        if route:
+            self._last_request["model"] = route
+        usage = self._llm.last_usage or {}
+        if usage.get("prompt_tokens") is not None:
+            self._last_request["prompt_tokens"] = usage["prompt_tokens"]
+        completion_tokens = usage.get("completion_tokens")
+        self._last_request["completion_tokens"] = completion_tokens if completion_tokens is not None else count_tokens("".join(completion))
+        self._last_request["cached_tokens"] = usage.get("cached_tokens")
+        self._last_request["ttft_ms"] = round((first_token_at - started) * 1000, 1) if first_token_at else None
+        logger.info(f"LLM response: model={self._last_request['model']}, prompt_tokens={self._last_request['prompt_tokens']}, "
+                    f"cached_tokens={self._last_request['cached_tokens']}, completion_tokens={self._last_request['completion_tokens']}, "
+                    f"ttft_ms={self._last_request['ttft_ms']}")
+
+    def _used_tokens(self, completion):
+        # reported counts once the stream has finished, estimates if it was cut short
+        completion_tokens = self._last_request["completion_tokens"]
+        return self._last_request["prompt_tokens"] + (completion_tokens if completion_tokens is not None else count_tokens("".join(completion)))
+
+    def _retrieve(self, user_query, ignore_history):
+        '''
+        The question with the relevant assignment sections, or None without a retriever
+        (or if retrieval fails). The earlier questions go into the search too, so a
+        follow-up finds what the previous answer was based on. This blocks (index
+        builds, query encoding), so the async path runs it on a worker thread.
+        '''
+        if self.retriever is None:
+            return None
+        earlier = [] if ignore_history else [m["content"] for m in self._messages if m["role"] == "user"]
+        try:
+            return self.retriever.augment(user_query, earlier)
+        except Exception as e:
+            logger.error(f"Retrieval failed, sending the question alone: {e}")
+            return None
+
+    def _cache_key_prompt(self):
+        # with retrieval the system prompt no longer contains the document, so its version is added
+        system_prompt = self.system_prompt[0]["content"]
+        return system_prompt if self.retriever is None else f"{system_prompt}\n{self.retriever.version}"
+
+    def stream_response(self, user_query, ignore_history=False, on_queue: Callable[[int], None]|None=None):
+        '''
+        Stream the assistant's reply. on_queue is called on the caller's thread with
+        the place in line while the scheduler holds the request, and with 0 when it starts.
+        First-turn questions are answered from the response cache when it has them.
+        '''
+        cached = self._cached_response(user_query, ignore_history, self._cache_lookup(user_query, ignore_history))
+        if cached is not None:
+            yield from self._replay(cached)
+            return
+        if self._use_async:
+            # sync adapter: the request runs on the shared event loop, chunks are handed back here
+            for item in iterate_sync(self._astream(user_query, ignore_history)):
+                if isinstance(item, QueuePosition):
+                    if on_queue:
+                        on_queue(item.position)
+                else:
+                    yield item
+            return
+
+        first_turn = self._first_turn(ignore_history)
+        augmented = self._retrieve(user_query, ignore_history)
+        reserve = self._augment_tokens(user_query, augmented)
+        evicted = self._start_request(user_query, ignore_history, reserve)
+        if self._summarize_evicted:
+            evicted = self._summarize(evicted, reserve)
+        messages = self._finish_request(user_query, ignore_history, evicted, augmented)
+
+        ticket = None
+        if self._scheduler is not None:
+            ticket = run_sync(self._scheduler.acquire(self._user_id, self._last_request["prompt_tokens"]))
+        completion = []
+        try:
+            started, first_token_at = time.perf_counter(), None
+            response = self._llm.generate_stream(
+                messages=messages,
+                model=self._model,
+                temperature=self._temperature
+            )
+            for chunk in response:
+                if first_token_at is None and chunk:
+                    first_token_at = time.perf_counter()
+                completion.append(chunk)
+                yield chunk
+            self._record_completion(completion, started, first_token_at)
+            self._cache_response(user_query, first_turn, completion)
+        finally:
+            if ticket is not None:
+                self._scheduler.release_threadsafe(ticket, self._used_tokens(completion))
+
+    async def astream_response(self, user_query, ignore_history=False, on_queue: Callable[[int], None]|None=None):
+        '''Async counterpart of stream_response; many of these can share one event loop.'''
+        # off the event loop, like retrieval: the cache lock and an embedder would stall every session's stream
+        lookup = await asyncio.to_thread(self._cache_lookup, user_query, ignore_history) if self._response_cache is not None else None
+        cached = self._cached_response(user_query, ignore_history, lookup)
+        if cached is not None:
+            for chunk in self._replay(cached):
+                yield chunk
+            return
+        async for item in self._astream(user_query, ignore_history):
+            if isinstance(item, QueuePosition):
+                if on_queue:
+                    on_queue(item.position)
+            else:
+                yield item
+
+    async def _astream(self, user_query, ignore_history):
+        '''Response chunks, preceded by QueuePosition updates while waiting for the scheduler.'''
+        first_turn = self._first_turn(ignore_history)
+        # off the event loop: it is shared by every session's stream
+        augmented = await asyncio.to_thread(self._retrieve, user_query, ignore_history) if self.retriever is not None else None
+        reserve = self._augment_tokens(user_query, augmented)
+        evicted = self._start_request(user_query, ignore_history, reserve)
+        if self._summarize_evicted:
+            evicted = await self._asummarize(evicted, reserve)
+        messages = self._finish_request(user_query, ignore_history, evicted, augmented)
+
+        ticket = None
+        if self._scheduler is not None:
+            ticket = self._scheduler.enqueue(self._user_id, self._last_request["prompt_tokens"])
+            async for position in self._scheduler.wait(ticket):
+                yield QueuePosition(position)
+        completion = []
+        try:
+            if ticket is not None:
+                yield QueuePosition(0)
+            started, first_token_at = time.perf_counter(), None
+            async for chunk in self._llm.agenerate_stream(
+                messages=messages,
+                model=self._model,
+                temperature=self._temperature
+            ):
+                if first_token_at is None and chunk:
+                    first_token_at = time.perf_counter()
+                completion.append(chunk)
+                yield chunk
+            self._record_completion(completion, started, first_token_at)
+            if self._response_cache is not None:
+                await asyncio.to_thread(self._cache_response, user_query, first_turn, completion)
+        finally:
+            if ticket is not None:
+                self._scheduler.release(ticket, self._used_tokens(completion))
 
-        response = self._llm.generate_stream(
-            messages=messages,
-            model=self._model,
-            temperature=self._temperature
-        )
-        for chunk in response:
-            yield chunk 
-          
 
 if __name__ == '__main__':
     import os
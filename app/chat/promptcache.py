@@ -0,0 +1,85 @@
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+from loguru import logger
+
+import constants as const
+from docloader import FileCacheDocLoader
+from llm.tokens import count_tokens
+
+
+class SystemPrompt(NamedTuple):
+    text: str
+    tokens: int
+
+
+class SystemPromptCache:
+    '''
+    Rendered system prompts shared by every session in the process.
+
+    Entries are keyed on (mode, context, base prompt text, document version),
+    so editing a prompt in Settings or regenerating an assignment file simply
+    produces a new key; old versions age out of the LRU.
+
+    The mode prompt comes first and the assignment content after it, with no
+    per-user text, so every student in the same (mode, context) sends a
+    byte-identical prefix and the provider's automatic prompt caching can reuse it.
+    '''
+
+    def __init__(self, max_entries: int = 256):
+        self._max_entries = max_entries
+        self._prompts: "OrderedDict[tuple, SystemPrompt]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, mode: str, context: str, base_prompt: str, loader: FileCacheDocLoader, full_document: bool = True) -> SystemPrompt:
+        """
+        Return the full system prompt for mode/context, building it on first use.
+        With full_document=False the assignment is only named; its relevant
+        sections are sent with each question (chat/ragapi.py).
+
+        Raises:
+            FileNotFoundError: If the assignment document doesn't exist
+        """
+        doc_version = loader.document_version(context) if context != "General Python" else None
+        key = (mode, context, base_prompt, doc_version, full_document)
+        with self._lock:
+            prompt = self._prompts.get(key)
+            if prompt is not None:
+                self._prompts.move_to_end(key)
+                return prompt
+
+        prompt = self._render(context, base_prompt, loader, full_document)
+        with self._lock:
+            self._prompts[key] = prompt
+            self._prompts.move_to_end(key)
+            while len(self._prompts) > self._max_entries:
+                self._prompts.popitem(last=False)
+        logger.info(f"System prompt built: mode={mode}, context={context}, chars={len(prompt.text)}, tokens={prompt.tokens}")
+        return prompt
+
+    def _render(self, context: str, base_prompt: str, loader: FileCacheDocLoader, full_document: bool) -> SystemPrompt:
+        if context == "General Python":
+            text = base_prompt
+        elif not full_document:
+            context_injection = const.CONTEXT_RETRIEVAL_PROMPT_TEMPLATE.format(assignment=context)
+            text = base_prompt.rstrip() + "\n\n" + context_injection.strip()
+        else:
+            content = loader.load_cached_document(context)
+            context_injection = const.CONTEXT_PROMPT_TEMPLATE.format(
+                assignment=context,
+                content=content
+            )
+            text = base_prompt.rstrip() + "\n\n" + context_injection.strip()
+        return SystemPrompt(text=text, tokens=count_tokens(text))
+
+    def clear(self):
+        with self._lock:
+            self._prompts.clear()
+
+    def __len__(self):
+        return len(self._prompts)
+
+
+# Shared by every session in the process
+system_prompts = SystemPromptCache()
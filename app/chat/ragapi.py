@@ -1,92 +1,172 @@
-# from loguru import logger
-
-# import chromadb
-# from chromadb.config import Settings
-# from huggingface_hub import login
-
-# from langchain_chroma import Chroma
-# from langchain_huggingface import HuggingFaceEmbeddings
-
-# class RAGAPI:
-#     def __init__(
-#             self,
-#             huggingface_token: str,
-#             huggingface_embedding_model: str,
-#             chroma_host: str,
-#             chroma_port: str,
-#             chroma_auth_token: str,
-#             collection_name: str
-#         ):
-#         login(token=huggingface_token)
-#         self._embeddings = HuggingFaceEmbeddings(model_name=huggingface_embedding_model)
-#         self._client = chromadb.HttpClient(
-#             host=chroma_host,
-#             port=chroma_port,
-#             settings=Settings(
-#                 chroma_client_auth_provider="chromadb.auth.token_authn.TokenAuthClientProvider",
-#                 chroma_client_auth_credentials=chroma_auth_token
-#             )    
-#         ) 
-#         self._client.heartbeat()
-#         self._vectorstore = Chroma(
-#             client=self._client,
-#             collection_name=collection_name,
-#             embedding_function=self._embeddings
-#         )
-#         logger.info(f"rag initialized chroma={chroma_host}:{chroma_port}, collection={collection_name}, embedding={huggingface_embedding_model}")
-
-#     def search(
-#             self, 
-#             query: str, 
-#             restrict_to_file: str|None = None, 
-#             n_results: int = 5, 
-#             threshold: float = 0.5
-#         ):
-#         if restrict_to_file:
-#             filter = {"source": { "$eq": restrict_to_file }}
-#             retriever = self._vectorstore.as_retriever(search_kwargs={"filter": filter})
-#         else:
-#             retriever = self._vectorstore.as_retriever()
-
-#         results = retriever.vectorstore.similarity_search_with_relevance_scores(query, k=n_results, score_threshold=threshold)
-#         logger.info(f"rag search returned count={len(results)}, min={min([score for doc, score in results])}, max={max([score for doc, score in results])}")
-#         return results
-
-
-#     def inject_prompt(
-#             self, 
-#             query: str,
-#             rag_template: str, 
-#             results: list
-#         ):
-
-#         if len(results) > 0:
-#             documents = "\n\n".join([doc.page_content for doc, score in results])    
-#             # add the documents to the prompt
-#             final_prompt = rag_template.format(documents=documents, query=query)
-#         else: # rag is no help
-#             final_prompt = query # rag is no help
-#         return final_prompt
-
-
-# if __name__ == '__main__':
-#     from time import sleep
-#     import os
-#     from constants import RAG_PROMPT_TEMPLATE
-#     rag = RAGAPI(
-#         huggingface_token=os.environ["HUGGINGFACE_TOKEN"],
-#         huggingface_embedding_model="hkunlp/instructor-base",
-#         chroma_host=os.environ['CHROMADB_HOST'],
-#         chroma_port=os.environ['CHROMADB_PORT'],
-#         chroma_auth_token=os.environ['CHROMA_CLIENT_AUTH_TOKEN'],
-#         collection_name="ist256"
-#     )
-#     query = "What is the purpose of the for loop?"
-#     docs = rag.search(query, n_results=3)
-#     prompt = rag.inject_prompt(query, RAG_PROMPT_TEMPLATE, docs)
-#     print(prompt)
-#     sleep(2)
-#     query = "What is the difference between a for and a while loop?"
-#     docs = rag.search(query, n_results=3)
-#     prompt = rag.inject_prompt(query, RAG_PROMPT_TEMPLATE, docs)
-#     print(prompt)
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+import constants as const
+from docloader import FileCacheDocLoader
+from rag.engine import RetrievalEngine, SearchResult
+from rag.indexfile import IndexArtifact, get_index_watcher
+
+
+class RAGAPI:
+    '''
+    Retrieval over the assignment documents (rag/engine.py), shared by every
+    session in the process.
+
+    With index_dir, the chunks and embeddings come from the index artifact the
+    ETL publishes there (rag/indexfile.py), memory-mapped and swapped for a new
+    version when one is published. Otherwise (or until one is published) the
+    documents in the file cache are chunked here and the index is rebuilt when
+    a document is added, removed or changed. A document the artifact doesn't
+    have, or that changed in the file cache after the artifact was published,
+    is indexed from the file cache on its own until the next ETL run.
+    '''
+
+    def __init__(
+            self,
+            loader: FileCacheDocLoader,
+            encoder: Optional[Callable] = None,
+            max_chars: int = 3000,
+            index_dir: str | None = None,
+            encoder_model: str = ""
+        ):
+        self._loader = loader
+        self._encoder = encoder
+        self._encoder_model = encoder_model
+        self._max_chars = max_chars
+        self._watcher = get_index_watcher(index_dir) if index_dir else None
+        self._engine: RetrievalEngine | None = None
+        self._versions: Tuple = ()
+        # source -> (file cache version, engine) for documents the artifact can't serve
+        self._source_engines: Dict[str, Tuple[Tuple, RetrievalEngine]] = {}
+        self._lock = threading.Lock()
+
+    def _artifact(self) -> IndexArtifact | None:
+        return self._watcher.current() if self._watcher is not None else None
+
+    def _serves(self, artifact: IndexArtifact, source: str) -> bool:
+        '''Whether the artifact has source as it is in the file cache (not missing, not older).'''
+        try:
+            mtime_ns, _ = self._loader.document_version(source)
+        except FileNotFoundError:
+            # nothing better in the file cache
+            return True
+        return source in artifact.sources and mtime_ns <= artifact.created_ns
+
+    def document_version(self, source: str):
+        artifact = self._artifact()
+        if artifact is not None and self._serves(artifact, source):
+            return artifact.version
+        return self._loader.document_version(source)
+
+    def _artifact_engine(self, artifact: IndexArtifact) -> RetrievalEngine:
+        with self._lock:
+            if self._engine is None or self._versions != ("artifact", artifact.version):
+                encoder = self._encoder
+                if encoder is not None and artifact.model and self._encoder_model != artifact.model:
+                    logger.warning(f"Index embedded with {artifact.model}, queries with {self._encoder_model}: using BM25 only")
+                    encoder = None
+                # persisted BM25 and lazily decoded texts: nothing is rebuilt per process
+                self._engine = RetrievalEngine(artifact.chunks, artifact.embeddings, encoder,
+                                               bm25=artifact.bm25, sources=artifact.chunks.sources)
+                self._versions = ("artifact", artifact.version)
+                # the new version may have the documents that were indexed on their own
+                self._source_engines.clear()
+                logger.info(f"Retrieval engine using index version={artifact.version}")
+            return self._engine
+
+    def _source_engine(self, source: str) -> RetrievalEngine:
+        '''An engine over just source, chunked from the file cache; rebuilt when the document changes.'''
+        version = self._loader.document_version(source)
+        cached = self._source_engines.get(source)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        with self._lock:
+            cached = self._source_engines.get(source)
+            if cached is None or cached[0] != version:
+                logger.warning(f"Document missing from (or newer than) the retrieval index, indexing it from the file cache: source={source}")
+                engine = RetrievalEngine.from_documents({source: self._loader.load_cached_document(source)}, self._encoder, self._max_chars)
+                cached = self._source_engines[source] = (version, engine)
+            return cached[1]
+
+    def engine(self, source: str | None = None) -> RetrievalEngine:
+        '''The engine to search source (or every document) with.'''
+        artifact = self._artifact()
+        if artifact is not None:
+            if source is not None and not self._serves(artifact, source):
+                return self._source_engine(source)
+            if self._engine is not None and self._versions == ("artifact", artifact.version):
+                return self._engine
+            return self._artifact_engine(artifact)
+        versions = tuple((key, self._loader.document_version(key)) for key in self._loader.get_doc_list())
+        if self._engine is not None and versions == self._versions:
+            return self._engine
+        with self._lock:
+            if self._engine is None or versions != self._versions:
+                documents = {key: self._loader.load_cached_document(key) for key, _ in versions}
+                self._engine = RetrievalEngine.from_documents(documents, self._encoder, self._max_chars)
+                self._versions = versions
+            return self._engine
+
+    def search(self, query: str, restrict_to_file: str | None = None, n_results: int = 5, threshold: float = 0.0) -> List[SearchResult]:
+        results = self.engine(restrict_to_file).search(query, k=n_results, source=restrict_to_file, threshold=threshold)
+        logger.info(f"rag search returned count={len(results)}, source={restrict_to_file}, "
+                    f"max={max((r.score for r in results), default=0):.2f}")
+        return results
+
+    def relevant_sections(self, query: str, source: str, n_results: int = 4) -> str:
+        '''
+        The sections of source most relevant to query, in document order. Falls
+        back to the document's opening section when nothing matches.
+        '''
+        results = self.search(query, restrict_to_file=source, n_results=n_results)
+        chunks = sorted((r.chunk for r in results), key=lambda chunk: chunk.start)
+        if not chunks:
+            chunks = self.engine(source).source_chunks(source)[:1]
+        return "\n\n".join(chunk.text.strip() for chunk in chunks)
+
+    def retriever(self, source: str, n_results: int = 4, history_turns: int = 2) -> "ContextRetriever":
+        return ContextRetriever(self, source, n_results, history_turns)
+
+
+class ContextRetriever:
+    '''
+    Bound to one assignment; used by LLMAPI to add the relevant sections to
+    each question it sends (the stored history keeps the plain question).
+    '''
+
+    def __init__(self, rag: RAGAPI, source: str, n_results: int, history_turns: int = 2):
+        self._rag = rag
+        self.source = source
+        self._n_results = n_results
+        self._history_turns = history_turns
+
+    @property
+    def version(self) -> str:
+        '''Changes when the document does; part of the response cache key.'''
+        return f"{self.source}@{self._rag.document_version(self.source)}"
+
+    def search_query(self, query: str, earlier: List[str] = ()) -> str:
+        '''query plus the last history_turns earlier questions, so "can you explain more?" still finds its sections.'''
+        recent = list(earlier)[-self._history_turns:] if self._history_turns > 0 else []
+        return "\n".join(recent + [query])
+
+    def augment(self, query: str, earlier: List[str] = ()) -> str:
+        '''
+        Args:
+            query: the student's question
+            earlier: the student's previous questions in this conversation, oldest first
+        Returns:
+            the question with the relevant sections of the assignment
+        '''
+        sections = self._rag.relevant_sections(self.search_query(query, earlier), self.source, self._n_results)
+        return const.RAG_PROMPT_TEMPLATE.format(assignment=self.source, documents=sections, query=query)
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+    rag = RAGAPI(FileCacheDocLoader(os.environ['LOCAL_FILE_CACHE']))
+    query = sys.argv[1] if len(sys.argv) > 1 else "How do I round up to the nearest can of paint?"
+    print(rag.retriever(sys.argv[2] if len(sys.argv) > 2 else "02-HW-Variables").augment(query))
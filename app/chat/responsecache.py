@@ -0,0 +1,237 @@
+import hashlib
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from loguru import logger
+
+_WORD = re.compile(r"[a-z0-9_]+")
+_NUMBER = re.compile(r"\d+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    '''Lowercase, collapse whitespace and drop trailing punctuation, so trivial variants share a key.'''
+    return re.sub(r"\s+", " ", prompt.lower()).strip().rstrip("?!. ")
+
+
+def prompt_hash(system_prompt: str) -> str:
+    return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:16]
+
+
+class CachedResponse(NamedTuple):
+    text: str
+    model: str
+    similarity: float  # 1.0 for an exact (normalized) match
+
+
+class _Entry:
+    __slots__ = ("text", "model", "created", "vector", "numbers")
+
+    def __init__(self, text: str, model: str, vector: Optional[Dict], numbers: Tuple[str, ...]):
+        self.text = text
+        self.model = model
+        self.created = time.monotonic()
+        self.vector = vector
+        self.numbers = numbers
+
+
+class ResponseCache:
+    '''
+    Answers to first-turn questions (no prior history), shared by every session.
+
+    Entries are keyed on (mode, context, system prompt hash, normalized prompt).
+    Editing a prompt in Settings or regenerating an assignment document changes
+    the system prompt hash, so new sessions get their own entries; sessions that
+    started on the old prompt keep theirs until they age out (TTL or LRU).
+
+    With similarity_threshold > 0, a miss on the exact key falls back to the
+    most similar cached question in the same scope: cosine similarity of TF-IDF
+    vectors (offline, no extra dependencies), or of embedder(text) vectors when
+    an embedder is given (encoded outside the cache lock). Questions that mention
+    different numbers ("question 3" vs "question 4") never match each other.
+
+    Entries expire after ttl_seconds and the least recently used are evicted
+    beyond max_entries.
+    '''
+
+    def __init__(
+            self,
+            max_entries: int = 2048,
+            ttl_seconds: float = 24 * 3600,
+            similarity_threshold: float = 0.0,
+            embedder: Optional[Callable[[str], Sequence[float]]] = None
+        ):
+        self._max_entries = max_entries
+        self._ttl = ttl_seconds
+        self._threshold = similarity_threshold
+        self._embedder = embedder
+        # (mode, context, system prompt hash, normalized prompt) -> entry
+        self._entries: "OrderedDict[tuple, _Entry]" = OrderedDict()
+        # (mode, context, system prompt hash) -> document frequency of each term, for IDF
+        self._df: Dict[tuple, Counter] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "similar_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    # ---- vectors ----
+
+    @staticmethod
+    def _terms(text: str) -> List[str]:
+        return _WORD.findall(text)
+
+    def _embed(self, text: str) -> Optional[Dict]:
+        '''Embedding vector (index -> value), or None without an embedder. Called without the lock held.'''
+        if self._threshold <= 0 or self._embedder is None:
+            return None
+        return dict(enumerate(self._embedder(text)))
+
+    def _vector(self, scope: tuple, text: str, embedded: Optional[Dict]) -> Optional[Dict]:
+        '''The embedding if there is one, else a TF-IDF (term -> weight) vector; None when similarity is off.'''
+        if self._threshold <= 0:
+            return None
+        if embedded is not None:
+            return embedded
+        df = self._df.get(scope, Counter())
+        documents = sum(1 for key in self._entries if key[:3] == scope) + 1
+        tf = Counter(self._terms(text))
+        return {term: count * (math.log((1 + documents) / (1 + df[term])) + 1) for term, count in tf.items()}
+
+    @staticmethod
+    def _cosine(a: Dict, b: Dict) -> float:
+        dot = sum(value * b.get(key, 0.0) for key, value in a.items())
+        norm = math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values()))
+        return dot / norm if norm else 0.0
+
+    # ---- bookkeeping (lock held) ----
+
+    def _drop(self, key: tuple, counter: str):
+        entry = self._entries.pop(key)
+        self._stats[counter] += 1
+        if entry.vector is not None and self._embedder is None:
+            df = self._df.get(key[:3])
+            if df is not None:
+                for term in entry.vector:
+                    df[term] -= 1
+                    if df[term] <= 0:
+                        del df[term]
+                if not df:
+                    # the scope's last entry, e.g. under a system prompt that has since been edited
+                    del self._df[key[:3]]
+
+    def _expired(self, entry: _Entry) -> bool:
+        return self._ttl > 0 and time.monotonic() - entry.created > self._ttl
+
+    # ---- public ----
+
+    def get(self, mode: str, context: str, system_prompt: str, prompt: str) -> Optional[CachedResponse]:
+        sp_hash = prompt_hash(system_prompt)
+        normalized = normalize_prompt(prompt)
+        key = (mode, context, sp_hash, normalized)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                self._drop(key, "expirations")
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return CachedResponse(entry.text, entry.model, 1.0)
+            if self._threshold <= 0:
+                self._stats["misses"] += 1
+                return None
+
+        # outside the lock: an embedding model can take a while, and every session reads this cache
+        embedded = self._embed(normalized)
+        with self._lock:
+            match = self._similar(key[:3], normalized, embedded)
+            if match is None:
+                self._stats["misses"] += 1
+                return None
+            match_key, similarity = match
+            entry = self._entries[match_key]
+            self._entries.move_to_end(match_key)
+            self._stats["similar_hits"] += 1
+        logger.debug(f"Response cache similar hit: context={context}, similarity={similarity:.3f}, cached={match_key[3]!r}, asked={normalized!r}")
+        return CachedResponse(entry.text, entry.model, similarity)
+
+    def _similar(self, scope: tuple, normalized: str, embedded: Optional[Dict]) -> Optional[Tuple[tuple, float]]:
+        vector = self._vector(scope, normalized, embedded)
+        numbers = tuple(_NUMBER.findall(normalized))
+        best, best_similarity = None, self._threshold
+        for key, entry in list(self._entries.items()):
+            if key[:3] != scope or entry.vector is None or entry.numbers != numbers:
+                continue
+            if self._expired(entry):
+                self._drop(key, "expirations")
+                continue
+            similarity = self._cosine(vector, entry.vector)
+            if similarity >= best_similarity:
+                best, best_similarity = key, similarity
+        return (best, best_similarity) if best is not None else None
+
+    def put(self, mode: str, context: str, system_prompt: str, prompt: str, response: str, model: str):
+        if not response.strip():
+            return
+        sp_hash = prompt_hash(system_prompt)
+        normalized = normalize_prompt(prompt)
+        key = (mode, context, sp_hash, normalized)
+        embedded = self._embed(normalized)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key, "evictions")
+            vector = self._vector(key[:3], normalized, embedded)
+            if vector is not None and self._embedder is None:
+                self._df.setdefault(key[:3], Counter()).update(set(vector))
+            self._entries[key] = _Entry(response, model, vector, tuple(_NUMBER.findall(normalized)))
+            self._stats["stores"] += 1
+            while len(self._entries) > self._max_entries:
+                self._drop(next(iter(self._entries)), "evictions")
+
+    def invalidate(self, mode: str | None = None, context: str | None = None) -> int:
+        '''Drop entries for a mode and/or context (all entries when both are None). Returns the number dropped.'''
+        with self._lock:
+            stale = [key for key in self._entries
+                     if (mode is None or key[0] == mode) and (context is None or key[1] == context)]
+            for key in stale:
+                self._drop(key, "invalidations")
+            if mode is None and context is None:
+                self._df.clear()
+        return len(stale)
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["similar_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["similar_hits"]) / lookups if lookups else 0.0
+        stats["similarity_threshold"] = self._threshold
+        return stats
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def load_embedder(model_name: str) -> Optional[Callable[[str], Sequence[float]]]:
+    '''A local sentence-transformers model as an embedder, or None (TF-IDF) if it isn't installed.'''
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        logger.warning(f"sentence-transformers not installed, response cache uses TF-IDF instead of {model_name}")
+        return None
+    model = SentenceTransformer(model_name)
+    return lambda text: model.encode(text, normalize_embeddings=True).tolist()
+
+
+if __name__ == '__main__':
+    cache = ResponseCache(similarity_threshold=0.6)
+    system_prompt = "You are a tutor for HW-03."
+    cache.put("Tutor", "HW-03", system_prompt, "What does question 3 want?", "Question 3 asks you to...", "gpt-4o-mini")
+    for prompt in ["what does question 3 want", "What does question 3 want me to do?", "What does question 4 want?"]:
+        print(prompt, "->", cache.get("Tutor", "HW-03", system_prompt, prompt))
+    # an edited prompt gets its own entries; the old ones stay for sessions still using it
+    print(cache.get("Tutor", "HW-03", system_prompt + " (edited)", "What does question 3 want?"))
+    print(cache.get("Tutor", "HW-03", system_prompt, "What does question 3 want?"))
+    print(cache.stats)
@@ -1,6 +1,11 @@
 import os
 import streamlit as st
-from dal.s3 import get_roster
+from dal.s3 import S3Client
+from llm.clients import client_stats
+from llm.resilience import circuit_stats
+from llm.routingllm import routing_stats
+from llm.scheduler import scheduler_stats
+from authorization import get_authorization_index
 
 
 def show_session():
@@ -10,24 +15,20 @@ def show_session():
     # Permission Information Section
     st.header("👥 User Permissions")
 
-    # Load permission lists
-    admin_users = [user.lower().strip() for user in os.environ.get("ADMIN_USERS", "").split(",") if user.strip()]
-    exception_users = [user.lower().strip() for user in os.environ.get("ROSTER_EXCEPTION_USERS", "").split(",") if user.strip()]
-
     # Get whitelist filename from config
     whitelist_file = st.session_state.config.whitelist if st.session_state.config.whitelist else "whitelist.txt"
 
     try:
-        whitelist_users = [user.lower().strip() for user in get_roster(
-            os.environ["S3_HOST"],
-            os.environ["S3_ACCESS_KEY"],
-            os.environ["S3_SECRET_KEY"],
-            os.environ["S3_BUCKET"],
-            whitelist_file
-        ) if user.strip()]
+        whitelist = st.session_state.s3_client.get_whitelist(os.environ["S3_BUCKET"], whitelist_file)
     except Exception as e:
         st.error(f"Failed to load whitelist: {e}")
-        whitelist_users = []
+        whitelist = ()
+
+    # Load permission lists (same shared index used for login authorization)
+    index = get_authorization_index(whitelist)
+    admin_users = index.admin_users
+    exception_users = index.exception_users
+    whitelist_users = index.whitelist_users
 
     # Display current user's permission level
     if 'auth_model' in st.session_state:
@@ -88,6 +89,100 @@ def show_session():
         **Note:** Admin users have full access including admin pages. Exception and Whitelist users have chat access only.
         """)
 
+    # Database Pool Section
+    st.header("🗄️ Database Connection Pool")
+    if 'db' in st.session_state:
+        pool_stats = st.session_state.db.pool_stats()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Checked Out", f"{pool_stats['checked_out']} / {pool_stats['pool_size']}")
+        col2.metric("Overflow", pool_stats["overflow"])
+        col3.metric("Avg Wait (ms)", f"{pool_stats.get('avg_wait_ms', 0.0):.1f}")
+        col4.metric("Max Wait (ms)", f"{pool_stats.get('max_wait_ms', 0.0):.1f}")
+        with st.expander("All pool counters", expanded=False):
+            st.json(pool_stats)
+    else:
+        st.info("Database not initialized in this session.")
+
+    # S3 Cache Section
+    with st.expander("🗃️ S3 Config/Whitelist Cache", expanded=False):
+        st.json(S3Client.cache_stats())
+
+    # LLM HTTP Clients Section
+    st.header("🔌 LLM HTTP Connections")
+    llm_pools = client_stats()
+    if llm_pools:
+        for pool in llm_pools:
+            st.markdown(f"**{pool['pool']}**")
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Requests", pool["requests"])
+            col2.metric("New Connections", pool["new_connections"])
+            col3.metric("Reuse Ratio", f"{pool['reuse_ratio']:.0%}")
+            col4.metric("HTTP Versions", ", ".join(pool["http_versions"]) or "-")
+        with st.expander("All connection counters", expanded=False):
+            st.json(llm_pools)
+    else:
+        st.info("No shared LLM clients have been created in this process yet.")
+
+    # LLM Scheduler Section
+    st.header("🚦 LLM Request Queue")
+    queue_stats = scheduler_stats()
+    if queue_stats:
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("In Flight", f"{queue_stats['active']} / {queue_stats['max_concurrency']}")
+        col2.metric("Waiting", f"{queue_stats['waiting']} ({queue_stats['waiting_users']} users)")
+        col3.metric("Avg Wait (ms)", f"{queue_stats['avg_wait_ms']:.0f}")
+        col4.metric("p95 Wait (ms)", f"{queue_stats['p95_wait_ms']:.0f}")
+        with st.expander("All queue counters", expanded=False):
+            st.json(queue_stats)
+    else:
+        st.info("LLM scheduler not started in this process yet.")
+    for breaker in circuit_stats():
+        st.markdown(f"**Circuit `{breaker['name']}`:** {breaker['state']} "
+                    f"(consecutive failures: {breaker['consecutive_failures']}, opened: {breaker['opened']}, rejected: {breaker['rejected']})")
+
+    # LLM Routing Section
+    routes = routing_stats()
+    if routes:
+        st.header("🧭 LLM Routing")
+        for route in routes:
+            latency = f"{route['latency_ms']:.0f} ms" if route['latency_ms'] is not None else "n/a"
+            st.markdown(f"**Backend `{route['name']}`:** {'healthy' if route['healthy'] else 'unhealthy'}, latency {latency} "
+                        f"(requests: {route['requests']}, failures: {route['failures']}, failovers: {route['failovers_from']})")
+        with st.expander("All routing counters", expanded=False):
+            st.json(routes)
+
+    # Response Cache Section
+    st.header("💾 Response Cache")
+    if 'response_cache' in st.session_state:
+        stats = st.session_state.response_cache.stats
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Hit Rate", f"{stats['hit_rate']:.1%}")
+        col2.metric("Hits (similar)", f"{stats['hits'] + stats['similar_hits']} ({stats['similar_hits']})")
+        col3.metric("Misses", stats["misses"])
+        col4.metric("Entries", stats["entries"])
+        with st.expander("All response cache counters", expanded=False):
+            st.json(stats)
+    else:
+        st.info("The response cache is disabled (RESPONSE_CACHE=false).")
+
+    # Chat Log Writer Section
+    st.header("📈 Chat Log Writer")
+    if 'chat_log_writer' in st.session_state:
+        stats = st.session_state.chat_log_writer.stats
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Queue Depth", f"{stats['queue_depth']} / {stats['queue_capacity']}")
+        col2.metric("Rows Written", stats["written"])
+        col3.metric("Avg Flush (ms)", f"{stats['avg_flush_ms']:.1f}")
+        col4.metric("Max Flush (ms)", f"{stats['max_flush_ms']:.1f}")
+        if stats["spilled"] > stats["replayed"]:
+            st.warning(f"{stats['spilled'] - stats['replayed']} log rows could not be written and are waiting on disk to be retried.")
+        if stats["dropped"]:
+            st.error(f"{stats['dropped']} log rows were dropped.")
+        with st.expander("All writer counters", expanded=False):
+            st.json(stats)
+    else:
+        st.info("Write-behind logging is disabled (CHATLOG_WRITE_BEHIND=false); logs are written synchronously.")
+
     # Session State Section
     st.header("🔍 Session State Variables")
     st.markdown("**Current Streamlit session state:**")
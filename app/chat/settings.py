@@ -39,12 +39,49 @@ def show_settings():
         value=float(config.temperature),
         step=0.05
     )
+    max_prompt_tokens = st.number_input(
+        "Max Prompt Tokens",
+        min_value=0,
+        value=int(config.max_prompt_tokens),
+        step=1000,
+        help="Token budget per request (system prompt + history). Oldest turns are dropped when exceeded. 0 = no limit."
+    )
+    summarize_history = st.checkbox(
+        "Summarize dropped history",
+        value=config.summarize_history,
+        help="Fold dropped turns into a short rolling summary (costs an extra AI call when turns are dropped)"
+    )
     whitelist = st.selectbox(
         "Whitelist File",
         options=whitelist_files,
         index=whitelist_files.index(config.whitelist) if config.whitelist in whitelist_files else 0
     )
 
+    # Resilience Section
+    with st.expander("Retry & Circuit Breaker", expanded=False):
+        col1, col2, col3 = st.columns(3)
+        retry_max_attempts = col1.number_input(
+            "Max Attempts", min_value=1, max_value=10, value=int(config.retry_max_attempts),
+            help="Attempts per AI call for timeouts, 429s and 5xx errors. A stream is never retried once text has been shown."
+        )
+        retry_base_delay = col2.number_input(
+            "Base Delay (s)", min_value=0.0, value=float(config.retry_base_delay), step=0.1,
+            help="Smallest backoff between attempts (randomized, grows with each retry)"
+        )
+        retry_max_delay = col3.number_input(
+            "Max Delay (s)", min_value=0.0, value=float(config.retry_max_delay), step=1.0,
+            help="Longest single backoff, including waits requested by Retry-After"
+        )
+        col1, col2 = st.columns(2)
+        circuit_failure_threshold = col1.number_input(
+            "Circuit Failure Threshold", min_value=0, value=int(config.circuit_failure_threshold),
+            help="Consecutive failed calls that stop all AI calls for a while. 0 = never."
+        )
+        circuit_reset_seconds = col2.number_input(
+            "Circuit Reset (s)", min_value=1.0, value=float(config.circuit_reset_seconds), step=5.0,
+            help="How long calls fail fast before a trial call is let through"
+        )
+
     # System Prompts Section
     st.header("System Prompts")
     st.markdown("Configure the AI's behavior in each mode.")
@@ -69,6 +106,13 @@ def show_settings():
         config.ai_model = ai_model
         config.temperature = temperature
         config.whitelist = whitelist
+        config.max_prompt_tokens = int(max_prompt_tokens)
+        config.summarize_history = summarize_history
+        config.retry_max_attempts = int(retry_max_attempts)
+        config.retry_base_delay = float(retry_base_delay)
+        config.retry_max_delay = float(retry_max_delay)
+        config.circuit_failure_threshold = int(circuit_failure_threshold)
+        config.circuit_reset_seconds = float(circuit_reset_seconds)
         config.tutor_prompt = tutor_prompt
         config.answer_prompt = answer_prompt
 
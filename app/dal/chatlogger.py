@@ -1,14 +1,45 @@
+import atexit
+import glob
+import json
+import os
+import queue
+import re
+import threading
+import time
+import uuid
 from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from loguru import logger
+from sqlalchemy import insert
+
 from dal.models import LogModel
 
+# chatlog-spill-<owner pid>.jsonl, and .replay-<claimer pid>-<id> while a writer is inserting it
+_SPILL_FILE = re.compile(r"chatlog-spill-(\d+)\.jsonl(?:\.replay-(\d+)-\w+)?$")
+
+# Bumped every time a row is logged for a user in this process; lets callers
+# cache per-user views of the logs (e.g. the "all chats" download) until new rows arrive
+_user_log_generations: Dict[str, int] = {}
+_user_log_generations_lock = threading.Lock()
+
+def user_log_generation(userid: str) -> int:
+    return _user_log_generations.get(userid, 0)
+
+def _bump_user_log_generation(userid: str):
+    with _user_log_generations_lock:
+        _user_log_generations[userid] = _user_log_generations.get(userid, 0) + 1
+
+
 class ChatLogger:
 
-    def __init__(self, db, model:str, rag:bool):
+    def __init__(self, db, model:str, rag:bool, writer: Optional["ChatLogWriter"]=None):
         self.__db = db
         self.__model = model
         self.__rag = rag
+        self.__writer = writer
 
-    def log(self, sessionid, userid, timestamp, model, rag, context, role, content):
+    def log(self, sessionid, userid, timestamp, model, rag, context, role, content, usage: Optional[dict]=None):
         lm = LogModel(
             sessionid=sessionid,
             userid=userid,
@@ -17,28 +48,294 @@ class ChatLogger:
             context=context,
             timestamp=timestamp,
             role=role,
-            content=content
-        )                         
+            content=content,
+            **(usage or {})
+        )
+        _bump_user_log_generation(userid)
+        if self.__writer is not None:
+            # write-behind: the row is inserted later by the writer's worker thread
+            return self.__writer.enqueue(lm)
         with self.__db.get_session() as session:
             session.add(lm)
             result = session.commit()
         return result
-    
+
     def log_user_prompt(self, sessionid, userid, context, prompt):
         return self.log(sessionid, userid, timestamp(), self.__model, self.__rag, context, "user", prompt)
-       
-    def log_assistant_response(self, sessionid, userid, context, response):
-        return self.log(sessionid, userid, timestamp(), self.__model, self.__rag, context, "assistant", response)
-    
+
+    def log_assistant_response(self, sessionid, userid, context, response, model=None, usage=None):
+        # model: the backend/model that actually answered, when it differs from the configured one (routing)
+        # usage: prompt_tokens, completion_tokens, cached_tokens, ttft_ms (LLMAPI.last_usage)
+        return self.log(sessionid, userid, timestamp(), model or self.__model, self.__rag, context, "assistant", response, usage)
+
     def log_system_prompt(self, appid, userid, system_prompt):
         return self.log(appid, userid, timestamp(), self.__model, self.__rag, "N/A", "system", system_prompt)
 
+
+class ChatLogWriter:
+    '''
+    Write-behind queue for LogModel rows. Rows are put on a bounded in-process
+    queue and a background worker inserts them in batches (one multi-row INSERT
+    per flush). A flush happens when batch_size rows are waiting or when
+    flush_interval seconds have passed since the first waiting row.
+
+    When the queue is full, enqueue() blocks for up to enqueue_timeout seconds,
+    then falls back to a synchronous insert on the caller's thread, so rows are
+    never dropped because of backpressure. Rows logged after close() are also
+    written synchronously.
+
+    A batch that still fails after max_retries attempts is appended to a JSONL
+    file in spill_dir and re-inserted after the next successful flush (and when
+    the next writer starts), so a database outage doesn't lose chat logs.
+    Without a spill_dir such rows are counted as dropped. Each process replays
+    its own spill file; files left by processes that have exited (including
+    half-finished replays) are picked up by whichever writer gets to them first.
+    The replayed stat counts this process's own rows, recovered the others'.
+    '''
+
+    _STOP = object()
+
+    def __init__(
+            self,
+            db,
+            batch_size: int = 100,
+            flush_interval: float = 1.0,
+            max_queue_size: int = 10000,
+            enqueue_timeout: float = 2.0,
+            max_retries: int = 3,
+            spill_dir: str | None = None
+        ):
+        self.__db = db
+        self._spill_dir = spill_dir
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._enqueue_timeout = enqueue_timeout
+        self._max_retries = max_retries
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "written": 0,
+            "dropped": 0,
+            "spilled": 0,
+            "replayed": 0,
+            "recovered": 0,
+            "sync_fallbacks": 0,
+            "flushes": 0,
+            "flush_errors": 0,
+            "last_flush_rows": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+        self._closed = False
+        # enqueue() and close() hold this while checking _closed / queueing, so no
+        # row can land in the queue behind _STOP, where the worker would never see it
+        self._close_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="chatlog-writer", daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+        logger.info(f"ChatLogWriter started batch_size={batch_size}, flush_interval={flush_interval}, max_queue_size={max_queue_size}")
+
+    def enqueue(self, log: LogModel):
+        deadline = time.monotonic() + self._enqueue_timeout
+        while True:
+            with self._close_lock:
+                if self._closed:
+                    break
+                try:
+                    self._queue.put_nowait(log)
+                    self._bump("enqueued")
+                    return None
+                except queue.Full:
+                    pass
+            if time.monotonic() >= deadline:
+                logger.warning(f"ChatLogWriter queue full (size={self._queue.qsize()}), writing synchronously")
+                self._bump("sync_fallbacks")
+                break
+            time.sleep(0.01)
+        self._write_sync(log)
+        return None
+
+    def flush(self, timeout: float|None = None):
+        '''Block until every row enqueued so far has been written (or dropped).'''
+        if timeout is None:
+            self._queue.join()
+            return
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def close(self, timeout: float = 10.0):
+        '''Flush outstanding rows and stop the worker. Safe to call more than once.'''
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            # put() rather than put_nowait(): the worker is draining, so room frees up
+            self._queue.put(self._STOP)
+        self._worker.join(timeout)
+        if self._worker.is_alive():
+            logger.error(f"ChatLogWriter did not stop within {timeout}s, pending={self._queue.qsize()}")
+        else:
+            logger.info(f"ChatLogWriter stopped, stats={self.stats}")
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["queue_capacity"] = self._queue.maxsize
+        stats["avg_flush_ms"] = stats["total_flush_ms"] / stats["flushes"] if stats["flushes"] else 0.0
+        return stats
+
+    def _bump(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def _run(self):
+        self._replay_spilled()
+        batch: List[LogModel] = []
+        deadline = None
+        stopping = False
+        while not stopping:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+                if item is self._STOP:
+                    self._queue.task_done()
+                    stopping = True
+                else:
+                    batch.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self._flush_interval
+            except queue.Empty:
+                pass
+
+            if batch and (stopping or len(batch) >= self._batch_size or time.monotonic() >= deadline):
+                self._flush_batch(batch)
+                for _ in batch:
+                    self._queue.task_done()
+                batch = []
+                deadline = None
+
+    def _flush_batch(self, batch: List[LogModel]):
+        rows = [log.model_dump(exclude={"id"}) for log in batch]
+        for attempt in range(1, self._max_retries + 1):
+            start = time.perf_counter()
+            try:
+                with self.__db.get_session() as session:
+                    session.execute(insert(LogModel), rows)
+                    session.commit()
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                with self._stats_lock:
+                    self._stats["written"] += len(rows)
+                    self._stats["flushes"] += 1
+                    self._stats["last_flush_rows"] = len(rows)
+                    self._stats["last_flush_ms"] = elapsed_ms
+                    self._stats["total_flush_ms"] += elapsed_ms
+                    self._stats["max_flush_ms"] = max(self._stats["max_flush_ms"], elapsed_ms)
+                logger.debug(f"ChatLogWriter flushed rows={len(rows)}, ms={elapsed_ms:.1f}, pending={self._queue.qsize()}")
+                self._replay_spilled()
+                return
+            except Exception as e:
+                self._bump("flush_errors")
+                logger.error(f"ChatLogWriter flush failed: rows={len(rows)}, attempt={attempt}/{self._max_retries}, error={e}")
+                time.sleep(min(0.5 * attempt, 2.0))
+        self._spill(batch)
+
+    def _spill(self, batch: List[LogModel]):
+        if not self._spill_dir:
+            self._bump("dropped", len(batch))
+            logger.error(f"ChatLogWriter dropped rows={len(batch)} after {self._max_retries} attempts (no spill_dir)")
+            return
+        path = os.path.join(self._spill_dir, f"chatlog-spill-{os.getpid()}.jsonl")
+        try:
+            with open(path, "a") as f:
+                for log in batch:
+                    f.write(json.dumps(log.model_dump(mode="json", exclude={"id"})) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        except Exception as e:
+            self._bump("dropped", len(batch))
+            logger.error(f"ChatLogWriter dropped rows={len(batch)}, spill to {path} failed: {e}")
+            return
+        self._bump("spilled", len(batch))
+        logger.error(f"ChatLogWriter spilled rows={len(batch)} to {path} after {self._max_retries} attempts")
+
+    def _replay_spilled(self):
+        '''Insert rows spilled by this writer or by a process that has exited; each file is removed once its rows are in.'''
+        if not self._spill_dir:
+            return
+        pid = os.getpid()
+        for path in sorted(glob.glob(os.path.join(self._spill_dir, "chatlog-spill-*.jsonl*"))):
+            match = _SPILL_FILE.search(path)
+            if match is None:
+                continue
+            owner, claimer = int(match.group(1)), match.group(2) and int(match.group(2))
+            if claimer is None and owner != pid and _pid_alive(owner):
+                # still spilling: the owner replays it
+                continue
+            if claimer is not None and claimer != pid and _pid_alive(claimer):
+                # another writer is inserting it right now
+                continue
+            # claim under a fresh name: a concurrent spill starts a new file, and nothing is ever renamed over
+            spill_path = os.path.join(self._spill_dir, f"chatlog-spill-{owner}.jsonl")
+            claimed = f"{spill_path}.replay-{pid}-{uuid.uuid4().hex[:8]}"
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            try:
+                with open(claimed) as f:
+                    rows = [json.loads(line) for line in f if line.strip()]
+                for row in rows:
+                    row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+                if rows:
+                    with self.__db.get_session() as session:
+                        session.execute(insert(LogModel), rows)
+                        session.commit()
+            except Exception as e:
+                # the claimed file stays; the next replay (ours, or another writer's if we exit) retries it
+                logger.error(f"ChatLogWriter replay of {claimed} failed, will retry: {e}")
+                return
+            os.remove(claimed)
+            self._bump("replayed" if owner == pid else "recovered", len(rows))
+            logger.info(f"ChatLogWriter replayed rows={len(rows)} from {claimed}, owner={owner}")
+
+    def _write_sync(self, log: LogModel):
+        with self.__db.get_session() as session:
+            session.add(log)
+            session.commit()
+        self._bump("written")
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # exists, but belongs to another user
+        return True
+    return True
+
+
 def timestamp(as_int=False):
+    # timezone-aware so it round-trips through the timestamptz column unchanged
     if not as_int:
-        return datetime.now(timezone.utc).isoformat()
+        return datetime.now(timezone.utc)
     else:
         return int(datetime.now(timezone.utc).timestamp())
 
 
 
-    
+
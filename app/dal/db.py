@@ -1,21 +1,137 @@
-from typing import Optional
+import threading
+import time
+from typing import Dict, Optional
 
+from loguru import logger
+from sqlalchemy import inspect
+from sqlalchemy.pool import QueuePool
 from sqlmodel import Field, Session, SQLModel, create_engine, select
 
 # Import Db Models that need creating
-from dal.models import LogModel, UserPreferencesModel
+from dal.models import LogModel, UserPreferencesModel, ExportWatermarkModel
+
+
+class TimedQueuePool(QueuePool):
+    '''
+    QueuePool that records how many checkouts were served and how long callers
+    waited for a connection (including time spent opening new connections).
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self._wait_stats = {"checkouts": 0, "timeouts": 0, "total_wait_ms": 0.0, "max_wait_ms": 0.0}
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except Exception:
+            with self._stats_lock:
+                self._wait_stats["timeouts"] += 1
+            raise
+        wait_ms = (time.perf_counter() - start) * 1000
+        with self._stats_lock:
+            self._wait_stats["checkouts"] += 1
+            self._wait_stats["total_wait_ms"] += wait_ms
+            self._wait_stats["max_wait_ms"] = max(self._wait_stats["max_wait_ms"], wait_ms)
+        return conn
+
+    @property
+    def wait_stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._wait_stats)
+        stats["avg_wait_ms"] = stats["total_wait_ms"] / stats["checkouts"] if stats["checkouts"] else 0.0
+        return stats
+
 
 class PostgresDb:
 
-    def __init__(self, database_url: str):
-        self.engine = create_engine(database_url)
+    def __init__(
+            self,
+            database_url: str,
+            pool_size: int = 5,
+            max_overflow: int = 10,
+            pool_timeout: float = 30,
+            pool_recycle: int = 1800,
+            pool_pre_ping: bool = True,
+            create_schema: bool = True
+        ):
+        self.engine = create_engine(
+            database_url,
+            poolclass=TimedQueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
+            pool_recycle=pool_recycle,
+            pool_pre_ping=pool_pre_ping
+        )
 
         # Create if needed, based on imported models
-        SQLModel.metadata.create_all(self.engine)
+        if create_schema:
+            fresh = not inspect(self.engine).has_table(LogModel.__tablename__)
+            SQLModel.metadata.create_all(self.engine)
+            if fresh:
+                # logs was just created in its current form, so no migration has anything left to do
+                from dal.migrations import record_baseline
+                record_baseline(self.engine)
+            self.ensure_partitions()
+
+    def ensure_partitions(self, months_ahead: int = 3):
+        '''Create the logs partitions for the coming months (no-op until logs is partitioned).'''
+        from dal.partitions import ensure_monthly_partitions
+        try:
+            created = ensure_monthly_partitions(self.engine, months_ahead=months_ahead)
+            if created:
+                logger.info(f"Created log partitions: {created}")
+        except Exception as e:
+            # rows still land in the default partition, so don't fail startup over it
+            logger.error(f"Failed to create log partitions: {e}")
 
     def get_session(self):
         return Session(self.engine)
 
+    def pool_stats(self) -> dict:
+        pool = self.engine.pool
+        stats = {
+            "pool_size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "status": pool.status(),
+        }
+        if isinstance(pool, TimedQueuePool):
+            stats.update(pool.wait_stats)
+        return stats
+
+
+# One PostgresDb (engine + pool) per database URL per process
+_shared_dbs: Dict[str, PostgresDb] = {}
+_shared_dbs_lock = threading.Lock()
+
+def get_shared_db(database_url: str, run_migrations: bool = False, **pool_kwargs) -> PostgresDb:
+    '''
+    Return the process-wide PostgresDb for database_url, creating it (and the
+    schema) on first use. Pool settings only apply to the first call.
+    With run_migrations, pending dal.migrations steps are applied once as well;
+    without, SchemaOutOfDateError is raised while a required one is pending.
+    '''
+    with _shared_dbs_lock:
+        db = _shared_dbs.get(database_url)
+        if db is None:
+            db = PostgresDb(database_url, **pool_kwargs)
+            from dal.migrations import apply_migrations, check_schema
+            try:
+                if run_migrations:
+                    apply_migrations(db.engine)
+                check_schema(db.engine)
+            except Exception:
+                db.engine.dispose()
+                raise
+            _shared_dbs[database_url] = db
+            logger.info(f"Created shared database engine: pool={pool_kwargs}")
+        return db
+
 
 if __name__=='__main__':
 
@@ -28,7 +144,7 @@ if __name__=='__main__':
     log = LogModel(
         sessionid="124", 
         userid="mafudge@syr.edu", 
-        timestamp=datetime.now(timezone.utc).isoformat(),
+        timestamp=datetime.now(timezone.utc),
         model="gpt-4",
         rag=False,
         context="test context", 
@@ -0,0 +1,286 @@
+'''
+Streaming export of the logs table.
+
+Rows are read with a server-side cursor (yield_per) and encoded batch by
+batch straight into a file, so peak memory depends on batch_size, not on the
+size of the table. Supported formats: CSV, NDJSON (one JSON object per line)
+and Parquet (needs pyarrow). CSV and NDJSON can be gzip-compressed; Parquet
+is compressed internally.
+'''
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import BinaryIO, Iterator, List, Optional, Sequence, Tuple
+
+from loguru import logger
+from sqlalchemy import func, select
+from sqlalchemy.sql import Select
+
+from dal.db import PostgresDb
+from dal.models import ExportWatermarkModel, LogFilterModel, LogModel
+
+EXPORT_FORMATS = ["csv", "ndjson", "parquet"]
+
+CONTENT_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+LOG_COLUMNS = [column.name for column in LogModel.__table__.columns]
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _as_utc(value: datetime) -> datetime:
+    # naive datetimes (e.g. from date pickers) are taken as UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def apply_log_filter(statement: Select, log_filter: Optional[LogFilterModel]) -> Select:
+    """Push the filter's predicates down into the SQL WHERE clause (a date range also prunes partitions)."""
+    if log_filter is None:
+        return statement
+    if log_filter.start is not None:
+        statement = statement.where(LogModel.timestamp >= _as_utc(log_filter.start))
+    if log_filter.end is not None:
+        statement = statement.where(LogModel.timestamp < _as_utc(log_filter.end))
+    if log_filter.contexts:
+        statement = statement.where(LogModel.context.in_(log_filter.contexts))
+    if log_filter.models:
+        statement = statement.where(LogModel.model.in_(log_filter.models))
+    if log_filter.roles:
+        statement = statement.where(LogModel.role.in_(log_filter.roles))
+    if log_filter.userid:
+        # userid is the MSAL email as signed in, so match it case-insensitively
+        statement = statement.where(func.lower(LogModel.userid) == log_filter.userid.strip().lower())
+    if log_filter.after_id is not None:
+        statement = statement.where(LogModel.id > log_filter.after_id)
+    if log_filter.max_id is not None:
+        statement = statement.where(LogModel.id <= log_filter.max_id)
+    return statement
+
+
+def log_select(log_filter: Optional[LogFilterModel] = None) -> Select:
+    """Log columns (no ORM objects) matching log_filter, ordered by timestamp."""
+    statement = select(LogModel.__table__).order_by(LogModel.timestamp, LogModel.id)
+    return apply_log_filter(statement, log_filter)
+
+
+def get_max_log_id(db: PostgresDb, after_id: int = 0, before: Optional[datetime] = None) -> int:
+    """Highest log id above after_id (0 if none), optionally only among rows logged before `before`."""
+    statement = select(func.max(LogModel.id)).where(LogModel.id > after_id)
+    if before is not None:
+        statement = statement.where(LogModel.timestamp < _as_utc(before))
+    with db.get_session() as session:
+        return session.execute(statement).scalar() or 0
+
+
+def watermark_name(base: str, log_filter: Optional[LogFilterModel] = None) -> str:
+    """
+    Watermark for the incremental export called base with log_filter's predicates.
+    Each distinct filter gets its own watermark, so an export of one context
+    doesn't advance past rows another filter hasn't exported yet.
+    """
+    predicates = log_filter.model_dump(mode="json", exclude_defaults=True, exclude={"after_id", "max_id"}) if log_filter else {}
+    if not predicates:
+        return base
+    digest = hashlib.sha256(json.dumps(predicates, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    return f"{base}:{digest}"
+
+
+def get_watermark(db: PostgresDb, name: str) -> int:
+    """Last log id included in the previous incremental export called name (0 if none)."""
+    with db.get_session() as session:
+        watermark = session.get(ExportWatermarkModel, name)
+        return watermark.last_id if watermark else 0
+
+
+def set_watermark(db: PostgresDb, name: str, last_id: int):
+    with db.get_session() as session:
+        watermark = session.get(ExportWatermarkModel, name) or ExportWatermarkModel(name=name)
+        watermark.last_id = last_id
+        watermark.updated_at = datetime.now(timezone.utc).isoformat()
+        session.add(watermark)
+        session.commit()
+    logger.info(f"Export watermark updated: name={name}, last_id={last_id}")
+
+
+def incremental_filter(
+        db: PostgresDb,
+        name: str,
+        log_filter: Optional[LogFilterModel] = None,
+        safety_margin: timedelta = timedelta(minutes=5)
+    ) -> LogFilterModel:
+    """
+    Copy of log_filter restricted to rows added since the last export called
+    name (see watermark_name), up to the highest id logged more than
+    safety_margin ago. Pass the returned filter's max_id to set_watermark once
+    the export has been delivered.
+
+    The margin matters because ids are taken when a row is inserted, not when
+    it commits: the write-behind writer (dal/chatlogger.py) can still commit a
+    batch with lower ids than rows that are already visible. Rows that recent
+    are left for the next export instead of being skipped for good.
+
+    Rows are bounded by id, so a recurring export touches only new rows via
+    the primary key index.
+    """
+    log_filter = log_filter.model_copy() if log_filter is not None else LogFilterModel()
+    log_filter.after_id = get_watermark(db, name)
+    cutoff = datetime.now(timezone.utc) - safety_margin
+    log_filter.max_id = max(log_filter.after_id, get_max_log_id(db, after_id=log_filter.after_id, before=cutoff))
+    return log_filter
+
+
+def iter_log_batches(db: PostgresDb, statement: Optional[Select] = None, batch_size: int = 5000) -> Iterator[Sequence[tuple]]:
+    """Yield batches of row tuples (in LOG_COLUMNS order) using a server-side cursor."""
+    statement = statement if statement is not None else log_select()
+    with db.get_session() as session:
+        result = session.execute(statement.execution_options(yield_per=batch_size))
+        for partition in result.partitions():
+            yield partition
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def write_csv(batches: Iterator[Sequence[tuple]], out: BinaryIO) -> int:
+    rows = 0
+    text = io.TextIOWrapper(out, encoding="utf-8", newline="", write_through=True)
+    writer = csv.writer(text)
+    writer.writerow(LOG_COLUMNS)
+    for batch in batches:
+        writer.writerows(batch)
+        rows += len(batch)
+    text.detach()
+    return rows
+
+
+def write_ndjson(batches: Iterator[Sequence[tuple]], out: BinaryIO) -> int:
+    rows = 0
+    for batch in batches:
+        lines = [json.dumps(dict(zip(LOG_COLUMNS, row)), default=_json_default) for row in batch]
+        out.write(("\n".join(lines) + "\n").encode("utf-8"))
+        rows += len(batch)
+    return rows
+
+
+def _arrow_schema():
+    import pyarrow as pa
+    from sqlalchemy import Boolean, DateTime, Float, Integer, Numeric
+
+    fields = []
+    for column in LogModel.__table__.columns:
+        if isinstance(column.type, Boolean):
+            arrow_type = pa.bool_()
+        elif isinstance(column.type, Integer):
+            arrow_type = pa.int64()
+        elif isinstance(column.type, (Float, Numeric)):
+            arrow_type = pa.float64()
+        elif isinstance(column.type, DateTime):
+            arrow_type = pa.timestamp("us", tz="UTC")
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column.name, arrow_type))
+    return pa.schema(fields)
+
+
+def _arrow_array(values, arrow_type):
+    import pyarrow as pa
+
+    if pa.types.is_floating(arrow_type):
+        # Numeric columns come back as Decimal, which pyarrow won't turn into doubles
+        values = [float(value) if value is not None else None for value in values]
+    return pa.array(values, type=arrow_type)
+
+
+def write_parquet(batches: Iterator[Sequence[tuple]], out: BinaryIO) -> int:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rows = 0
+    schema = _arrow_schema()
+    with pq.ParquetWriter(out, schema, compression="zstd") as writer:
+        for batch in batches:
+            columns = list(zip(*batch))
+            # one row group per batch keeps memory flat
+            writer.write_table(pa.Table.from_arrays([_arrow_array(values, field.type) for values, field in zip(columns, schema)], schema=schema))
+            rows += len(batch)
+    return rows
+
+
+_WRITERS = {"csv": write_csv, "ndjson": write_ndjson, "parquet": write_parquet}
+
+
+def export_file_extension(export_format: str, compress: bool) -> str:
+    return export_format + (".gz" if compress and export_format != "parquet" else "")
+
+
+def export_logs(
+        db: PostgresDb,
+        export_format: str,
+        output_path: str,
+        compress: bool = False,
+        statement: Optional[Select] = None,
+        batch_size: int = 5000
+    ) -> int:
+    """
+    Stream logs matching statement (default: all) into output_path.
+
+    Args:
+        db: PostgresDb instance
+        export_format: "csv", "ndjson" or "parquet"
+        output_path: File to write
+        compress: gzip the output (ignored for parquet, which is compressed internally)
+        statement: Select built from log_select(); defaults to every row
+        batch_size: Rows per fetch / encode batch
+
+    Returns:
+        Number of rows written
+    """
+    if export_format not in _WRITERS:
+        raise ValueError(f"Unknown export format: {export_format}")
+    batches = iter_log_batches(db, statement, batch_size)
+    with open(output_path, "wb") as raw:
+        if compress and export_format != "parquet":
+            with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6) as out:
+                rows = _WRITERS[export_format](batches, out)
+        else:
+            rows = _WRITERS[export_format](batches, raw)
+    logger.info(f"Exported logs: format={export_format}, compress={compress}, rows={rows}, bytes={os.path.getsize(output_path)}")
+    return rows
+
+
+def export_logs_to_tempfile(
+        db: PostgresDb,
+        export_format: str,
+        compress: bool = False,
+        statement: Optional[Select] = None,
+        batch_size: int = 5000
+    ) -> Tuple[str, int]:
+    """export_logs into a new temp file. Returns (path, rows); the caller deletes the file."""
+    fd, path = tempfile.mkstemp(suffix="." + export_file_extension(export_format, compress), prefix="chat_logs_")
+    os.close(fd)
+    try:
+        rows = export_logs(db, export_format, path, compress=compress, statement=statement, batch_size=batch_size)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, rows
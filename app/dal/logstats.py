@@ -0,0 +1,111 @@
+import threading
+import time
+from datetime import datetime, time as dt_time, timedelta, timezone
+from typing import Dict, Tuple
+
+from loguru import logger
+from sqlalchemy import text
+from sqlmodel import func, select
+
+from dal.db import PostgresDb
+from dal.models import LogModel, LogStatsModel
+
+
+def count_logs(db: PostgresDb) -> int:
+    """Exact row count using COUNT(*) in the database."""
+    with db.get_session() as session:
+        return session.exec(select(func.count()).select_from(LogModel)).one()
+
+
+def estimate_log_count(db: PostgresDb) -> int:
+    """
+    Approximate row count from the planner statistics in pg_class.
+
+    Instant on any table size, but only as fresh as the last (auto)ANALYZE.
+    A partitioned table has no statistics of its own, so its partitions are
+    summed. Returns -1 if the table has never been analyzed.
+    """
+    with db.get_session() as session:
+        partitions = session.execute(
+            text("SELECT c.reltuples FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(:table)"),
+            {"table": LogModel.__tablename__}
+        ).all()
+        if partitions:
+            analyzed = [row[0] for row in partitions if row[0] >= 0]
+            return int(sum(analyzed)) if analyzed else -1
+        row = session.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"),
+            {"table": LogModel.__tablename__}
+        ).first()
+        return int(row[0]) if row and row[0] is not None else -1
+
+
+def _group_counts(session, column, where=None) -> Dict[str, int]:
+    statement = select(column, func.count()).select_from(LogModel)
+    if where is not None:
+        statement = statement.where(where)
+    statement = statement.group_by(column).order_by(column)
+    return {str(key): count for key, count in session.exec(statement).all()}
+
+
+def compute_log_stats(db: PostgresDb, use_estimate: bool = False, days: int = 30) -> LogStatsModel:
+    """
+    Totals plus per-day (last `days` days), per-context and per-model message counts.
+
+    With use_estimate nothing scans the whole table: the total comes from the
+    planner statistics and the per-context / per-model counts cover the same
+    `days` window as the per-day counts (an index range on timestamp, which
+    also prunes the monthly partitions).
+    """
+    estimated = False
+    total = -1
+    if use_estimate:
+        total = estimate_log_count(db)
+        estimated = total >= 0
+    if not estimated:
+        total = count_logs(db)
+
+    # bucket by UTC day regardless of the session time zone
+    day = func.date(func.timezone("UTC", LogModel.timestamp))
+    since = datetime.combine((datetime.now(timezone.utc) - timedelta(days=days)).date(), dt_time.min, tzinfo=timezone.utc)
+    with db.get_session() as session:
+        by_day = _group_counts(session, day, LogModel.timestamp >= since)
+        window = LogModel.timestamp >= since if use_estimate else None
+        by_context = _group_counts(session, LogModel.context, window)
+        by_model = _group_counts(session, LogModel.model, window)
+
+    return LogStatsModel(
+        total=total,
+        estimated=estimated,
+        by_day=by_day,
+        by_context=by_context,
+        by_model=by_model,
+        breakdown_days=days if use_estimate else None,
+        generated_at=datetime.now(timezone.utc)
+    )
+
+
+# Short-lived cache so reruns of the Export page don't re-aggregate the table
+_stats_cache: Dict[Tuple[int, bool, int], Tuple[float, LogStatsModel]] = {}
+_stats_lock = threading.Lock()
+
+def get_log_stats(db: PostgresDb, use_estimate: bool = False, days: int = 30, ttl: float = 60.0) -> LogStatsModel:
+    """compute_log_stats, cached per database for ttl seconds."""
+    key = (id(db), use_estimate, days)
+    cached = _stats_cache.get(key)
+    if cached is not None and time.monotonic() - cached[0] < ttl:
+        return cached[1]
+    with _stats_lock:
+        cached = _stats_cache.get(key)
+        if cached is not None and time.monotonic() - cached[0] < ttl:
+            return cached[1]
+        start = time.perf_counter()
+        stats = compute_log_stats(db, use_estimate=use_estimate, days=days)
+        _stats_cache[key] = (time.monotonic(), stats)
+        logger.info(f"Computed log stats: total={stats.total}, estimated={stats.estimated}, ms={(time.perf_counter() - start) * 1000:.0f}")
+        return stats
+
+
+def clear_log_stats_cache():
+    with _stats_lock:
+        _stats_cache.clear()
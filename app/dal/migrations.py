@@ -0,0 +1,317 @@
+'''
+Lightweight schema migrations for existing deployments.
+
+SQLModel.metadata.create_all() only creates missing tables; it never alters
+an existing one. Changes to existing tables (new indexes, columns) are listed
+here as ordered, idempotent steps. Applied steps are recorded in the
+schema_migrations table.
+
+Run from the app folder:
+
+    python -m dal.migrations            # apply pending migrations
+    python -m dal.migrations --list     # show applied / pending
+
+or set DB_AUTO_MIGRATE=true to apply them when the app creates its shared engine.
+Otherwise the app checks the schema when it starts and refuses to run while a
+migration the models depend on (REQUIRED_MIGRATIONS) is pending, instead of
+writing rows the old schema can't hold. A database created from scratch by
+create_all already has the current schema, so every step is recorded as
+applied (record_baseline).
+Long-running steps (backfills) work in small batches and never hold a lock on
+logs for more than a moment, so they can run while the app is serving.
+'''
+import os
+import time
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError
+
+from dal.partitions import add_months, ensure_monthly_partitions, is_partitioned, month_start
+
+# Rows per UPDATE when backfilling, and pause between batches (seconds)
+BACKFILL_BATCH_SIZE = int(os.environ.get("MIGRATION_BATCH_SIZE", "10000"))
+BACKFILL_PAUSE = float(os.environ.get("MIGRATION_BATCH_PAUSE", "0.05"))
+
+
+def _create_index_concurrently(conn: Connection, name: str, ddl: str):
+    '''
+    CREATE INDEX CONCURRENTLY doesn't block writes to the logs table. If an
+    earlier attempt was interrupted it leaves an INVALID index behind, which
+    IF NOT EXISTS would silently keep, so drop and rebuild it in that case.
+    '''
+    invalid = conn.execute(text(
+        "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name AND NOT i.indisvalid"
+    ), {"name": name}).first()
+    if invalid:
+        logger.warning(f"Rebuilding invalid index {name}")
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    conn.execute(text(ddl))
+
+
+def _column_type(conn: Connection, table: str, column: str) -> Optional[str]:
+    return conn.execute(text(
+        "SELECT data_type FROM information_schema.columns WHERE table_name = :table AND column_name = :column"
+    ), {"table": table, "column": column}).scalar()
+
+
+def _constraint_exists(conn: Connection, name: str) -> bool:
+    return conn.execute(text("SELECT 1 FROM pg_constraint WHERE conname = :name"), {"name": name}).first() is not None
+
+
+def _in_short_transaction(conn: Connection, statements: List[str], attempts: int = 10):
+    '''
+    Run DDL that needs an ACCESS EXCLUSIVE lock on logs in one transaction.
+    lock_timeout keeps it from queueing behind a long query (and blocking every
+    insert queued behind it); on timeout it backs off and tries again.
+    '''
+    for attempt in range(1, attempts + 1):
+        try:
+            with conn.engine.begin() as tx:
+                tx.execute(text("SET LOCAL lock_timeout = '3s'"))
+                for statement in statements:
+                    tx.execute(text(statement))
+            return
+        except OperationalError as e:
+            if attempt == attempts:
+                raise
+            logger.warning(f"Lock not acquired (attempt {attempt}/{attempts}), retrying: {e.orig}")
+            time.sleep(min(2 * attempt, 30))
+
+
+def _logs_indexes(conn: Connection):
+    if is_partitioned(conn):
+        # new deployments: create_all already built the indexes (CONCURRENTLY isn't allowed on partitioned tables)
+        return
+    _create_index_concurrently(conn, "ix_logs_userid_timestamp",
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_logs_userid_timestamp ON logs (userid, "timestamp")')
+    _create_index_concurrently(conn, "ix_logs_sessionid_timestamp",
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_logs_sessionid_timestamp ON logs (sessionid, "timestamp")')
+    _create_index_concurrently(conn, "ix_logs_timestamp",
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_logs_timestamp ON logs ("timestamp")')
+    conn.execute(text("ANALYZE logs"))
+
+
+def _logs_timestamptz_backfill(conn: Connection):
+    '''
+    Add logs.timestamp_tz (timestamptz) next to the ISO-8601 text column and
+    fill it without locking the table:
+
+    - ADD COLUMN without a default only touches the catalog.
+    - A trigger fills the column for rows inserted while the backfill runs.
+    - Existing rows are updated in id ranges of BACKFILL_BATCH_SIZE, each in
+      its own short transaction, so only those rows are locked at any time.
+      Re-running skips rows that are already filled.
+    - NOT NULL is proven with a NOT VALID check constraint that is validated
+      afterwards (VALIDATE doesn't block reads or writes).
+    - The indexes on the new column are built CONCURRENTLY.
+    '''
+    if _column_type(conn, "logs", "timestamp") == "timestamp with time zone":
+        return
+    conn.execute(text("ALTER TABLE logs ADD COLUMN IF NOT EXISTS timestamp_tz TIMESTAMPTZ"))
+    conn.execute(text(
+        "CREATE OR REPLACE FUNCTION logs_timestamp_tz_sync() RETURNS trigger AS $$ "
+        "BEGIN NEW.timestamp_tz := NEW.\"timestamp\"::timestamptz; RETURN NEW; END $$ LANGUAGE plpgsql"
+    ))
+    conn.execute(text("DROP TRIGGER IF EXISTS logs_timestamp_tz_sync ON logs"))
+    conn.execute(text(
+        'CREATE TRIGGER logs_timestamp_tz_sync BEFORE INSERT OR UPDATE OF "timestamp" ON logs '
+        "FOR EACH ROW EXECUTE FUNCTION logs_timestamp_tz_sync()"
+    ))
+
+    low, high = conn.execute(text("SELECT min(id), max(id) FROM logs")).first()
+    if low is not None:
+        updated = 0
+        start = time.perf_counter()
+        for batch_start in range(low - 1, high, BACKFILL_BATCH_SIZE):
+            result = conn.execute(text(
+                'UPDATE logs SET timestamp_tz = "timestamp"::timestamptz '
+                "WHERE id > :start AND id <= :end AND timestamp_tz IS NULL"
+            ), {"start": batch_start, "end": batch_start + BACKFILL_BATCH_SIZE})
+            updated += result.rowcount
+            if (batch_start - low + 1) // BACKFILL_BATCH_SIZE % 50 == 0:
+                logger.info(f"Backfilling logs.timestamp_tz: id<={batch_start + BACKFILL_BATCH_SIZE}/{high}, updated={updated}")
+            time.sleep(BACKFILL_PAUSE)
+        logger.info(f"Backfilled logs.timestamp_tz: rows={updated}, seconds={time.perf_counter() - start:.1f}")
+
+    if not _constraint_exists(conn, "logs_timestamp_tz_not_null"):
+        conn.execute(text("ALTER TABLE logs ADD CONSTRAINT logs_timestamp_tz_not_null CHECK (timestamp_tz IS NOT NULL) NOT VALID"))
+    conn.execute(text("ALTER TABLE logs VALIDATE CONSTRAINT logs_timestamp_tz_not_null"))
+
+    _create_index_concurrently(conn, "ix_logs_userid_timestamp_tz",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_logs_userid_timestamp_tz ON logs (userid, timestamp_tz)")
+    _create_index_concurrently(conn, "ix_logs_sessionid_timestamp_tz",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_logs_sessionid_timestamp_tz ON logs (sessionid, timestamp_tz)")
+    _create_index_concurrently(conn, "ix_logs_timestamp_tz",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_logs_timestamp_tz ON logs (timestamp_tz)")
+
+
+def _logs_timestamptz_swap(conn: Connection):
+    '''
+    Replace the text column with timestamp_tz in one short transaction. Every
+    statement is a catalog change: SET NOT NULL reuses the validated check
+    constraint instead of scanning (Postgres 12+), and dropping a column
+    doesn't rewrite the table.
+    '''
+    if _column_type(conn, "logs", "timestamp_tz") is None:
+        return
+    _in_short_transaction(conn, [
+        "ALTER TABLE logs ALTER COLUMN timestamp_tz SET NOT NULL",
+        "ALTER TABLE logs DROP CONSTRAINT logs_timestamp_tz_not_null",
+        "DROP TRIGGER IF EXISTS logs_timestamp_tz_sync ON logs",
+        'ALTER TABLE logs DROP COLUMN "timestamp"',
+        'ALTER TABLE logs RENAME COLUMN timestamp_tz TO "timestamp"',
+        "ALTER INDEX ix_logs_userid_timestamp_tz RENAME TO ix_logs_userid_timestamp",
+        "ALTER INDEX ix_logs_sessionid_timestamp_tz RENAME TO ix_logs_sessionid_timestamp",
+        "ALTER INDEX ix_logs_timestamp_tz RENAME TO ix_logs_timestamp",
+    ])
+    conn.execute(text("DROP FUNCTION IF EXISTS logs_timestamp_tz_sync()"))
+    conn.execute(text("ANALYZE logs"))
+
+
+def _logs_partitioned(conn: Connection):
+    '''
+    Turn logs into a table range-partitioned by month, keeping the existing
+    rows in place: the current table becomes the logs_legacy partition of a
+    new partitioned logs table. Nothing is copied.
+
+    The slow parts run online first: a unique index for the new (id, timestamp)
+    primary key is built CONCURRENTLY, and a check constraint matching the
+    legacy partition's bound is validated without blocking writes, so ATTACH
+    PARTITION doesn't have to scan the table. The legacy partition ends two
+    months ahead so rows written while this runs always satisfy its bound;
+    monthly partitions start after it.
+    '''
+    if is_partitioned(conn):
+        return
+    legacy_upper = datetime.combine(add_months(month_start(datetime.now(timezone.utc).date()), 2), datetime.min.time(), tzinfo=timezone.utc)
+    bound = f"'{legacy_upper.isoformat()}'"
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence('logs', 'id')")).scalar()
+
+    _create_index_concurrently(conn, "logs_legacy_pkey",
+        'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS logs_legacy_pkey ON logs (id, "timestamp")')
+    if not _constraint_exists(conn, "logs_legacy_bound"):
+        conn.execute(text(f'ALTER TABLE logs ADD CONSTRAINT logs_legacy_bound CHECK ("timestamp" < {bound}) NOT VALID'))
+    conn.execute(text("ALTER TABLE logs VALIDATE CONSTRAINT logs_legacy_bound"))
+
+    _in_short_transaction(conn, [
+        "ALTER TABLE logs DROP CONSTRAINT logs_pkey",
+        "ALTER TABLE logs ADD CONSTRAINT logs_legacy_pkey PRIMARY KEY USING INDEX logs_legacy_pkey",
+        "ALTER TABLE logs RENAME TO logs_legacy",
+        "ALTER INDEX ix_logs_userid_timestamp RENAME TO ix_logs_legacy_userid_timestamp",
+        "ALTER INDEX ix_logs_sessionid_timestamp RENAME TO ix_logs_legacy_sessionid_timestamp",
+        "ALTER INDEX ix_logs_timestamp RENAME TO ix_logs_legacy_timestamp",
+        'CREATE TABLE logs (LIKE logs_legacy INCLUDING DEFAULTS, PRIMARY KEY (id, "timestamp")) PARTITION BY RANGE ("timestamp")',
+        f"ALTER SEQUENCE {sequence} OWNED BY logs.id",
+        # no partitions yet, so these are instant; ATTACH below adopts the legacy indexes
+        'CREATE INDEX ix_logs_userid_timestamp ON logs (userid, "timestamp")',
+        'CREATE INDEX ix_logs_sessionid_timestamp ON logs (sessionid, "timestamp")',
+        'CREATE INDEX ix_logs_timestamp ON logs ("timestamp")',
+        f"ALTER TABLE logs ATTACH PARTITION logs_legacy FOR VALUES FROM (MINVALUE) TO ({bound})",
+        "ALTER TABLE logs_legacy DROP CONSTRAINT logs_legacy_bound",
+    ])
+    ensure_monthly_partitions(conn.engine)
+    conn.execute(text("ANALYZE logs"))
+
+
+def _logs_usage_columns(conn: Connection):
+    '''Nullable token-usage / latency columns; ADD COLUMN without a default only touches the catalog.'''
+    _in_short_transaction(conn, [
+        "ALTER TABLE logs ADD COLUMN IF NOT EXISTS prompt_tokens INTEGER",
+        "ALTER TABLE logs ADD COLUMN IF NOT EXISTS completion_tokens INTEGER",
+        "ALTER TABLE logs ADD COLUMN IF NOT EXISTS cached_tokens INTEGER",
+        "ALTER TABLE logs ADD COLUMN IF NOT EXISTS ttft_ms DOUBLE PRECISION",
+    ])
+
+
+# Ordered list of (name, step). Steps run in autocommit mode and must be idempotent.
+MIGRATIONS: List[Tuple[str, Callable[[Connection], None]]] = [
+    ("001_logs_indexes", _logs_indexes),
+    ("002_logs_timestamptz_backfill", _logs_timestamptz_backfill),
+    ("003_logs_timestamptz_swap", _logs_timestamptz_swap),
+    ("004_logs_partitioned", _logs_partitioned),
+    ("005_logs_usage_columns", _logs_usage_columns),
+]
+
+
+# Steps the current models depend on: the app won't start while one of these is pending.
+# 001 only adds indexes, so an older schema still works (slowly) without it.
+REQUIRED_MIGRATIONS = {
+    "002_logs_timestamptz_backfill",
+    "003_logs_timestamptz_swap",
+    "004_logs_partitioned",
+    "005_logs_usage_columns",
+}
+
+
+class SchemaOutOfDateError(RuntimeError):
+    """The database is missing migrations the application depends on."""
+
+
+def _applied(conn: Connection) -> set:
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "name TEXT PRIMARY KEY, applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+    ))
+    return {row[0] for row in conn.execute(text("SELECT name FROM schema_migrations"))}
+
+
+def apply_migrations(engine: Engine) -> List[str]:
+    """Apply pending migrations in order. Returns the names of the ones applied."""
+    applied_now = []
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        done = _applied(conn)
+        for name, step in MIGRATIONS:
+            if name in done:
+                continue
+            logger.info(f"Applying migration {name}")
+            start = datetime.now(timezone.utc)
+            step(conn)
+            conn.execute(text("INSERT INTO schema_migrations (name) VALUES (:name) ON CONFLICT DO NOTHING"), {"name": name})
+            logger.info(f"Applied migration {name} in {(datetime.now(timezone.utc) - start).total_seconds():.1f}s")
+            applied_now.append(name)
+    return applied_now
+
+
+def record_baseline(engine: Engine):
+    """Mark every step applied, for a schema create_all just built in its current form."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        _applied(conn)
+        for name, _ in MIGRATIONS:
+            conn.execute(text("INSERT INTO schema_migrations (name) VALUES (:name) ON CONFLICT DO NOTHING"), {"name": name})
+    logger.info(f"Recorded migration baseline: {[name for name, _ in MIGRATIONS]}")
+
+
+def check_schema(engine: Engine):
+    """Raise SchemaOutOfDateError if a migration in REQUIRED_MIGRATIONS is pending."""
+    pending = [name for name, done in migration_status(engine) if not done and name in REQUIRED_MIGRATIONS]
+    if pending:
+        raise SchemaOutOfDateError(
+            f"Database schema is behind the application, pending migrations: {', '.join(pending)}. "
+            "Run `python -m dal.migrations` from the app folder (steps that are already in place are skipped), "
+            "or start the app with DB_AUTO_MIGRATE=true."
+        )
+
+
+def migration_status(engine: Engine) -> List[Tuple[str, bool]]:
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        done = _applied(conn)
+    return [(name, name in done) for name, _ in MIGRATIONS]
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+    from sqlmodel import create_engine
+
+    engine = create_engine(os.environ["DATABASE_URL"].strip("'").strip('"'))
+    if "--list" in sys.argv:
+        for name, done in migration_status(engine):
+            print(f"{'applied' if done else 'pending'}  {name}{'  (required)' if name in REQUIRED_MIGRATIONS else ''}")
+    else:
+        applied = apply_migrations(engine)
+        print(f"Applied {len(applied)} migration(s): {applied}")
@@ -1,7 +1,8 @@
 from datetime import datetime
 from loguru import logger
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Dict, Optional, List
+from sqlalchemy import Column, DateTime, Index
 from sqlmodel import Field, SQLModel
 import yaml
 
@@ -30,6 +31,13 @@ class AppSettingsModel(BaseModel):
     answer_prompt: str = "Your name is Answerbot. You're have knowledge of Python programming."
     tutor_prompt: str = "Your name is Tutorbot. You're a supportive AI Python programming tutor."
     whitelist: str = ""
+    max_prompt_tokens: int = 0  # 0 = no limit on conversation history sent per request
+    summarize_history: bool = False  # fold evicted turns into a rolling summary
+    retry_max_attempts: int = 3  # LLM call attempts for transient errors (1 = no retries)
+    retry_base_delay: float = 0.5  # seconds; backoff uses decorrelated jitter from here
+    retry_max_delay: float = 20.0  # seconds; cap on a single backoff, including Retry-After
+    circuit_failure_threshold: int = 5  # consecutive failures that open the circuit (0 = off)
+    circuit_reset_seconds: float = 30.0  # how long the circuit stays open before a trial call
 
     @staticmethod
     def from_yaml_string(yaml_string: str) -> "AppSettingsModel":
@@ -42,7 +50,14 @@ class AppSettingsModel(BaseModel):
                 temperature=config.get('temperature', 0.0),
                 answer_prompt=config.get('answer_prompt', "Your name is Answerbot. You're have knowledge of Python programming."),
                 tutor_prompt=config.get('tutor_prompt', "Your name is Tutorbot. You're a supportive AI Python programming tutor."),
-                whitelist=config.get('whitelist', '')
+                whitelist=config.get('whitelist', ''),
+                max_prompt_tokens=config.get('max_prompt_tokens', 0),
+                summarize_history=config.get('summarize_history', False),
+                retry_max_attempts=config.get('retry_max_attempts', 3),
+                retry_base_delay=config.get('retry_base_delay', 0.5),
+                retry_max_delay=config.get('retry_max_delay', 20.0),
+                circuit_failure_threshold=config.get('circuit_failure_threshold', 5),
+                circuit_reset_seconds=config.get('circuit_reset_seconds', 30.0)
             )
         except Exception as e:
             logger.error(f"Error loading AppSettingsModel from YAML: {e}")
@@ -55,12 +70,42 @@ class AppSettingsModel(BaseModel):
                 'temperature': self.temperature,
                 'answer_prompt': self.answer_prompt,
                 'tutor_prompt': self.tutor_prompt,
-                'whitelist': self.whitelist
+                'whitelist': self.whitelist,
+                'max_prompt_tokens': self.max_prompt_tokens,
+                'summarize_history': self.summarize_history,
+                'retry_max_attempts': self.retry_max_attempts,
+                'retry_base_delay': self.retry_base_delay,
+                'retry_max_delay': self.retry_max_delay,
+                'circuit_failure_threshold': self.circuit_failure_threshold,
+                'circuit_reset_seconds': self.circuit_reset_seconds
             }
         }
         return yaml.dump(data)
 
 
+class LogStatsModel(BaseModel):
+    """Aggregate counts over the logs table, computed database-side (see dal/logstats.py)."""
+    total: int = 0
+    estimated: bool = False  # total taken from pg_class.reltuples instead of COUNT(*)
+    by_day: Dict[str, int] = {}  # YYYY-MM-DD (UTC) -> messages, most recent days only
+    by_context: Dict[str, int] = {}
+    by_model: Dict[str, int] = {}
+    breakdown_days: Optional[int] = None  # by_context / by_model cover only the last N days (None = all rows)
+    generated_at: datetime = datetime.min
+
+
+class LogFilterModel(BaseModel):
+    """Predicates for log exports; empty fields don't filter. Applied in SQL by dal/logexport.py."""
+    start: Optional[datetime] = None  # inclusive
+    end: Optional[datetime] = None  # exclusive
+    contexts: List[str] = []
+    models: List[str] = []
+    roles: List[str] = []
+    userid: Optional[str] = None
+    after_id: Optional[int] = None  # only rows with id > after_id (incremental exports)
+    max_id: Optional[int] = None  # only rows with id <= max_id (snapshot upper bound)
+
+
 # Backwards compatibility alias (deprecated)
 ConfigurationModel = AppSettingsModel
 
@@ -83,13 +128,36 @@ class UserPreferencesModel(SQLModel, table=True):
 # Database Models
 class LogModel(SQLModel, table=True):
     __tablename__ = "logs"
-    id: Optional[int] = Field(default=None, primary_key=True)
+    # Existing deployments get these via dal/migrations.py (create_all only covers new tables).
+    # The table is range-partitioned by month on timestamp (see dal/partitions.py), so the
+    # partition key has to be part of the primary key.
+    __table_args__ = (
+        Index("ix_logs_userid_timestamp", "userid", "timestamp"),
+        Index("ix_logs_sessionid_timestamp", "sessionid", "timestamp"),
+        Index("ix_logs_timestamp", "timestamp"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
+    id: Optional[int] = Field(default=None, primary_key=True, sa_column_kwargs={"autoincrement": True})
     sessionid: str
     userid: str
-    timestamp: str
+    timestamp: datetime = Field(sa_column=Column("timestamp", DateTime(timezone=True), primary_key=True, nullable=False))
     model: str
     rag: bool
     context: str
     role: str
     content: str
+    # Assistant rows only, when the backend reports them: cached_tokens are prompt
+    # tokens served from the provider's prompt cache; ttft_ms is time to first token.
+    # Added by migration 005, which the app requires before it starts (dal/migrations.py)
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    cached_tokens: Optional[int] = None
+    ttft_ms: Optional[float] = None
+
 
+# High-water mark for recurring ("since last export") log exports
+class ExportWatermarkModel(SQLModel, table=True):
+    __tablename__ = "export_watermarks"
+    name: str = Field(default=None, primary_key=True)
+    last_id: int = 0
+    updated_at: str = ""
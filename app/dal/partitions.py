@@ -0,0 +1,271 @@
+'''
+Monthly partitions, retention and archival for the logs table.
+
+logs is range-partitioned on "timestamp" with one partition per UTC month
+(logs_pYYYY_MM) plus a default partition that catches rows outside every
+range. Deployments converted by migration 004 also have a logs_legacy
+partition holding everything written before the conversion.
+
+Partitions must exist before rows for that month arrive, so the app creates
+the upcoming months when it opens the database. Cold partitions are
+archived by copying them to a gzip CSV in S3 and then detaching and
+dropping them, which frees the space immediately (no DELETE / VACUUM).
+
+Run from the app folder:
+
+    python -m dal.partitions                            # create upcoming partitions
+    python -m dal.partitions --list                     # show partitions and row estimates
+    python -m dal.partitions --archive --retention-months 12 [--dry-run]
+'''
+import gzip
+import os
+import re
+import tempfile
+from datetime import date, datetime, timezone
+from typing import List, NamedTuple, Optional
+
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from dal.models import LogModel
+
+TABLE = LogModel.__tablename__
+DEFAULT_PARTITION = f"{TABLE}_default"
+
+
+class PartitionInfo(NamedTuple):
+    name: str
+    lower: Optional[datetime]  # None = MINVALUE
+    upper: Optional[datetime]  # None = MAXVALUE
+    is_default: bool
+    estimated_rows: int
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(value: date, months: int) -> date:
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _utc(value: date) -> datetime:
+    return datetime(value.year, value.month, value.day, tzinfo=timezone.utc)
+
+
+def partition_name(month: date) -> str:
+    return f"{TABLE}_p{month.year:04d}_{month.month:02d}"
+
+
+def is_partitioned(conn: Connection) -> bool:
+    return conn.execute(
+        text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)"),
+        {"table": TABLE}
+    ).first() is not None
+
+
+def _parse_bound(value: str) -> Optional[datetime]:
+    value = value.strip().strip("'")
+    if value in ("MINVALUE", "MAXVALUE"):
+        return None
+    # Postgres prints offsets as +00; older Pythons need +00:00
+    if re.search(r"[+-]\d\d$", value):
+        value += ":00"
+    return datetime.fromisoformat(value).astimezone(timezone.utc)
+
+
+def list_partitions(conn: Connection) -> List[PartitionInfo]:
+    rows = conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint "
+        "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:table) ORDER BY c.relname"
+    ), {"table": TABLE}).all()
+    partitions = []
+    for name, bound, estimated_rows in rows:
+        match = re.search(r"FROM \((.+?)\) TO \((.+?)\)", bound)
+        if match:
+            partitions.append(PartitionInfo(name, _parse_bound(match.group(1)), _parse_bound(match.group(2)), False, estimated_rows))
+        else:
+            partitions.append(PartitionInfo(name, None, None, True, estimated_rows))
+    return partitions
+
+
+def _overlaps(partition: PartitionInfo, lower: datetime, upper: datetime) -> bool:
+    if partition.is_default:
+        return False
+    return (partition.lower is None or partition.lower < upper) and (partition.upper is None or partition.upper > lower)
+
+
+def _create_month_partition(engine: Engine, month: date):
+    name = partition_name(month)
+    lower, upper = _utc(month), _utc(add_months(month, 1))
+    params = {"lower": lower, "upper": upper}
+    # partition bounds must be literals, not bind parameters
+    bounds = f"FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"
+    with engine.begin() as conn:
+        conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+        strays = conn.execute(text(
+            f'SELECT count(*) FROM {DEFAULT_PARTITION} WHERE "timestamp" >= :lower AND "timestamp" < :upper'
+        ), params).scalar()
+        if strays:
+            # Rows for this month already landed in the default partition. Postgres refuses
+            # to create an overlapping partition, so move them into the new table first.
+            logger.warning(f"Moving {strays} rows from {DEFAULT_PARTITION} into {name}")
+            conn.execute(text(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS)"))
+            conn.execute(text(
+                f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE "timestamp" >= :lower AND "timestamp" < :upper RETURNING *) '
+                f"INSERT INTO {name} SELECT * FROM moved"
+            ), params)
+            conn.execute(text(f"ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES {bounds}"))
+        else:
+            conn.execute(text(f"CREATE TABLE {name} PARTITION OF {TABLE} FOR VALUES {bounds}"))
+    logger.info(f"Created partition {name} for {lower.date()}..{upper.date()}")
+
+
+def ensure_monthly_partitions(engine: Engine, months_ahead: int = 3) -> List[str]:
+    """
+    Create the default partition and one partition per month from the current
+    UTC month through months_ahead months later. Months already covered by an
+    existing partition (e.g. logs_legacy) are skipped. No-op if logs is not
+    partitioned yet.
+
+    Returns:
+        Names of the partitions created
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if not is_partitioned(conn):
+            return []
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT"))
+        existing = list_partitions(conn)
+
+    created = []
+    current = month_start(datetime.now(timezone.utc).date())
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        lower, upper = _utc(month), _utc(add_months(month, 1))
+        if any(_overlaps(p, lower, upper) for p in existing):
+            continue
+        _create_month_partition(engine, month)
+        created.append(partition_name(month))
+    return created
+
+
+def _copy_partition_to_gzip(engine: Engine, name: str, path: str) -> int:
+    """COPY the partition straight from Postgres into a gzip CSV file (no rows in Python memory)."""
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        with gzip.open(path, "wb", compresslevel=6) as out:
+            cursor.copy_expert(f'COPY (SELECT * FROM {name} ORDER BY "timestamp", id) TO STDOUT WITH (FORMAT csv, HEADER)', out)
+        rows = cursor.rowcount
+        cursor.close()
+        raw.commit()
+    finally:
+        raw.close()
+    return rows
+
+
+def archive_partition(engine: Engine, s3_client, bucket: str, partition: PartitionInfo, prefix: str = "archive/logs") -> str:
+    """
+    Copy one partition to s3://bucket/prefix/<name>.csv.gz, verify the upload,
+    then detach and drop the partition.
+
+    Returns:
+        The S3 object key
+    """
+    object_key = f"{prefix.rstrip('/')}/{partition.name}.csv.gz"
+    fd, path = tempfile.mkstemp(suffix=".csv.gz", prefix=f"{partition.name}_")
+    os.close(fd)
+    try:
+        rows = _copy_partition_to_gzip(engine, partition.name, path)
+        size = os.path.getsize(path)
+        s3_client.put_file(bucket, object_key, path, content_type="application/gzip")
+        uploaded = s3_client.client.stat_object(bucket, object_key).size
+        if uploaded != size:
+            raise RuntimeError(f"Archive upload size mismatch for {object_key}: local={size}, s3={uploaded}")
+    finally:
+        os.remove(path)
+
+    with engine.begin() as conn:
+        conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+        conn.execute(text(f"ALTER TABLE {TABLE} DETACH PARTITION {partition.name}"))
+        conn.execute(text(f"DROP TABLE {partition.name}"))
+    logger.info(f"Archived partition {partition.name}: rows={rows}, bytes={size}, key=s3://{bucket}/{object_key}")
+    return object_key
+
+
+def archive_partitions(
+        engine: Engine,
+        s3_client,
+        bucket: str,
+        retention_months: int = 12,
+        prefix: str = "archive/logs",
+        dry_run: bool = False
+    ) -> List[str]:
+    """
+    Archive every partition whose rows are all older than retention_months
+    (counted from the start of the current UTC month).
+
+    Args:
+        engine: SQLAlchemy engine
+        s3_client: dal.s3.S3Client used for the upload
+        bucket: Destination bucket
+        retention_months: Months of logs to keep in the database
+        prefix: Key prefix for the archive files
+        dry_run: Only report which partitions would be archived
+
+    Returns:
+        Names of the partitions archived (or that would be, with dry_run)
+    """
+    cutoff = _utc(add_months(month_start(datetime.now(timezone.utc).date()), -retention_months))
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if not is_partitioned(conn):
+            logger.warning(f"{TABLE} is not partitioned; run the migrations first")
+            return []
+        cold = [p for p in list_partitions(conn) if p.upper is not None and p.upper <= cutoff]
+
+    archived = []
+    for partition in cold:
+        if dry_run:
+            logger.info(f"Would archive partition {partition.name} (upper={partition.upper}, rows~{partition.estimated_rows})")
+        else:
+            archive_partition(engine, s3_client, bucket, partition, prefix)
+        archived.append(partition.name)
+    return archived
+
+
+if __name__ == '__main__':
+    import argparse
+    from dotenv import load_dotenv
+    from sqlmodel import create_engine
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Manage logs table partitions")
+    parser.add_argument("--list", action="store_true", help="show partitions")
+    parser.add_argument("--archive", action="store_true", help="archive partitions older than the retention period to S3")
+    parser.add_argument("--retention-months", type=int, default=int(os.environ.get("LOG_RETENTION_MONTHS", "12")))
+    parser.add_argument("--months-ahead", type=int, default=3)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    engine = create_engine(os.environ["DATABASE_URL"].strip("'").strip('"'))
+    if args.list:
+        with engine.connect() as conn:
+            for p in list_partitions(conn):
+                bounds = "DEFAULT" if p.is_default else f"{p.lower or 'MINVALUE'} .. {p.upper or 'MAXVALUE'}"
+                print(f"{p.name:<24} {bounds:<55} rows~{p.estimated_rows:,}")
+    elif args.archive:
+        from dal.s3 import S3Client
+        s3_client = S3Client(
+            host_port=os.environ["S3_HOST"],
+            access_key=os.environ["S3_ACCESS_KEY"],
+            secret_key=os.environ["S3_SECRET_KEY"],
+            secure=False
+        )
+        archived = archive_partitions(engine, s3_client, os.environ["S3_BUCKET"], args.retention_months, dry_run=args.dry_run)
+        print(f"{'Would archive' if args.dry_run else 'Archived'} {len(archived)} partition(s): {archived}")
+    else:
+        created = ensure_monthly_partitions(engine, months_ahead=args.months_ahead)
+        print(f"Created {len(created)} partition(s): {created}")
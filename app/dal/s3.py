@@ -1,7 +1,133 @@
 from loguru import logger
 from minio import Minio
-from typing import List
+from typing import Callable, Dict, List, Optional, Tuple
 import io
+import os
+import threading
+import time
+
+
+class _CacheEntry:
+    def __init__(self, text: str, etag: Optional[str]):
+        self.text = text
+        self.etag = etag
+        self.checked_at = time.monotonic()
+        self.parsed: Dict[Callable, object] = {}
+
+
+class S3TextCache:
+    '''
+    Process-wide cache of small text objects (config, whitelist) keyed by
+    (bucket, key). Entries are served from memory for ttl seconds; after that
+    the object's ETag is checked with a HEAD request and the body is only
+    downloaded again if it changed. Parsed forms of the text (e.g. an
+    AppSettingsModel) are cached alongside the entry and dropped with it.
+    If S3 is unreachable during revalidation, the stale entry keeps being served.
+    '''
+
+    def __init__(self, ttl: float = 60.0):
+        self.ttl = ttl
+        self._entries: Dict[Tuple[str, str], _CacheEntry] = {}
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._stats = {"hits": 0, "revalidated": 0, "downloads": 0, "stale_served": 0, "invalidations": 0}
+
+    def _key_lock(self, cache_key: Tuple[str, str]) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(cache_key, threading.Lock())
+
+    def _bump(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def get_entry(self, client: Minio, bucket_name: str, object_key: str) -> _CacheEntry:
+        cache_key = (bucket_name, object_key)
+        entry = self._entries.get(cache_key)
+        if entry is not None and time.monotonic() - entry.checked_at < self.ttl:
+            self._bump("hits")
+            return entry
+
+        # one revalidation/download per key at a time; other callers wait and reuse it
+        with self._key_lock(cache_key):
+            entry = self._entries.get(cache_key)
+            if entry is not None and time.monotonic() - entry.checked_at < self.ttl:
+                self._bump("hits")
+                return entry
+
+            if entry is not None and entry.etag:
+                try:
+                    etag = client.stat_object(bucket_name, object_key).etag
+                    if etag and etag.strip('"') == entry.etag:
+                        entry.checked_at = time.monotonic()
+                        self._bump("revalidated")
+                        return entry
+                except Exception as e:
+                    logger.warning(f"Revalidation failed for s3://{bucket_name}/{object_key}, serving cached copy: {e}")
+                    entry.checked_at = time.monotonic()
+                    self._bump("stale_served")
+                    return entry
+
+            try:
+                response = client.get_object(bucket_name, object_key)
+                try:
+                    text = response.read().decode('utf-8')
+                    etag = response.headers.get("ETag")
+                finally:
+                    response.close()
+                    response.release_conn()
+            except Exception as e:
+                if entry is not None:
+                    logger.warning(f"Download failed for s3://{bucket_name}/{object_key}, serving cached copy: {e}")
+                    entry.checked_at = time.monotonic()
+                    self._bump("stale_served")
+                    return entry
+                raise
+
+            entry = _CacheEntry(text, etag.strip('"') if etag else None)
+            with self._lock:
+                self._entries[cache_key] = entry
+            self._bump("downloads")
+            logger.info(f"Cached s3://{bucket_name}/{object_key}, size={len(text)} characters, etag={entry.etag}")
+            return entry
+
+    def get_text(self, client: Minio, bucket_name: str, object_key: str) -> str:
+        return self.get_entry(client, bucket_name, object_key).text
+
+    def get_parsed(self, client: Minio, bucket_name: str, object_key: str, parser: Callable[[str], object]):
+        entry = self.get_entry(client, bucket_name, object_key)
+        if parser not in entry.parsed:
+            entry.parsed[parser] = parser(entry.text)
+        return entry.parsed[parser]
+
+    def invalidate(self, bucket_name: Optional[str] = None, object_key: Optional[str] = None):
+        '''Drop one object, every object in a bucket, or (no arguments) everything.'''
+        with self._lock:
+            if bucket_name is None:
+                self._entries.clear()
+            elif object_key is None:
+                for cache_key in [k for k in self._entries if k[0] == bucket_name]:
+                    del self._entries[cache_key]
+            else:
+                self._entries.pop((bucket_name, object_key), None)
+            self._stats["invalidations"] += 1
+        logger.info(f"Invalidated S3 cache bucket={bucket_name}, key={object_key}")
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        stats["ttl"] = self.ttl
+        return stats
+
+
+# Shared by every S3Client in the process
+_text_cache = S3TextCache(ttl=float(os.environ.get("S3_CACHE_TTL", "60")))
+
+
+def parse_whitelist(content: str) -> Tuple[str, ...]:
+    """Parse a comma-separated whitelist into normalized (trimmed, lowercased) emails."""
+    return tuple(email.strip().lower() for email in content.split(",") if email.strip())
 
 
 class S3Client:
@@ -66,7 +192,53 @@ class S3Client:
             else:
                 logger.error(f"Failed to fetch s3://{bucket_name}/{object_key} and no fallback provided: {e}")
                 raise
-    
+
+    def get_cached_text_file(self, bucket_name: str, object_key: str, fallback_file_path: str = None) -> str:
+        """
+        Same as get_text_file, but served from the process-wide S3TextCache.
+
+        The fallback file is read (uncached) only if S3 fails and nothing is cached yet.
+        """
+        return self.get_cached_object(bucket_name, object_key, parser=None, fallback_file_path=fallback_file_path)
+
+    def get_cached_object(self, bucket_name: str, object_key: str, parser: Callable[[str], object]|None, fallback_file_path: str = None):
+        """
+        Fetch a text file through the process-wide cache and return parser(text).
+
+        The parsed value is cached with the text and shared across sessions,
+        so callers must treat it as read-only.
+        """
+        try:
+            if parser is None:
+                return _text_cache.get_text(self.client, bucket_name, object_key)
+            return _text_cache.get_parsed(self.client, bucket_name, object_key, parser)
+        except Exception as e:
+            if not fallback_file_path:
+                logger.error(f"Failed to fetch s3://{bucket_name}/{object_key} and no fallback provided: {e}")
+                raise
+            logger.error(f"Failed to fetch s3://{bucket_name}/{object_key}: {e}")
+            logger.info(f"Using fallback file: {fallback_file_path}")
+            with open(fallback_file_path, 'r', encoding='utf-8') as f:
+                fallback_content = f.read()
+            return fallback_content if parser is None else parser(fallback_content)
+
+    def get_whitelist(self, bucket_name: str, object_key: str) -> Tuple[str, ...]:
+        """
+        Return the normalized whitelist emails, served from the process-wide cache.
+
+        The returned tuple is the same object until the whitelist file changes.
+        """
+        return self.get_cached_object(bucket_name, object_key, parser=parse_whitelist)
+
+    def invalidate_cache(self, bucket_name: str, object_key: str|None = None):
+        """Drop cached copies of an object (or the whole bucket) so the next read hits S3."""
+        _text_cache.invalidate(bucket_name, object_key)
+
+    @staticmethod
+    def cache_stats() -> dict:
+        return _text_cache.stats
+
+
     def put_text_file(self, bucket_name: str, object_key: str, content: str):
         # Minio expects a file-like object (with .read()) for data. Wrap bytes in BytesIO.
         if isinstance(content, str):
@@ -85,7 +257,23 @@ class S3Client:
             length=byte_length,
             content_type='text/plain'
         )
-        logger.info(f"Uploaded text file to s3://{bucket_name}/{object_key}, size={len(content)} characters")   
+        logger.info(f"Uploaded text file to s3://{bucket_name}/{object_key}, size={len(content)} characters")
+        # Writes from this process (Settings, Whitelist pages) are visible immediately
+        _text_cache.invalidate(bucket_name, object_key)
+
+    def put_file(self, bucket_name: str, object_key: str, file_path: str, content_type: str = 'application/octet-stream'):
+        """
+        Upload a local file. Files larger than part_size are sent as an S3
+        multipart upload, reading one part at a time, so memory use stays flat.
+        """
+        self.client.fput_object(
+            bucket_name,
+            object_key,
+            file_path,
+            content_type=content_type,
+            part_size=16 * 1024 * 1024
+        )
+        logger.info(f"Uploaded file {file_path} to s3://{bucket_name}/{object_key}, size={os.path.getsize(file_path)} bytes")
 
     def list_objects(self, bucket_name: str, prefix: str = '') -> List[str]:
         objects = self.client.list_objects(bucket_name, prefix=prefix)
@@ -1,23 +1,146 @@
 from loguru import logger
 
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple
+
 import requests
-import os 
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+MANIFEST_FILE = ".extract-manifest.json"
+
+
+class ExtractResult(NamedTuple):
+    filename: str      # manifest entry, e.g. "04-Iterations/HW-Iterations.ipynb"
+    localfile: str
+    status: str        # "updated", "unchanged" (same content), "not-modified" (304) or "failed"
+    error: str = ""
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
 
 
+def _file_sha256(path: str) -> str | None:
+    try:
+        with open(path, "rb") as f:
+            return _sha256(f.read())
+    except FileNotFoundError:
+        return None
+
 
 class UrlContentExtractor:
-    def __init__(self):
-        pass
+    '''
+    Downloads course notebooks into a local folder, in parallel and incrementally.
 
-    def extract_url(self, base, filename, destination_folder):
-        url = f"{base}{filename}"
-        response = requests.get(url)
-        response.raise_for_status()
+    One pooled requests.Session (keep-alive, retries on 429/5xx) is shared by a
+    bounded thread pool. A manifest in the destination folder records each
+    file's ETag, Last-Modified and content hash; the next run sends conditional
+    requests (If-None-Match / If-Modified-Since) and skips files the server
+    reports unchanged (304). A 200 with the same content as before doesn't
+    rewrite the file either, so its mtime, and everything downstream, is left alone.
+    A local file that is missing or differs from its manifest hash is always refetched.
+    '''
+
+    def __init__(self, max_workers: int = 8, timeout: float = 30.0, session: requests.Session | None = None):
+        self._max_workers = max_workers
+        self._timeout = timeout
+        self._session = session or self._pooled_session(max_workers)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _pooled_session(pool_size: int) -> requests.Session:
+        session = requests.Session()
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET"])
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    @staticmethod
+    def local_filename(filename: str) -> str:
         folder, file = filename.split('/')
-        clean_filename = folder.split('-')[0] + '-' + file
+        return folder.split('-')[0] + '-' + file
+
+    def _load_manifest(self, destination_folder: str) -> Dict[str, Dict]:
+        try:
+            with open(os.path.join(destination_folder, MANIFEST_FILE)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_manifest(self, destination_folder: str, manifest: Dict[str, Dict]):
+        path = os.path.join(destination_folder, MANIFEST_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(path + ".tmp", path)
+
+    def _fetch(self, base: str, filename: str, destination_folder: str, manifest: Dict[str, Dict]) -> ExtractResult:
+        url = f"{base}{filename}"
+        clean_filename = self.local_filename(filename)
         localfile = os.path.join(destination_folder, clean_filename)
-        with open(localfile, 'w') as f:
-            f.write(response.text)
+        entry = manifest.get(clean_filename, {})
+        local_hash = _file_sha256(localfile)
+
+        headers = {}
+        if entry.get("url") == url and local_hash is not None and local_hash == entry.get("sha256"):
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = self._session.get(url, headers=headers, timeout=self._timeout)
+        if response.status_code == 304:
+            return ExtractResult(filename, localfile, "not-modified")
+        response.raise_for_status()
+
+        content = response.content
+        content_hash = _sha256(content)
+        status = "unchanged"
+        if content_hash != local_hash:
+            # write-then-rename, so a reader never sees a half-written notebook
+            with open(localfile + ".tmp", "wb") as f:
+                f.write(content)
+            os.replace(localfile + ".tmp", localfile)
+            status = "updated"
+        with self._lock:
+            manifest[clean_filename] = {
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "sha256": content_hash
+            }
+        return ExtractResult(filename, localfile, status)
+
+    def extract_url(self, base, filename, destination_folder) -> ExtractResult:
+        return self.extract_all(base, [filename], destination_folder)[0]
+
+    def extract_all(self, base: str, filenames: List[str], destination_folder: str) -> List[ExtractResult]:
+        '''
+        Fetch every file in filenames (relative to base) into destination_folder.
+        A failed file is reported in its result and doesn't stop the others.
+        '''
+        manifest = self._load_manifest(destination_folder)
+
+        def fetch(filename: str) -> ExtractResult:
+            try:
+                result = self._fetch(base, filename, destination_folder, manifest)
+            except Exception as e:
+                logger.error(f"extract failed={filename}, error={e}")
+                return ExtractResult(filename, os.path.join(destination_folder, self.local_filename(filename)), "failed", str(e))
+            logger.info(f"extracted={filename}, status={result.status}")
+            return result
+
+        with ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="etl-extract") as pool:
+            results = list(pool.map(fetch, filenames))
+        self._save_manifest(destination_folder, manifest)
+        counts = {status: sum(1 for r in results if r.status == status) for status in ("updated", "unchanged", "not-modified", "failed")}
+        logger.info(f"extract summary base={base}, files={len(results)}, {counts}")
+        return results
 
 
 if __name__=='__main__':
@@ -29,6 +152,6 @@ if __name__=='__main__':
         "05-Functions/LAB-Functions.ipynb",
         "05-Functions/HW-Functions.ipynb",]
     extractor = UrlContentExtractor()
-    for doc in DOCUMENT_MANIFEST:
-        extractor.extract_url(DOCUMENT_BASE, doc ,os.environ['LOCAL_FILE_CACHE'].replace('"',''))
-        logger.info(f"extracted={doc}, base={DOCUMENT_BASE}")
+    # run it twice: the second run should report every file not-modified
+    for result in extractor.extract_all(DOCUMENT_BASE, DOCUMENT_MANIFEST, os.environ['LOCAL_FILE_CACHE'].replace('"','')):
+        print(result.status, result.localfile, result.error)
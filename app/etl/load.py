@@ -1,3 +1,61 @@
+import hashlib
+import json
+import os
+from glob import glob
+from typing import Dict
+
+from loguru import logger
+
+from rag.chunking import split_markdown
+from rag.embeddings import load_embedding_model
+from rag.indexfile import write_index
+
+
+def folder_documents(folder: str) -> Dict[str, str]:
+    '''{source: markdown} for every *.md in folder, transform output or not: what load_folder indexes.'''
+    documents = {}
+    for markdown in sorted(glob(os.path.join(folder, "*.md"))):
+        with open(markdown) as f:
+            documents[os.path.splitext(os.path.basename(markdown))[0]] = f.read()
+    return documents
+
+
+def documents_key(documents: Dict[str, str]) -> str:
+    '''Hash of the documents an index is built from; changes when any is added, removed or edited.'''
+    hashes = sorted((source, hashlib.sha256(text.encode("utf-8")).hexdigest()) for source, text in documents.items())
+    return hashlib.sha256(json.dumps(hashes).encode("utf-8")).hexdigest()
+
+
+class IndexLoader:
+    '''
+    Publishes the transformed markdown as a retrieval index artifact
+    (rag/indexfile.py) that the chat app memory-maps: chunks by markdown
+    header, plus their embeddings when an embedding model is given.
+    '''
+
+    def __init__(self, index_dir: str, embedding_model: str = "", dtype: str = "float16", max_chars: int = 3000, keep: int = 3):
+        self._index_dir = index_dir
+        self._embedding_model = embedding_model
+        self._encoder = load_embedding_model(embedding_model) if embedding_model else None
+        self._dtype = dtype
+        self._max_chars = max_chars
+        self._keep = keep
+        logger.info(f"initialized index loader dir={index_dir}, embedding={embedding_model or None}, dtype={dtype}")
+
+    def load(self, documents: Dict[str, str]) -> str:
+        '''Chunk and embed {source: markdown} documents and publish them as a new version.'''
+        chunks = [chunk for source, text in sorted(documents.items()) for chunk in split_markdown(text, source, self._max_chars)]
+        embeddings = None
+        if self._encoder is not None and chunks:
+            embeddings = self._encoder([chunk.search_text for chunk in chunks])
+        version = write_index(self._index_dir, chunks, embeddings, self._embedding_model if embeddings is not None else "", self._dtype, self._keep)
+        logger.info(f"loaded docs count={len(documents)}, chunks={len(chunks)} into index version={version}")
+        return version
+
+    def load_folder(self, folder: str) -> str:
+        return self.load(folder_documents(folder))
+
+
 
 # from uuid import uuid4
 # from loguru import logger
@@ -1,8 +1,13 @@
+from add_parent_path import add_parent_path
+add_parent_path(1)
+
 import os
 from loguru import logger
 # from load import ChromaLoader
+from load import IndexLoader, documents_key, folder_documents
 from extract import UrlContentExtractor
-from transform import NotebookTransformer, extract_metadata
+from transform import TransformPipeline
+from rag.indexfile import read_current
 
 DOCUMENT_BASE = "https://raw.githubusercontent.com/ist256/spring2026/refs/heads/main/lessons/"
 DOCUMENT_MANIFEST = [
@@ -60,9 +65,8 @@ DOCUMENT_MANIFEST = [
 ]
 
 def run_etl():
-    from glob import glob
     # Setup
-    extractor = UrlContentExtractor()
+    extractor = UrlContentExtractor(max_workers=int(os.environ.get("ETL_MAX_WORKERS", "8")))
     # chroma_loader = ChromaLoader(
     #     huggingface_token=os.environ['HUGGINGFACE_TOKEN'],
     #     huggingface_embedding_model="hkunlp/instructor-base",
@@ -74,19 +78,15 @@ def run_etl():
     # chroma_loader.reset_collection()
 
     filecache = os.environ['LOCAL_FILE_CACHE'].replace('"','')
-    # Extract
-    for doc in DOCUMENT_MANIFEST:
-        extractor.extract_url(DOCUMENT_BASE, doc ,filecache)
-        logger.info(f"extracted={doc}, base={DOCUMENT_BASE}")
+    # Extract: conditional GETs in parallel; unchanged notebooks aren't rewritten
+    results = extractor.extract_all(DOCUMENT_BASE, DOCUMENT_MANIFEST, filecache)
+    failed = [r.filename for r in results if r.status == "failed"]
+    if failed:
+        logger.warning(f"extract failed for {len(failed)} files, keeping the previous copies: {failed}")
 
-    # Transform
-    for notebook in glob(os.path.join(filecache, "*.ipynb")):
-        markdownFile = os.path.splitext(notebook)[0] + ".md"
-        transformer = NotebookTransformer(notebook, metadata=extract_metadata(notebook))
-        transformer.remove_empty_code_cells()
-        transformer.remove_cells_after_markdown("# Metacognition")
-        transformer.remove_cells_after_markdown("## Part 3: Metacognition")
-        transformer.to_markdown(markdownFile)
+    # Transform: only notebooks whose content (or the transform config) changed
+    pipeline = TransformPipeline(filecache, max_workers=int(os.environ.get("ETL_TRANSFORM_WORKERS", "0")) or None)
+    pipeline.run([r.localfile for r in results])
 
         # docs = transformer.split()
         # logger.info(f"transformed notebook={notebook}, docs={len(docs)}")
@@ -95,6 +95,21 @@ def run_etl():
         # chroma_loader.load(docs)
         # logger.info(f"loaded docs count={len(docs)}")
 
+    # Load: publish the retrieval index the chat app memory-maps (RAG_INDEX_DIR, default <filecache>/index),
+    # unless it was already built from these exact markdown files and settings. The key covers every
+    # markdown file in the folder, not only the transform outputs: the index is built from all of them
+    index_dir = os.environ.get("RAG_INDEX_DIR", os.path.join(filecache, "index"))
+    embedding_model = os.environ.get("RAG_EMBEDDING_MODEL", "")
+    dtype = os.environ.get("RAG_INDEX_DTYPE", "float16")
+    documents = folder_documents(filecache)
+    index_key = pipeline.downstream_key(os.path.abspath(index_dir), embedding_model, dtype, documents_key(documents))
+    if pipeline.stage_is_current("index", index_key) and read_current(index_dir) is not None:
+        logger.info(f"retrieval index is up to date, dir={index_dir}")
+    else:
+        index_loader = IndexLoader(index_dir=index_dir, embedding_model=embedding_model, dtype=dtype)
+        index_loader.load(documents)
+        pipeline.mark_stage("index", index_key)
+
     # return loader for querying
     # return chroma_loader 
 
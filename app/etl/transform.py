@@ -1,14 +1,32 @@
 from loguru import logger
 
-from typing import List
+from typing import Dict, List, NamedTuple, Tuple
+from concurrent.futures import ProcessPoolExecutor
 from glob import glob
+import hashlib
+import json
 import os
 
 import nbformat
+import nbconvert
 from nbconvert import MarkdownExporter
 # from langchain_text_splitters import MarkdownHeaderTextSplitter
 # from langchain_core.documents import Document
 
+MANIFEST_FILE = ".transform-manifest.json"
+# bump when a change here alters the markdown produced for the same notebook
+TRANSFORM_VERSION = 1
+
+_exporter: MarkdownExporter | None = None
+
+def get_exporter() -> MarkdownExporter:
+    '''One exporter per process; building it (templates, preprocessors) costs more than most conversions.'''
+    global _exporter
+    if _exporter is None:
+        _exporter = MarkdownExporter()
+    return _exporter
+
+
 class NotebookTransformer:
   
     def __init__(self, notebook_path: str, metadata :dict|None=None):
@@ -18,12 +36,12 @@ class NotebookTransformer:
             self._metadata = metadata
 
     def to_markdown(self, markdown_path: str|None=None):
-        exporter = MarkdownExporter()
-        self._markdown, resources = exporter.from_notebook_node(self._notebook)
+        self._markdown, resources = get_exporter().from_notebook_node(self._notebook)
 
         if markdown_path:
-            with open(markdown_path, 'w') as fw:
+            with open(markdown_path + ".tmp", 'w') as fw:
                 fw.write(self._markdown)
+            os.replace(markdown_path + ".tmp", markdown_path)
           
     def remove_empty_code_cells(self):    
         for cell in self._notebook.cells:
@@ -80,19 +98,160 @@ def extract_metadata(notebook_filename):
     return metadata
 
 
+class TransformConfig(NamedTuple):
+    remove_empty_code_cells: bool = True
+    truncate_at: Tuple[str, ...] = ("# Metacognition", "## Part 3: Metacognition")
+
+    def key(self) -> str:
+        '''Changes whenever the same notebook would be converted differently.'''
+        config = {**self._asdict(), "transform": TRANSFORM_VERSION, "nbconvert": nbconvert.__version__}
+        return hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class TransformResult(NamedTuple):
+    notebook: str
+    markdown: str
+    status: str        # "built", "skipped" (input and config unchanged) or "failed"
+    error: str = ""
+
+
+def _file_sha256(path: str) -> str | None:
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def transform_notebook(notebook_path: str, markdown_path: str, config: TransformConfig) -> str:
+    '''Convert one notebook to markdown; returns the sha256 of the markdown written.'''
+    transformer = NotebookTransformer(notebook_path, metadata=extract_metadata(notebook_path))
+    if config.remove_empty_code_cells:
+        transformer.remove_empty_code_cells()
+    for markdown in config.truncate_at:
+        transformer.remove_cells_after_markdown(markdown)
+    transformer.to_markdown(markdown_path)
+    return _file_sha256(markdown_path)
+
+
+class TransformPipeline:
+    '''
+    Incremental notebook -> markdown stage, driven by a manifest in the folder.
+
+    Each markdown output is a node keyed by the sha256 of its notebook plus the
+    transform configuration (TransformConfig.key). A node is rebuilt only when
+    its key changed, its output is missing, or the output no longer matches the
+    hash recorded when it was built; everything else is skipped without parsing
+    the notebook. Rebuilds run across a process pool, one exporter per worker.
+    Outputs whose notebook left the input list are removed.
+
+    Downstream stages (the retrieval index) depend on all the outputs together:
+    downstream_key() hashes them, and stage_is_current() / mark_stage() record
+    whether a stage has already been built from that key.
+    '''
+
+    def __init__(self, folder: str, config: TransformConfig = TransformConfig(), max_workers: int | None = None):
+        self._folder = folder
+        self._config = config
+        self._config_key = config.key()
+        self._max_workers = max_workers
+        self._manifest = self._load_manifest()
+
+    def _load_manifest(self) -> Dict:
+        try:
+            with open(os.path.join(self._folder, MANIFEST_FILE)) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            manifest = {}
+        return {"outputs": manifest.get("outputs", {}), "stages": manifest.get("stages", {})}
+
+    def _save_manifest(self):
+        path = os.path.join(self._folder, MANIFEST_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(self._manifest, f, indent=2, sort_keys=True)
+        os.replace(path + ".tmp", path)
+
+    def _node_key(self, notebook: str) -> str:
+        with open(notebook, "rb") as f:
+            return hashlib.sha256(f.read() + self._config_key.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def markdown_path(notebook: str) -> str:
+        return os.path.splitext(notebook)[0] + ".md"
+
+    def plan(self, notebooks: List[str]) -> Dict[str, str]:
+        '''The notebooks whose markdown must be rebuilt, as {notebook: node key}.'''
+        stale = {}
+        for notebook in notebooks:
+            key = self._node_key(notebook)
+            markdown = self.markdown_path(notebook)
+            node = self._manifest["outputs"].get(os.path.basename(markdown), {})
+            if node.get("key") != key or node.get("sha256") != _file_sha256(markdown):
+                stale[notebook] = key
+        return stale
+
+    def run(self, notebooks: List[str]) -> List[TransformResult]:
+        notebooks = [notebook for notebook in notebooks if os.path.exists(notebook)]
+        stale = self.plan(notebooks)
+        results = {notebook: TransformResult(notebook, self.markdown_path(notebook), "skipped")
+                   for notebook in notebooks if notebook not in stale}
+
+        if len(stale) > 1 and self._max_workers != 1:
+            with ProcessPoolExecutor(max_workers=self._max_workers, initializer=get_exporter) as pool:
+                futures = {notebook: pool.submit(transform_notebook, notebook, self.markdown_path(notebook), self._config)
+                           for notebook in stale}
+                for notebook, future in futures.items():
+                    results[notebook] = self._record(notebook, stale[notebook], future.result)
+        else:
+            for notebook in stale:
+                results[notebook] = self._record(notebook, stale[notebook],
+                                                 lambda: transform_notebook(notebook, self.markdown_path(notebook), self._config))
+
+        self._remove_orphans({os.path.basename(self.markdown_path(notebook)) for notebook in notebooks})
+        self._save_manifest()
+        counts = {status: sum(1 for r in results.values() if r.status == status) for status in ("built", "skipped", "failed")}
+        logger.info(f"transform summary notebooks={len(notebooks)}, {counts}")
+        return [results[notebook] for notebook in notebooks]
+
+    def _record(self, notebook: str, key: str, build) -> TransformResult:
+        markdown = self.markdown_path(notebook)
+        try:
+            output_hash = build()
+        except Exception as e:
+            # not recorded, so the node stays stale and is retried next run
+            logger.error(f"transform failed notebook={notebook}, error={e}")
+            return TransformResult(notebook, markdown, "failed", str(e))
+        self._manifest["outputs"][os.path.basename(markdown)] = {
+            "input": os.path.basename(notebook), "key": key, "sha256": output_hash}
+        logger.info(f"transformed notebook={notebook}, markdown={markdown}")
+        return TransformResult(notebook, markdown, "built")
+
+    def _remove_orphans(self, current: set):
+        for name in [name for name in self._manifest["outputs"] if name not in current]:
+            path = os.path.join(self._folder, name)
+            if os.path.exists(path):
+                os.remove(path)
+            del self._manifest["outputs"][name]
+            logger.info(f"removed markdown={name}, notebook no longer in the manifest")
+
+    def downstream_key(self, *parts: str) -> str:
+        '''Hash of every output (plus any stage settings in parts).'''
+        outputs = sorted((name, node["sha256"]) for name, node in self._manifest["outputs"].items())
+        return hashlib.sha256(json.dumps([outputs, parts]).encode("utf-8")).hexdigest()
+
+    def stage_is_current(self, stage: str, key: str) -> bool:
+        return self._manifest["stages"].get(stage) == key
+
+    def mark_stage(self, stage: str, key: str):
+        self._manifest["stages"][stage] = key
+        self._save_manifest()
+
+
 if __name__ == '__main__':
   file_cache = os.environ['LOCAL_FILE_CACHE']
-  globspec = os.path.join(file_cache, "*.ipynb")
-  for notebookFile in glob(globspec):
-    source = os.path.basename(notebookFile)
-    metadata = extract_metadata(notebookFile)
-    markdownFile = os.path.splitext(notebookFile)[0] + ".md"
-    nbt = NotebookTransformer(notebookFile, metadata=metadata)
-    nbt.remove_empty_code_cells()
-    nbt.remove_cells_after_markdown("# Metacognition")
-    nbt.remove_cells_after_markdown("## Part 3: Metacognition")
-    nbt.to_markdown(markdownFile)
-    docs = nbt.split()
-    logger.info(f"converted notebook={notebookFile}, markdown={markdownFile}")
+  pipeline = TransformPipeline(file_cache)
+  results = pipeline.run(sorted(glob(os.path.join(file_cache, "*.ipynb"))))
+  for result in results:
+    logger.info(f"notebook={result.notebook}, status={result.status}")
 
 
@@ -0,0 +1,101 @@
+'''
+One background asyncio event loop per process for LLM I/O.
+
+Streamlit runs each session's script on its own thread, so async code can't
+simply own the thread it is called from. Coroutines are submitted to a single
+daemon loop thread instead, where every in-flight completion is multiplexed
+on shared async HTTP pools. iterate_sync() and run_sync() let synchronous
+callers consume them.
+'''
+import asyncio
+import queue
+import threading
+from typing import AsyncIterator, Awaitable, Iterator, TypeVar
+
+from loguru import logger
+
+T = TypeVar("T")
+
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    '''The shared LLM event loop, started on first use.'''
+    global _loop
+    if _loop is not None:
+        return _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="llm-event-loop", daemon=True)
+            thread.start()
+            _loop = loop
+            logger.info("Started LLM event loop thread")
+        return _loop
+
+
+def run_sync(coro: Awaitable[T], timeout: float | None = None) -> T:
+    '''Run a coroutine on the shared loop and wait for its result.'''
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result(timeout)
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+_DONE = object()
+
+
+def iterate_sync(stream: AsyncIterator[T]) -> Iterator[T]:
+    '''
+    Consume an async iterator from synchronous code. The iterator runs on the
+    shared loop and hands items over through a queue; exceptions are re-raised
+    in the caller. If the caller stops early, the async side is cancelled.
+    '''
+    items: queue.Queue = queue.Queue()
+
+    async def pump():
+        try:
+            async for item in stream:
+                items.put(item)
+        except asyncio.CancelledError:
+            items.put(_DONE)
+            raise
+        except Exception as e:
+            items.put(_Failure(e))
+        else:
+            items.put(_DONE)
+
+    future = asyncio.run_coroutine_threadsafe(pump(), get_loop())
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        if not future.done():
+            future.cancel()
+
+
+if __name__=='__main__':
+    import time
+
+    async def numbers(n: int, delay: float):
+        for i in range(n):
+            await asyncio.sleep(delay)
+            yield i
+
+    # 50 concurrent streams share one loop thread
+    start = time.perf_counter()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(sum(iterate_sync(numbers(10, 0.05))))) for _ in range(50)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    print(f"streams={len(results)}, total={sum(results)}, seconds={time.perf_counter() - start:.2f}")
@@ -1,13 +1,28 @@
 from loguru import logger
 
-from openai import AzureOpenAI
 if __name__=='__main__':
     from llmbase import LLMBase
+    from clients import get_async_azure_openai_client, get_azure_openai_client
 else:
     from .llmbase import LLMBase
+    from .clients import get_async_azure_openai_client, get_azure_openai_client
     
 from typing import List, Dict
 
+
+def _usage(usage) -> Dict | None:
+    '''prompt/completion tokens and the prompt tokens served from Azure's prompt cache.'''
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        # older API versions don't report prompt_tokens_details
+        "cached_tokens": getattr(details, "cached_tokens", None) if details is not None else None
+    }
+
+
 class AzureOpenAILLM(LLMBase):
 
     def __init__(
@@ -20,9 +35,11 @@ class AzureOpenAILLM(LLMBase):
         ):
         self.__endpoint = endpoint
         self.__api_version = api_version
+        self.__api_key = api_key
         self._model = model
         self._temperature = temperature
-        self._client = AzureOpenAI(azure_endpoint=endpoint, api_key=api_key, api_version=api_version)
+        # shared per endpoint/version/key so sessions reuse pooled connections
+        self._client = get_azure_openai_client(endpoint, api_key, api_version)
         logger.info(f"endpoint={self.__endpoint}, apiver={self.__api_version}, model={model}, temperature={temperature}")
 
     @property
@@ -39,12 +56,17 @@ class AzureOpenAILLM(LLMBase):
         logger.info(f"endpoint={self.__endpoint}, apiver={self.__api_version}, model={this_model}, temperature={this_temperature}")
         response = self._client.chat.completions.create(
             stream=True,
+            stream_options={"include_usage": True},
             model=this_model,
             messages=messages,
             temperature=this_temperature
         )
         
+        self.last_usage = None
         for chunk in response:
+            if chunk.usage is not None:
+                # final chunk (include_usage): no choices, just the usage
+                self.last_usage = _usage(chunk.usage)
             if len(chunk.choices) > 0:
                 yield chunk.choices[0].delta.content if chunk.choices[0].delta.content is not None else ""
 
@@ -57,8 +79,41 @@ class AzureOpenAILLM(LLMBase):
             messages=messages,
             temperature=this_temperature
         )
+        self.last_usage = _usage(response.usage)
         content = response.choices[0].message.content
         return content
+
+    async def agenerate_stream(self, messages: List[Dict], model: str|None=None,  temperature: float|None=None):
+        this_model = model if model != None else self._model
+        this_temperature = temperature if temperature != None else self._temperature
+        logger.info(f"endpoint={self.__endpoint}, apiver={self.__api_version}, model={this_model}, temperature={this_temperature}, async=True")
+        client = get_async_azure_openai_client(self.__endpoint, self.__api_key, self.__api_version)
+        response = await client.chat.completions.create(
+            stream=True,
+            stream_options={"include_usage": True},
+            model=this_model,
+            messages=messages,
+            temperature=this_temperature
+        )
+        self.last_usage = None
+        async for chunk in response:
+            if chunk.usage is not None:
+                self.last_usage = _usage(chunk.usage)
+            if len(chunk.choices) > 0:
+                yield chunk.choices[0].delta.content if chunk.choices[0].delta.content is not None else ""
+
+    async def agenerate_text(self, messages: List[Dict], model: str|None=None,  temperature: float|None=None):
+        this_model = model if model != None else self._model
+        this_temperature = temperature if temperature != None else self._temperature
+        logger.info(f"endpoint={self.__endpoint}, apiver={self.__api_version}, model={this_model}, temperature={this_temperature}, async=True")
+        client = get_async_azure_openai_client(self.__endpoint, self.__api_key, self.__api_version)
+        response = await client.chat.completions.create(
+            model=this_model,
+            messages=messages,
+            temperature=this_temperature
+        )
+        self.last_usage = _usage(response.usage)
+        return response.choices[0].message.content
     
 
 if __name__=='__main__':
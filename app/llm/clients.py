@@ -0,0 +1,285 @@
+'''
+Process-wide registry of LLM API clients.
+
+Every Streamlit session used to build its own AzureOpenAI / ollama.Client,
+each with a private connection pool, so every student paid a fresh TCP + TLS
+handshake and the process kept hundreds of idle pools. Clients are now shared
+per (endpoint, API version, credentials), and all clients for one endpoint
+share a single tuned keep-alive pool (HTTP/2 when the h2 package is
+installed and the server negotiates it).
+
+Pool settings come from the environment:
+
+    LLM_HTTP_MAX_CONNECTIONS    total connections per endpoint (default 100)
+    LLM_HTTP_MAX_KEEPALIVE      idle connections kept open (default 20)
+    LLM_HTTP_KEEPALIVE_EXPIRY   seconds an idle connection is kept (default 120)
+    LLM_HTTP_CONNECT_TIMEOUT    seconds (default 10)
+    LLM_HTTP_READ_TIMEOUT       seconds between streamed chunks (default 120)
+    LLM_HTTP2                   use HTTP/2 when available (default true)
+'''
+import asyncio
+import hashlib
+import os
+import threading
+from typing import Dict, List
+
+import httpx
+from loguru import logger
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.environ.get(name, str(default)))
+
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(_env_float("LLM_HTTP_MAX_CONNECTIONS", 100)),
+        max_keepalive_connections=int(_env_float("LLM_HTTP_MAX_KEEPALIVE", 20)),
+        keepalive_expiry=_env_float("LLM_HTTP_KEEPALIVE_EXPIRY", 120),
+    )
+
+
+def http_timeout() -> httpx.Timeout:
+    return httpx.Timeout(
+        connect=_env_float("LLM_HTTP_CONNECT_TIMEOUT", 10),
+        read=_env_float("LLM_HTTP_READ_TIMEOUT", 120),
+        write=30.0,
+        pool=30.0,
+    )
+
+
+def use_http2() -> bool:
+    return os.environ.get("LLM_HTTP2", "true").lower() == "true" and http2_available()
+
+
+def credential_fingerprint(secret: str | None) -> str:
+    '''Short hash used in registry keys and stats so raw keys are never logged.'''
+    return hashlib.sha256((secret or "").encode("utf-8")).hexdigest()[:12]
+
+
+class ConnectionStats:
+    '''
+    Counts requests and newly opened connections for one pool using httpx's
+    request hooks and httpcore's trace extension. Requests that didn't open a
+    connection reused a pooled one.
+    '''
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._counters = {"requests": 0, "new_connections": 0, "tls_handshakes": 0, "errors": 0}
+        self._http_versions: Dict[str, int] = {}
+
+    def _bump(self, key: str):
+        with self._lock:
+            self._counters[key] += 1
+
+    def _trace(self, event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            self._bump("new_connections")
+        elif event_name == "connection.start_tls.complete":
+            self._bump("tls_handshakes")
+
+    def on_request(self, request: httpx.Request):
+        self._bump("requests")
+        request.extensions["trace"] = self._trace
+
+    def on_response(self, response: httpx.Response):
+        with self._lock:
+            self._http_versions[response.http_version] = self._http_versions.get(response.http_version, 0) + 1
+            if response.status_code >= 500:
+                self._counters["errors"] += 1
+
+    # httpx.AsyncClient requires coroutine hooks and trace callbacks
+    async def _atrace(self, event_name: str, info: dict):
+        self._trace(event_name, info)
+
+    async def aon_request(self, request: httpx.Request):
+        self._bump("requests")
+        request.extensions["trace"] = self._atrace
+
+    async def aon_response(self, response: httpx.Response):
+        self.on_response(response)
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["http_versions"] = dict(self._http_versions)
+        stats["pool"] = self.name
+        stats["reused"] = max(0, stats["requests"] - stats["new_connections"])
+        stats["reuse_ratio"] = stats["reused"] / stats["requests"] if stats["requests"] else 0.0
+        return stats
+
+
+def _client_kwargs(stats: ConnectionStats, is_async: bool = False) -> dict:
+    '''httpx.Client / AsyncClient keyword arguments for a shared, instrumented pool.'''
+    if is_async:
+        event_hooks = {"request": [stats.aon_request], "response": [stats.aon_response]}
+    else:
+        event_hooks = {"request": [stats.on_request], "response": [stats.on_response]}
+    return {
+        "limits": http_limits(),
+        "timeout": http_timeout(),
+        "http2": use_http2(),
+        "event_hooks": event_hooks,
+    }
+
+
+_lock = threading.Lock()
+# keyed by endpoint for sync pools and by (endpoint, event loop id) for async ones,
+# since an httpx.AsyncClient's connections belong to the loop that opened them
+_http_clients: Dict[object, object] = {}
+_api_clients: Dict[tuple, object] = {}
+_stats: Dict[str, ConnectionStats] = {}
+
+
+def _connection_stats(name: str) -> ConnectionStats:
+    # caller holds _lock; sync and async pools for an endpoint share one set of counters
+    stats = _stats.get(name)
+    if stats is None:
+        stats = _stats[name] = ConnectionStats(name)
+    return stats
+
+
+def _loop_id() -> int:
+    return id(asyncio.get_running_loop())
+
+
+def get_http_client(base_url: str) -> httpx.Client:
+    '''Shared httpx.Client (one connection pool) for an endpoint.'''
+    key = base_url.rstrip("/")
+    with _lock:
+        client = _http_clients.get(key)
+        if client is None:
+            client = _http_clients[key] = httpx.Client(**_client_kwargs(_connection_stats(key)))
+            logger.info(f"Created shared HTTP pool: endpoint={key}, http2={use_http2()}, limits={http_limits()}")
+        return client
+
+
+def get_async_http_client(base_url: str) -> httpx.AsyncClient:
+    '''Shared httpx.AsyncClient for an endpoint on the running event loop.'''
+    name = base_url.rstrip("/")
+    key = (name, _loop_id())
+    with _lock:
+        client = _http_clients.get(key)
+        if client is None:
+            client = _http_clients[key] = httpx.AsyncClient(**_client_kwargs(_connection_stats(name), is_async=True))
+            logger.info(f"Created shared async HTTP pool: endpoint={name}, http2={use_http2()}, limits={http_limits()}")
+        return client
+
+
+def get_azure_openai_client(endpoint: str, api_key: str, api_version: str):
+    '''Shared AzureOpenAI client for (endpoint, api_version, api_key).'''
+    from openai import AzureOpenAI
+
+    key = ("azure", endpoint, api_version, credential_fingerprint(api_key))
+    with _lock:
+        client = _api_clients.get(key)
+    if client is None:
+        http_client = get_http_client(endpoint)
+        with _lock:
+            client = _api_clients.get(key)
+            if client is None:
+                client = AzureOpenAI(
+                    azure_endpoint=endpoint,
+                    api_key=api_key,
+                    api_version=api_version,
+                    timeout=http_timeout(),
+                    # retries are handled by llm/resilience.py; SDK retries would multiply them
+                    max_retries=0,
+                    http_client=http_client
+                )
+                _api_clients[key] = client
+                logger.info(f"Created shared AzureOpenAI client: endpoint={endpoint}, apiver={api_version}, key={key[3]}")
+    return client
+
+
+def get_async_azure_openai_client(endpoint: str, api_key: str, api_version: str):
+    '''Shared AsyncAzureOpenAI client for (endpoint, api_version, api_key) on the running event loop.'''
+    from openai import AsyncAzureOpenAI
+
+    key = ("azure-async", endpoint, api_version, credential_fingerprint(api_key), _loop_id())
+    with _lock:
+        client = _api_clients.get(key)
+    if client is None:
+        http_client = get_async_http_client(endpoint)
+        with _lock:
+            client = _api_clients.get(key)
+            if client is None:
+                client = AsyncAzureOpenAI(
+                    azure_endpoint=endpoint,
+                    api_key=api_key,
+                    api_version=api_version,
+                    timeout=http_timeout(),
+                    # retries are handled by llm/resilience.py; SDK retries would multiply them
+                    max_retries=0,
+                    http_client=http_client
+                )
+                _api_clients[key] = client
+                logger.info(f"Created shared AsyncAzureOpenAI client: endpoint={endpoint}, apiver={api_version}, key={key[3]}")
+    return client
+
+
+def get_ollama_client(host: str):
+    '''
+    Shared ollama.Client for a host. ollama builds its own httpx.Client from
+    the keyword arguments, so the same pool settings and counters are passed in.
+    '''
+    from ollama import Client
+
+    key = ("ollama", host)
+    with _lock:
+        client = _api_clients.get(key)
+        if client is None:
+            client = Client(host=host, **_client_kwargs(_connection_stats(host.rstrip("/"))))
+            _api_clients[key] = client
+            logger.info(f"Created shared Ollama client: host={host}, http2={use_http2()}")
+    return client
+
+
+def get_async_ollama_client(host: str):
+    '''Shared ollama.AsyncClient for a host on the running event loop.'''
+    from ollama import AsyncClient
+
+    key = ("ollama-async", host, _loop_id())
+    with _lock:
+        client = _api_clients.get(key)
+        if client is None:
+            client = AsyncClient(host=host, **_client_kwargs(_connection_stats(host.rstrip("/")), is_async=True))
+            _api_clients[key] = client
+            logger.info(f"Created shared async Ollama client: host={host}, http2={use_http2()}")
+    return client
+
+
+def client_stats() -> List[dict]:
+    '''Connection reuse counters for every endpoint with a shared pool.'''
+    with _lock:
+        entries = list(_stats.values())
+    return [stats.stats for stats in entries]
+
+
+def close_clients():
+    '''Close the sync pools and forget every client (async pools close with their loop).'''
+    with _lock:
+        for http_client in _http_clients.values():
+            if isinstance(http_client, httpx.Client):
+                http_client.close()
+        _http_clients.clear()
+        _api_clients.clear()
+
+
+if __name__=='__main__':
+    # Connection reuse against a public endpoint: one TLS handshake, the rest reused
+    client = get_http_client("https://www.example.com")
+    for _ in range(5):
+        client.get("https://www.example.com/")
+    print(client_stats())
@@ -1,16 +1,35 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import List, Dict
+from typing import AsyncIterator, List, Dict
 
 class LLMBase(ABC):
 
+    # Token usage of the most recent completion, when the backend reports it:
+    # {"prompt_tokens", "completion_tokens", "cached_tokens"} (cached_tokens is None
+    # if the provider has no prompt cache). Backends are per session, so this is too.
+    last_usage: Dict | None = None
+
     @abstractmethod
     def generate_text(self, messages: List[Dict], model: str|None,  temperature: float|None):
         pass
-          
+
     @abstractmethod
     def generate_stream(self, messages: List[Dict], model: str|None,  temperature: float|None):
         pass
 
+    # Async contract. Backends with a native async client override these; the
+    # defaults run the sync methods on worker threads so every backend supports both.
+    async def agenerate_text(self, messages: List[Dict], model: str|None=None,  temperature: float|None=None) -> str:
+        return await asyncio.to_thread(self.generate_text, messages, model, temperature)
+
+    async def agenerate_stream(self, messages: List[Dict], model: str|None=None,  temperature: float|None=None) -> AsyncIterator[str]:
+        stream = self.generate_stream(messages, model, temperature)
+        done = object()
+        while True:
+            chunk = await asyncio.to_thread(next, stream, done)
+            if chunk is done:
+                break
+            yield chunk
 
     @abstractmethod
     def model(self):
@@ -21,4 +40,4 @@ class LLMBase(ABC):
         pass
 
 if __name__=='__main__':
-    pass
\ No newline at end of file
+    pass
@@ -1,15 +1,22 @@
 from loguru import logger
 
-from ollama import Client
-
 if __name__=='__main__':
     from llmbase import LLMBase
+    from clients import get_async_ollama_client, get_ollama_client
 else:
     from .llmbase import LLMBase
+    from .clients import get_async_ollama_client, get_ollama_client
 
 from typing import List, Dict
 
 
+def _usage(response) -> Dict | None:
+    '''Token counts from the final (done) response; Ollama has no prompt cache to report.'''
+    if not response['done']:
+        return None
+    return {"prompt_tokens": response['prompt_eval_count'], "completion_tokens": response['eval_count'], "cached_tokens": None}
+
+
 class OllamaLLM(LLMBase):
 
     def __init__(
@@ -21,9 +28,8 @@ class OllamaLLM(LLMBase):
         self.__host_url = host_url  
         self._model = model
         self._temperature = temperature
-        self._client = Client(
-            host=host_url
-        )
+        # shared per host so sessions reuse pooled connections
+        self._client = get_ollama_client(host_url)
         logger.info(f"host={self.__host_url}, model={model}, temperature={temperature}")
 
     @property
@@ -45,21 +51,51 @@ class OllamaLLM(LLMBase):
             options={"temperature": this_temperature} 
         )
         
+        self.last_usage = None
         for chunk in response:
+            self.last_usage = _usage(chunk) or self.last_usage
             content = chunk['message']['content']
             yield content
 
-    def generate_text(self, messages: List[Dict], model: str|None=None,  tempeature: float|None=None):
+    def generate_text(self, messages: List[Dict], model: str|None=None,  temperature: float|None=None):
         this_model = model if model != None else self._model
-        this_temperature = tempeature if tempeature != None else self._temperature
+        this_temperature = temperature if temperature != None else self._temperature
         logger.info(f"host={self.__host_url}, model={this_model}, temperature={this_temperature}")
         response = self._client.chat(
             model=this_model,
             messages=messages,
             options={"temperature": this_temperature} 
         )
+        self.last_usage = _usage(response)
         content = response['message']['content']
         return content 
+
+    async def agenerate_stream(self, messages: List[Dict], model: str|None=None,  temperature: float|None=None):
+        this_model = model if model != None else self._model
+        this_temperature = temperature if temperature != None else self._temperature
+        logger.info(f"host={self.__host_url}, model={this_model}, temperature={this_temperature}, async=True")
+        response = await get_async_ollama_client(self.__host_url).chat(
+            stream=True,
+            model=this_model,
+            messages=messages,
+            options={"temperature": this_temperature}
+        )
+        self.last_usage = None
+        async for chunk in response:
+            self.last_usage = _usage(chunk) or self.last_usage
+            yield chunk['message']['content']
+
+    async def agenerate_text(self, messages: List[Dict], model: str|None=None,  temperature: float|None=None):
+        this_model = model if model != None else self._model
+        this_temperature = temperature if temperature != None else self._temperature
+        logger.info(f"host={self.__host_url}, model={this_model}, temperature={this_temperature}, async=True")
+        response = await get_async_ollama_client(self.__host_url).chat(
+            model=this_model,
+            messages=messages,
+            options={"temperature": this_temperature}
+        )
+        self.last_usage = _usage(response)
+        return response['message']['content']
           
 
 if __name__=='__main__':
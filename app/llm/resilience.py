@@ -0,0 +1,383 @@
+'''
+Retries and circuit breaking for LLM calls.
+
+ResilientLLM wraps any LLMBase. Transient failures (timeouts, connection
+errors, 408/409/429 and 5xx responses) are retried with decorrelated-jitter
+backoff, waiting at least as long as the server's Retry-After header asks.
+A stream is only retried if it failed before the first token was emitted;
+after that the student has seen part of the answer, so the error is raised.
+
+A circuit breaker per backend opens after failure_threshold consecutive
+failed calls (a call that used up its retries counts once) and rejects calls
+immediately (CircuitOpenError) for reset_timeout seconds, then lets one trial
+call through. A cancelled trial gives its slot back.
+
+The OpenAI SDK's own retries are disabled in llm/clients.py so attempts don't
+multiply. tests/test_resilience.py exercises the policy against a local
+fake chat server.
+'''
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, List
+
+from loguru import logger
+
+if __name__=='__main__':
+    from llmbase import LLMBase
+else:
+    from .llmbase import LLMBase
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class RetryPolicy:
+
+    def __init__(
+            self,
+            max_attempts: int = 3,
+            base_delay: float = 0.5,
+            max_delay: float = 20.0,
+            failure_threshold: int = 5,
+            reset_timeout: float = 30.0
+        ):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+    def next_delay(self, previous: float, retry_after: float | None = None) -> float:
+        '''Decorrelated jitter: uniform(base, previous * 3), capped; never shorter than Retry-After.'''
+        delay = min(self.max_delay, random.uniform(self.base_delay, max(self.base_delay, previous * 3)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def __repr__(self):
+        return (f"RetryPolicy(max_attempts={self.max_attempts}, base_delay={self.base_delay}, max_delay={self.max_delay}, "
+                f"failure_threshold={self.failure_threshold}, reset_timeout={self.reset_timeout})")
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    '''closed -> open after failure_threshold consecutive failures -> half-open after reset_timeout.'''
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial_in_flight = False
+        self._stats = {"opened": 0, "rejected": 0}
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self._opened_at >= self.reset_timeout else "open"
+
+    def allow(self) -> bool:
+        '''Raise CircuitOpenError unless a call may go through now. Returns True if the call is the half-open trial.'''
+        if self.failure_threshold <= 0:
+            return False
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return False
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self._stats["rejected"] += 1
+        raise CircuitOpenError(f"Circuit open for {self.name}: AI service unavailable, retry in {self.reset_timeout:.0f}s")
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"Circuit closed for {self.name}")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def abandon(self):
+        '''The call ended without a verdict (e.g. the consumer stopped reading); free the trial slot.'''
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self.failure_threshold > 0 and self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    self._stats["opened"] += 1
+                    logger.error(f"Circuit opened for {self.name} after {self._failures} consecutive failures")
+                # a failed half-open trial restarts the timeout
+                self._opened_at = time.monotonic()
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["consecutive_failures"] = self._failures
+        stats["name"] = self.name
+        stats["state"] = self.state
+        return stats
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(name: str, failure_threshold: int = 5, reset_timeout: float = 30.0) -> CircuitBreaker:
+    '''Process-wide breaker per backend, so every session sees the same state.'''
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, failure_threshold, reset_timeout)
+        else:
+            breaker.failure_threshold = failure_threshold
+            breaker.reset_timeout = reset_timeout
+        return breaker
+
+
+def circuit_stats() -> List[dict]:
+    with _breakers_lock:
+        return [b.stats for b in _breakers.values()]
+
+
+def _status_code(error: Exception) -> int | None:
+    status = getattr(error, "status_code", None)
+    if status is None and getattr(error, "response", None) is not None:
+        status = getattr(error.response, "status_code", None)
+    return status
+
+
+def is_retryable(error: Exception) -> bool:
+    '''Timeouts, connection failures and throttling / server errors.'''
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, (TimeoutError, ConnectionError, asyncio.TimeoutError)):
+        return True
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS or status >= 500
+    # openai.APIConnectionError / APITimeoutError, httpx.TransportError (incl. RemoteProtocolError)
+    return any(cls.__name__ in ("APIConnectionError", "APITimeoutError", "TransportError") for cls in type(error).__mro__)
+
+
+def retry_after(error: Exception) -> float | None:
+    '''Seconds requested by Retry-After / retry-after-ms on the error's response, if any.'''
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+class ResilientLLM(LLMBase):
+
+    def __init__(self, llm: LLMBase, policy: RetryPolicy | None = None, name: str | None = None):
+        self._llm = llm
+        self._policy = policy or RetryPolicy()
+        self._breaker = get_circuit_breaker(
+            name or type(llm).__name__,
+            failure_threshold=self._policy.failure_threshold,
+            reset_timeout=self._policy.reset_timeout
+        )
+
+    @property
+    def model(self):
+        return self._llm.model
+
+    @property
+    def temperature(self):
+        return self._llm.temperature
+
+    @property
+    def last_usage(self):
+        return self._llm.last_usage
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        return self._breaker
+
+    def _should_retry(self, error: Exception, attempt: int, emitted: bool) -> bool:
+        '''Whether to try again; once the call has failed for good, it counts once against the breaker.'''
+        retryable = is_retryable(error)
+        retry = not emitted and attempt < self._policy.max_attempts and retryable
+        if not retry:
+            if retryable:
+                self._breaker.record_failure()
+            else:
+                # e.g. 400 / content filter: the service is up, the request was the problem
+                self._breaker.record_success()
+        logger.warning(f"LLM call failed: backend={self._breaker.name}, attempt={attempt}/{self._policy.max_attempts}, "
+                       f"emitted={emitted}, retry={retry}, error={type(error).__name__}: {error}")
+        return retry
+
+    # The breaker is consulted once per call and its retries happen inside it,
+    # so a half-open trial keeps its slot while it retries.
+
+    def generate_text(self, messages, model=None, temperature=None):
+        trial = self._breaker.allow()
+        try:
+            delay = self._policy.base_delay
+            for attempt in range(1, self._policy.max_attempts + 1):
+                try:
+                    result = self._llm.generate_text(messages, model, temperature)
+                    self._breaker.record_success()
+                    return result
+                except Exception as e:
+                    if not self._should_retry(e, attempt, emitted=False):
+                        raise
+                    delay = self._policy.next_delay(delay, retry_after(e))
+                    time.sleep(delay)
+        except Exception:
+            # the verdict was recorded in _should_retry
+            raise
+        except BaseException:
+            # cancelled, interrupted or closed: no verdict, so give the trial slot back
+            if trial:
+                self._breaker.abandon()
+            raise
+
+    def generate_stream(self, messages, model=None, temperature=None):
+        trial = self._breaker.allow()
+        try:
+            delay = self._policy.base_delay
+            for attempt in range(1, self._policy.max_attempts + 1):
+                emitted = False
+                try:
+                    for chunk in self._llm.generate_stream(messages, model, temperature):
+                        emitted = emitted or bool(chunk)
+                        yield chunk
+                    self._breaker.record_success()
+                    return
+                except Exception as e:
+                    if not self._should_retry(e, attempt, emitted):
+                        raise
+                    delay = self._policy.next_delay(delay, retry_after(e))
+                    time.sleep(delay)
+        except Exception:
+            # the verdict was recorded in _should_retry
+            raise
+        except BaseException:
+            # cancelled, interrupted or closed: no verdict, so give the trial slot back
+            if trial:
+                self._breaker.abandon()
+            raise
+
+    async def agenerate_text(self, messages, model=None, temperature=None):
+        trial = self._breaker.allow()
+        try:
+            delay = self._policy.base_delay
+            for attempt in range(1, self._policy.max_attempts + 1):
+                try:
+                    result = await self._llm.agenerate_text(messages, model, temperature)
+                    self._breaker.record_success()
+                    return result
+                except Exception as e:
+                    if not self._should_retry(e, attempt, emitted=False):
+                        raise
+                    delay = self._policy.next_delay(delay, retry_after(e))
+                    await asyncio.sleep(delay)
+        except Exception:
+            # the verdict was recorded in _should_retry
+            raise
+        except BaseException:
+            # cancelled, interrupted or closed: no verdict, so give the trial slot back
+            if trial:
+                self._breaker.abandon()
+            raise
+
+    async def agenerate_stream(self, messages, model=None, temperature=None):
+        trial = self._breaker.allow()
+        try:
+            delay = self._policy.base_delay
+            for attempt in range(1, self._policy.max_attempts + 1):
+                emitted = False
+                try:
+                    async for chunk in self._llm.agenerate_stream(messages, model, temperature):
+                        emitted = emitted or bool(chunk)
+                        yield chunk
+                    self._breaker.record_success()
+                    return
+                except Exception as e:
+                    if not self._should_retry(e, attempt, emitted):
+                        raise
+                    delay = self._policy.next_delay(delay, retry_after(e))
+                    await asyncio.sleep(delay)
+        except Exception:
+            # the verdict was recorded in _should_retry
+            raise
+        except BaseException:
+            # cancelled, interrupted or closed: no verdict, so give the trial slot back
+            if trial:
+                self._breaker.abandon()
+            raise
+
+if __name__=='__main__':
+
+    class FlakyLLM(LLMBase):
+        '''Fails with the given status codes, one per call, then streams the answer.'''
+
+        def __init__(self, statuses):
+            self._statuses = list(statuses)
+            self.calls = 0
+
+        @property
+        def model(self):
+            return "flaky"
+
+        @property
+        def temperature(self):
+            return 0.0
+
+        def generate_stream(self, messages, model=None, temperature=None):
+            self.calls += 1
+            if self._statuses:
+                error = Exception(f"fake error {self._statuses[0]}")
+                error.status_code = self._statuses.pop(0)
+                raise error
+            for word in "Albany is the capital.".split(" "):
+                yield word + " "
+
+        def generate_text(self, messages, model=None, temperature=None):
+            return "".join(self.generate_stream(messages, model, temperature))
+
+    messages = [{"role": "user", "content": "What is the capital of New York?"}]
+    policy = RetryPolicy(max_attempts=4, base_delay=0.2, max_delay=2.0, failure_threshold=3, reset_timeout=2.0)
+
+    # 429, then 503, then a good stream: recovers on the third attempt
+    flaky = FlakyLLM([429, 503])
+    llm = ResilientLLM(flaky, policy, name="flaky-1")
+    start = time.perf_counter()
+    print("".join(llm.generate_stream(messages)), f"({time.perf_counter() - start:.1f}s, calls={flaky.calls})")
+
+    # persistent 500s: each call that runs out of retries is one failure, the third opens the circuit
+    flaky = FlakyLLM([500] * 20)
+    llm = ResilientLLM(flaky, policy, name="flaky-2")
+    for _ in range(4):
+        try:
+            llm.generate_text(messages)
+        except Exception as e:
+            print(f"{type(e).__name__}: {e} (calls={flaky.calls})")
+    print(llm.breaker.stats)
@@ -0,0 +1,411 @@
+'''
+LLMBase that routes each request across several backends.
+
+Each request goes to the healthy backend with the lowest latency / weight,
+where latency is a moving average of time-to-first-token. A backend that
+fails is marked unhealthy for cooldown seconds and the request moves on to
+the next backend straight away, as long as no text has been emitted yet;
+routes should therefore not retry on their own (ResilientLLM with
+max_attempts=1). Only when every backend has failed with a retryable error
+does the router back off (per its RetryPolicy, honouring Retry-After) and
+try them all again. The conversation
+history lives in LLMAPI and is sent with every request, so switching backends
+mid-session loses nothing.
+
+Backend health and latency are shared by every RoutingLLM in the process, so
+one session's failure steers the others away too. start_health_checks adds
+periodic probes of every backend registered with it, so a recovered backend
+comes back before its cooldown ends. Probes go through backend objects of
+their own (last_usage belongs to the session being served) and only set
+health, never the latency average. last_route names the
+backend/model that served the most recent request (logged in LogModel.model).
+'''
+import asyncio
+import threading
+import time
+from typing import Dict, List, NamedTuple
+
+from loguru import logger
+
+if __name__=='__main__':
+    import os
+    import sys
+    # resilience imports relatively, so load the package rather than the sibling files
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from llm.llmbase import LLMBase
+    from llm.aio import get_loop
+    from llm.resilience import RetryPolicy, is_retryable, retry_after
+else:
+    from .llmbase import LLMBase
+    from .aio import get_loop
+    from .resilience import RetryPolicy, is_retryable, retry_after
+
+
+class Route(NamedTuple):
+    name: str
+    llm: LLMBase
+    weight: float = 1.0
+
+
+class BackendHealth:
+
+    def __init__(self, name: str, cooldown: float = 30.0, smoothing: float = 0.2):
+        self.name = name
+        self.cooldown = cooldown
+        self._smoothing = smoothing
+        self._lock = threading.Lock()
+        self.latency_ms: float | None = None
+        self._unhealthy_until = 0.0
+        self._stats = {"requests": 0, "failures": 0, "failovers_from": 0, "probes": 0, "probe_failures": 0, "last_error": ""}
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self._unhealthy_until
+
+    def record_latency(self, latency_ms: float):
+        with self._lock:
+            self._stats["requests"] += 1
+            self.latency_ms = latency_ms if self.latency_ms is None else (1 - self._smoothing) * self.latency_ms + self._smoothing * latency_ms
+            self._unhealthy_until = 0.0
+
+    def record_failure(self, error: Exception, failover: bool):
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["failures"] += 1
+            self._stats["failovers_from"] += int(failover)
+            self._stats["last_error"] = f"{type(error).__name__}: {error}"[:200]
+            self._unhealthy_until = time.monotonic() + self.cooldown
+
+    def record_probe(self, error: Exception | None = None):
+        '''A health check result: a whole short completion, not a time to first token, so latency is left alone.'''
+        with self._lock:
+            self._stats["probes"] += 1
+            if error is None:
+                self._unhealthy_until = 0.0
+                return
+            self._stats["probe_failures"] += 1
+            self._stats["last_error"] = f"{type(error).__name__}: {error}"[:200]
+            self._unhealthy_until = time.monotonic() + self.cooldown
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["name"] = self.name
+        stats["healthy"] = self.healthy
+        stats["latency_ms"] = round(self.latency_ms, 1) if self.latency_ms is not None else None
+        return stats
+
+
+_health: Dict[str, BackendHealth] = {}
+_health_lock = threading.Lock()
+
+def get_backend_health(name: str, cooldown: float = 30.0) -> BackendHealth:
+    with _health_lock:
+        health = _health.get(name)
+        if health is None:
+            health = _health[name] = BackendHealth(name, cooldown)
+        return health
+
+
+def routing_stats() -> List[dict]:
+    with _health_lock:
+        return [h.stats for h in _health.values()]
+
+
+class RoutingLLM(LLMBase):
+
+    def __init__(self, routes: List[Route], cooldown: float = 30.0, policy: RetryPolicy | None = None):
+        '''
+        Args:
+            routes: backends to route across, the first is the primary
+            cooldown: seconds a failed backend is ranked last
+            policy: passes over all routes (max_attempts) and the backoff between
+                them; the default makes a single pass
+        '''
+        if not routes:
+            raise ValueError("RoutingLLM needs at least one route")
+        self._routes = routes
+        self._policy = policy or RetryPolicy(max_attempts=1)
+        self._health = {route.name: get_backend_health(route.name, cooldown) for route in routes}
+        self._last_route = None
+        self._served: LLMBase | None = None
+        logger.info(f"RoutingLLM routes={[(r.name, r.llm.model, r.weight) for r in routes]}, cooldown={cooldown}, policy={self._policy}")
+
+    @property
+    def model(self):
+        return self._routes[0].llm.model
+
+    @property
+    def temperature(self):
+        return self._routes[0].llm.temperature
+
+    @property
+    def last_route(self) -> str | None:
+        '''"<backend>/<model>" that served the most recent request.'''
+        return self._last_route
+
+    @property
+    def last_usage(self):
+        return self._served.last_usage if self._served is not None else None
+
+    def _ranked(self) -> List[Route]:
+        '''
+        Healthy routes fastest first (latency / weight, heavier first on a tie), then
+        unhealthy ones as a last resort. A route with no latency yet is scored with
+        the average of the others, so its weight decides where it goes.
+        '''
+        measured = [h.latency_ms for h in self._health.values() if h.latency_ms is not None]
+        typical = sum(measured) / len(measured) if measured else 0.0
+
+        def score(route: Route):
+            latency = self._health[route.name].latency_ms
+            return (typical if latency is None else latency) / max(route.weight, 1e-6), -route.weight
+        healthy = sorted((r for r in self._routes if r.weight > 0 and self._health[r.name].healthy), key=score)
+        unhealthy = sorted((r for r in self._routes if r not in healthy), key=lambda r: self._health[r.name]._unhealthy_until)
+        return healthy + unhealthy
+
+    def _model_for(self, route: Route, model: str | None) -> str:
+        # the caller's model name belongs to the primary backend; other backends use their own
+        return model if model is not None and model != self.model else route.llm.model
+
+    def _failed(self, route: Route, error: Exception, remaining: int):
+        self._health[route.name].record_failure(error, failover=remaining > 0)
+        logger.warning(f"Route failed: backend={route.name}, failover={remaining > 0}, error={type(error).__name__}: {error}")
+
+    def _chosen(self, route: Route, model: str, start: float):
+        self._health[route.name].record_latency((time.perf_counter() - start) * 1000)
+        self._last_route = f"{route.name}/{model}"
+        self._served = route.llm
+        logger.info(f"Routed request: route={self._last_route}, latency_ms={self._health[route.name].latency_ms:.0f}")
+
+    def _retry_pass(self, error: Exception, attempt: int) -> bool:
+        '''Every route failed this pass: go round again if the last error was transient.'''
+        retry = attempt < self._policy.max_attempts and is_retryable(error)
+        logger.warning(f"All routes failed: attempt={attempt}/{self._policy.max_attempts}, retry={retry}, error={type(error).__name__}: {error}")
+        return retry
+
+    def _text_pass(self, messages, model, temperature):
+        ranked = self._ranked()
+        for i, route in enumerate(ranked):
+            this_model = self._model_for(route, model)
+            start = time.perf_counter()
+            try:
+                result = route.llm.generate_text(messages, this_model, temperature)
+            except Exception as e:
+                self._failed(route, e, len(ranked) - i - 1)
+                if i == len(ranked) - 1:
+                    raise
+                continue
+            self._chosen(route, this_model, start)
+            return result
+
+    def _stream_pass(self, messages, model, temperature):
+        ranked = self._ranked()
+        for i, route in enumerate(ranked):
+            this_model = self._model_for(route, model)
+            start = time.perf_counter()
+            emitted = False
+            try:
+                for chunk in route.llm.generate_stream(messages, this_model, temperature):
+                    if not emitted and chunk:
+                        emitted = True
+                        self._chosen(route, this_model, start)
+                    yield chunk
+                if not emitted:
+                    self._chosen(route, this_model, start)
+                return
+            except GeneratorExit:
+                raise
+            except Exception as e:
+                self._failed(route, e, 0 if emitted else len(ranked) - i - 1)
+                if emitted or i == len(ranked) - 1:
+                    raise
+
+    async def _atext_pass(self, messages, model, temperature):
+        ranked = self._ranked()
+        for i, route in enumerate(ranked):
+            this_model = self._model_for(route, model)
+            start = time.perf_counter()
+            try:
+                result = await route.llm.agenerate_text(messages, this_model, temperature)
+            except Exception as e:
+                self._failed(route, e, len(ranked) - i - 1)
+                if i == len(ranked) - 1:
+                    raise
+                continue
+            self._chosen(route, this_model, start)
+            return result
+
+    async def _astream_pass(self, messages, model, temperature):
+        ranked = self._ranked()
+        for i, route in enumerate(ranked):
+            this_model = self._model_for(route, model)
+            start = time.perf_counter()
+            emitted = False
+            try:
+                async for chunk in route.llm.agenerate_stream(messages, this_model, temperature):
+                    if not emitted and chunk:
+                        emitted = True
+                        self._chosen(route, this_model, start)
+                    yield chunk
+                if not emitted:
+                    self._chosen(route, this_model, start)
+                return
+            except (GeneratorExit, asyncio.CancelledError):
+                raise
+            except Exception as e:
+                self._failed(route, e, 0 if emitted else len(ranked) - i - 1)
+                if emitted or i == len(ranked) - 1:
+                    raise
+
+    def generate_text(self, messages, model=None, temperature=None):
+        delay = self._policy.base_delay
+        for attempt in range(1, self._policy.max_attempts + 1):
+            try:
+                return self._text_pass(messages, model, temperature)
+            except Exception as e:
+                if not self._retry_pass(e, attempt):
+                    raise
+                delay = self._policy.next_delay(delay, retry_after(e))
+                time.sleep(delay)
+
+    def generate_stream(self, messages, model=None, temperature=None):
+        delay = self._policy.base_delay
+        for attempt in range(1, self._policy.max_attempts + 1):
+            emitted = False
+            try:
+                for chunk in self._stream_pass(messages, model, temperature):
+                    emitted = emitted or bool(chunk)
+                    yield chunk
+                return
+            except GeneratorExit:
+                raise
+            except Exception as e:
+                if emitted or not self._retry_pass(e, attempt):
+                    raise
+                delay = self._policy.next_delay(delay, retry_after(e))
+                time.sleep(delay)
+
+    async def agenerate_text(self, messages, model=None, temperature=None):
+        delay = self._policy.base_delay
+        for attempt in range(1, self._policy.max_attempts + 1):
+            try:
+                return await self._atext_pass(messages, model, temperature)
+            except Exception as e:
+                if not self._retry_pass(e, attempt):
+                    raise
+                delay = self._policy.next_delay(delay, retry_after(e))
+                await asyncio.sleep(delay)
+
+    async def agenerate_stream(self, messages, model=None, temperature=None):
+        delay = self._policy.base_delay
+        for attempt in range(1, self._policy.max_attempts + 1):
+            emitted = False
+            try:
+                async for chunk in self._astream_pass(messages, model, temperature):
+                    emitted = emitted or bool(chunk)
+                    yield chunk
+                return
+            except (GeneratorExit, asyncio.CancelledError):
+                raise
+            except Exception as e:
+                if emitted or not self._retry_pass(e, attempt):
+                    raise
+                delay = self._policy.next_delay(delay, retry_after(e))
+                await asyncio.sleep(delay)
+
+
+async def check_routes(routes: List[Route], timeout: float = 10.0) -> Dict[str, bool]:
+    '''
+    Probe every route with a one-word completion, concurrently. Updates the
+    shared health (not latency), so a recovered backend is used again before its
+    cooldown ends. The routes' backends should not be ones a router serves
+    requests with: a probe overwrites its backend's last_usage.
+    Returns backend name -> healthy.
+    '''
+    probe = [{"role": "user", "content": "Reply with the word OK."}]
+
+    async def check(route: Route) -> bool:
+        health = get_backend_health(route.name)
+        try:
+            await asyncio.wait_for(route.llm.agenerate_text(probe, route.llm.model, 0.0), timeout)
+        except Exception as e:
+            health.record_probe(e)
+            return False
+        health.record_probe()
+        return True
+
+    results = await asyncio.gather(*(check(route) for route in routes))
+    return {route.name: ok for route, ok in zip(routes, results)}
+
+
+# Backends probed by the health checks, by route name; the latest call to register a name wins
+_probe_routes: Dict[str, Route] = {}
+_health_task = None
+
+def start_health_checks(routes: List[Route], interval: float = 60.0):
+    '''
+    Probe these routes every interval seconds on the shared event loop. Pass routes
+    with the same names as a router's but backend objects of their own (they can
+    share its connection pools); see check_routes. The probe task is started once
+    per process (with the first interval); later calls only add their routes.
+    '''
+    global _health_task
+    with _health_lock:
+        if interval <= 0:
+            return
+        for route in routes:
+            _probe_routes[route.name] = route
+        if _health_task is not None:
+            return
+
+        async def loop():
+            while True:
+                await asyncio.sleep(interval)
+                with _health_lock:
+                    routes = list(_probe_routes.values())
+                try:
+                    results = await check_routes(routes)
+                    logger.debug(f"Route health: {results}")
+                except Exception as e:
+                    logger.error(f"Route health check failed: {e}")
+
+        _health_task = asyncio.run_coroutine_threadsafe(loop(), get_loop())
+
+
+if __name__=='__main__':
+
+    class FakeLLM(LLMBase):
+        '''Streams answer, or raises a 500 when answer is None.'''
+
+        def __init__(self, model, answer):
+            self._model = model
+            self._answer = answer
+
+        @property
+        def model(self):
+            return self._model
+
+        @property
+        def temperature(self):
+            return 0.0
+
+        def generate_stream(self, messages, model=None, temperature=None):
+            if self._answer is None:
+                error = Exception("fake error 500")
+                error.status_code = 500
+                raise error
+            yield from (word + " " for word in self._answer.split(" "))
+
+        def generate_text(self, messages, model=None, temperature=None):
+            return "".join(self.generate_stream(messages, model, temperature))
+
+    messages = [{"role": "user", "content": "What is the capital of New York?"}]
+    router = RoutingLLM([
+        Route("azure", FakeLLM("gpt-4o-mini", None), weight=2.0),
+        Route("ollama", FakeLLM("llama3", "Albany, from Ollama."), weight=1.0),
+    ])
+    for _ in range(2):
+        print("".join(router.generate_stream(messages)), "->", router.last_route)
+    print(routing_stats())
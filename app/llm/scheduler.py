@@ -0,0 +1,287 @@
+'''
+Process-wide scheduler in front of the LLM backends.
+
+Every completion asks the scheduler for a slot before it is sent. A slot is
+granted when:
+
+- fewer than max_concurrency completions are in flight,
+- the requests-per-minute bucket has a request left, and
+- the tokens-per-minute bucket covers the estimated tokens (prompt plus
+  expected completion; corrected with the real count when the slot is released).
+
+Waiting requests are queued per user and served round-robin across users, so
+a user with several requests queued waits behind everyone else's first
+request instead of in front of it. The scheduler lives on the shared LLM
+event loop (llm/aio.py); all of its methods except stats run on that loop.
+stats can be read from any thread: the queue state is copied on the loop.
+'''
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Callable, Deque, Optional
+
+from loguru import logger
+
+if __name__=='__main__':
+    from aio import get_loop
+else:
+    from .aio import get_loop
+
+
+class TokenBucket:
+    '''Refills at rate_per_minute / 60 per second up to one minute's worth. rate 0 = unlimited.'''
+
+    def __init__(self, rate_per_minute: float):
+        self.capacity = float(rate_per_minute)
+        self.level = self.capacity
+        self._rate = self.capacity / 60.0
+        self._updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def clamp(self, amount: float) -> float:
+        # a request bigger than the bucket could never be served
+        return amount if self.unlimited else min(amount, self.capacity)
+
+    def wait_time(self, amount: float) -> float:
+        '''Seconds until amount is available (0 if it is now).'''
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        return 0.0 if self.level >= amount else (amount - self.level) / self._rate
+
+    def consume(self, amount: float):
+        '''Take amount from the bucket; negative amounts give tokens back. May go into debt.'''
+        if self.unlimited:
+            return
+        self._refill()
+        self.level = min(self.capacity, self.level - amount)
+
+
+class Ticket:
+    '''A queued or granted request. Pass it back to release() when the completion ends.'''
+
+    def __init__(self, user_id: str, tokens: int):
+        self.user_id = user_id
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+        self.granted_at: Optional[float] = None
+        self.granted = asyncio.get_running_loop().create_future()
+
+    @property
+    def wait_seconds(self) -> float:
+        return (self.granted_at or time.monotonic()) - self.enqueued_at
+
+
+class LLMScheduler:
+
+    def __init__(
+            self,
+            max_concurrency: int = 16,
+            requests_per_minute: int = 0,
+            tokens_per_minute: int = 0,
+            expected_completion_tokens: int = 500
+        ):
+        self.max_concurrency = max_concurrency
+        self.expected_completion_tokens = expected_completion_tokens
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        # user_id -> that user's waiting tickets; dict order is the round-robin order
+        self._queues: "OrderedDict[str, Deque[Ticket]]" = OrderedDict()
+        self._active = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # the loop the queues live on (set by the first enqueue); stats reads them there
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stats_lock = threading.Lock()
+        self._waits: Deque[float] = deque(maxlen=1000)
+        self._stats = {"granted": 0, "cancelled": 0, "total_wait_ms": 0.0, "max_wait_ms": 0.0}
+        logger.info(f"LLMScheduler max_concurrency={max_concurrency}, rpm={requests_per_minute}, tpm={tokens_per_minute}")
+
+    # ---- queue ----
+
+    def _waiting(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def position(self, ticket: Ticket) -> int:
+        '''1-based place in line under round-robin service (0 once granted).'''
+        if ticket.granted.done():
+            return 0
+        queues = [list(q) for q in self._queues.values()]
+        place = 0
+        for depth in range(max((len(q) for q in queues), default=0)):
+            for q in queues:
+                if depth < len(q):
+                    place += 1
+                    if q[depth] is ticket:
+                        return place
+        return 0
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._queues and self._active < self.max_concurrency:
+            user_id, queue = next(iter(self._queues.items()))
+            ticket = queue[0]
+            delay = max(self._requests.wait_time(1), self._tokens.wait_time(ticket.tokens))
+            if delay > 0:
+                # wake up when the buckets have refilled enough for the next request
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+            queue.popleft()
+            del self._queues[user_id]
+            if queue:
+                self._queues[user_id] = queue  # back of the round-robin order
+            self._requests.consume(1)
+            self._tokens.consume(ticket.tokens)
+            self._active += 1
+            ticket.granted_at = time.monotonic()
+            ticket.granted.set_result(True)
+            self._record_wait(ticket)
+
+    def _record_wait(self, ticket: Ticket):
+        wait_ms = ticket.wait_seconds * 1000
+        with self._stats_lock:
+            self._stats["granted"] += 1
+            self._stats["total_wait_ms"] += wait_ms
+            self._stats["max_wait_ms"] = max(self._stats["max_wait_ms"], wait_ms)
+            self._waits.append(wait_ms)
+        if wait_ms > 1000:
+            logger.info(f"LLM request waited: user={ticket.user_id}, wait_ms={wait_ms:.0f}, active={self._active}, waiting={self._waiting()}")
+
+    def _remove(self, ticket: Ticket):
+        queue = self._queues.get(ticket.user_id)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del self._queues[ticket.user_id]
+
+    # ---- public ----
+
+    def enqueue(self, user_id: str, prompt_tokens: int) -> Ticket:
+        '''Queue a request; prompt_tokens plus expected_completion_tokens is its token estimate.'''
+        ticket = Ticket(user_id, int(self._tokens.clamp(prompt_tokens + self.expected_completion_tokens)))
+        self._loop = asyncio.get_running_loop()
+        self._queues.setdefault(user_id, deque()).append(ticket)
+        self._dispatch()
+        return ticket
+
+    async def wait(self, ticket: Ticket, poll: float = 1.0) -> AsyncIterator[int]:
+        '''
+        Yield the ticket's place in line every poll seconds until it is granted.
+        Closing or cancelling the iterator before then gives up the place.
+        '''
+        try:
+            while not ticket.granted.done():
+                yield self.position(ticket)
+                try:
+                    await asyncio.wait_for(asyncio.shield(ticket.granted), timeout=poll)
+                except asyncio.TimeoutError:
+                    pass
+        except (asyncio.CancelledError, GeneratorExit):
+            if not ticket.granted.done():
+                self._remove(ticket)
+                with self._stats_lock:
+                    self._stats["cancelled"] += 1
+            else:
+                self.release(ticket)
+            raise
+
+    async def acquire(self, user_id: str, prompt_tokens: int, on_position: Callable[[int], None] | None = None) -> Ticket:
+        '''Wait for a slot, reporting the place in line to on_position. Returns the ticket for release().'''
+        ticket = self.enqueue(user_id, prompt_tokens)
+        async for position in self.wait(ticket):
+            if on_position:
+                on_position(position)
+        return ticket
+
+    def release(self, ticket: Ticket, actual_tokens: int | None = None):
+        '''Free the slot; actual_tokens (prompt + completion) corrects the token bucket.'''
+        if actual_tokens is not None:
+            self._tokens.consume(actual_tokens - ticket.tokens)
+        self._active = max(0, self._active - 1)
+        self._dispatch()
+
+    def release_threadsafe(self, ticket: Ticket, actual_tokens: int | None = None):
+        get_loop().call_soon_threadsafe(self.release, ticket, actual_tokens)
+
+    def _queue_state(self) -> dict:
+        return {
+            "active": self._active,
+            "waiting": self._waiting(),
+            "waiting_users": len(self._queues),
+            "requests_available": None if self._requests.unlimited else round(self._requests.level, 1),
+            "tokens_available": None if self._tokens.unlimited else round(self._tokens.level)
+        }
+
+    async def _aqueue_state(self) -> dict:
+        return self._queue_state()
+
+    def _queue_snapshot(self, timeout: float = 2.0) -> dict:
+        '''The queue state, copied on the scheduler's loop when called from another thread.'''
+        loop = self._loop
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if loop is None or running is loop or not loop.is_running():
+            return self._queue_state()
+        return asyncio.run_coroutine_threadsafe(self._aqueue_state(), loop).result(timeout)
+
+    @property
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+            waits = sorted(self._waits)
+        stats.update(self._queue_snapshot())
+        stats["max_concurrency"] = self.max_concurrency
+        stats["avg_wait_ms"] = stats["total_wait_ms"] / stats["granted"] if stats["granted"] else 0.0
+        stats["p95_wait_ms"] = waits[int(len(waits) * 0.95)] if waits else 0.0
+        return stats
+
+
+_scheduler: LLMScheduler | None = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler(**kwargs) -> LLMScheduler:
+    '''The process-wide scheduler; kwargs are used only when it is first created.'''
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler(**kwargs)
+        return _scheduler
+
+
+def scheduler_stats() -> dict | None:
+    return _scheduler.stats if _scheduler is not None else None
+
+
+if __name__=='__main__':
+    # One heavy user with 6 requests and three light users with 1 each, 2 slots:
+    # the light users are served in the first rounds, not after the heavy user's queue.
+    async def main():
+        scheduler = LLMScheduler(max_concurrency=2)
+        order = []
+
+        async def request(user):
+            ticket = await scheduler.acquire(user, 100)
+            order.append(user)
+            await asyncio.sleep(0.05)
+            scheduler.release(ticket)
+
+        tasks = [asyncio.create_task(request("heavy")) for _ in range(6)]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(request(f"light{i}")) for i in range(3)]
+        await asyncio.gather(*tasks)
+        print(order)
+        print(scheduler.stats)
+
+    asyncio.run(main())
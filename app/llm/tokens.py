@@ -0,0 +1,36 @@
+from loguru import logger
+from typing import Dict
+
+# tiktoken is optional; without it token counts are estimated at ~4 characters per token
+_encoding = None
+_encoding_loaded = False
+
+# Per-message framing overhead used by OpenAI chat models
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            logger.info(f"tiktoken unavailable, estimating token counts: {e}")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def count_message_tokens(message: Dict) -> int:
+    return count_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+
+
+if __name__=='__main__':
+    print(count_tokens("What is the capital of New York?"))
@@ -0,0 +1,118 @@
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Set, Tuple
+
+_WORD = re.compile(r"[a-z0-9_]+")
+
+# Common words that carry no signal in questions about the assignments
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from how i if in is it me my of on or so that the this
+to was what when where which who why will with you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _WORD.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    '''
+    Okapi BM25 over an inverted index (term -> [(doc id, term frequency)]).
+    Documents are numbered in the order they are added.
+
+    to_arrays / from_arrays flatten the index into a postings array plus each
+    term's span in it, so a built index can be saved (rag/indexfile.py) and
+    served straight from memory-mapped arrays, without re-tokenizing the documents.
+    '''
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self._lengths: List[int] = []
+        self._total_length = 0
+        # set by from_arrays: term -> [start, end) rows of a (n, 2) doc id / tf array
+        self._spans: Dict[str, List[int]] | None = None
+        self._flat = None
+
+    def to_arrays(self) -> Tuple[Dict[str, List[int]], List[Tuple[int, int]], List[int]]:
+        '''
+        Returns:
+            spans: term -> [start, end) rows of postings
+            postings: (doc id, term frequency) rows, grouped by term, doc ids ascending
+            lengths: token count of each document
+        '''
+        if self._spans is not None:
+            return dict(self._spans), [tuple(row) for row in self._flat.tolist()], [int(n) for n in self._lengths]
+        spans, postings = {}, []
+        for term in sorted(self._postings):
+            spans[term] = [len(postings), len(postings) + len(self._postings[term])]
+            postings.extend(self._postings[term])
+        return spans, postings, list(self._lengths)
+
+    @classmethod
+    def from_arrays(cls, spans: Dict[str, List[int]], postings, lengths, k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        '''
+        A read-only index over arrays from to_arrays. postings and lengths are numpy
+        arrays (memory-mapped is fine): (n, 2) and (documents,) integers.
+        '''
+        index = cls(k1, b)
+        index._spans = spans
+        index._flat = postings
+        index._lengths = lengths
+        index._total_length = int(lengths.sum()) if len(lengths) else 0
+        return index
+
+    def _term_postings(self, term: str):
+        if self._spans is None:
+            return self._postings.get(term, ())
+        span = self._spans.get(term)
+        if span is None:
+            return ()
+        return self._flat[span[0]:span[1]].tolist()
+
+    def add(self, text: str) -> int:
+        if self._spans is not None:
+            raise ValueError("BM25Index loaded from arrays is read-only")
+        doc_id = len(self._lengths)
+        terms = Counter(tokenize(text))
+        for term, tf in terms.items():
+            self._postings[term].append((doc_id, tf))
+        length = sum(terms.values())
+        self._lengths.append(length)
+        self._total_length += length
+        return doc_id
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def _idf(self, term: str) -> float:
+        if self._spans is None:
+            df = len(self._postings.get(term, ()))
+        else:
+            start, end = self._spans.get(term, (0, 0))
+            df = end - start
+        return math.log(1 + (len(self._lengths) - df + 0.5) / (df + 0.5))
+
+    def scores(self, query: str, allowed: Set[int] | None = None) -> Dict[int, float]:
+        '''BM25 score of every document (restricted to allowed ids, if given) sharing a term with the query.'''
+        if len(self._lengths) == 0:
+            return {}
+        average = self._total_length / len(self._lengths) or 1.0
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self._term_postings(term)
+            if not postings:
+                continue
+            idf = self._idf(term)
+            for doc_id, tf in postings:
+                if allowed is not None and doc_id not in allowed:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * int(self._lengths[doc_id]) / average)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query: str, k: int = 5, allowed: Iterable[int] | None = None) -> List[Tuple[int, float]]:
+        scores = self.scores(query, set(allowed) if allowed is not None else None)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
@@ -0,0 +1,74 @@
+import re
+from typing import List, NamedTuple
+
+_HEADER = re.compile(r"^(#{1,3})\s+(.+?)\s*#*\s*$")
+_FENCE = re.compile(r"^\s*(```|~~~)")
+
+
+class Chunk(NamedTuple):
+    '''A section of a markdown document. start/end are character offsets into the document.'''
+    source: str
+    headers: str   # header path, e.g. "Homework: Paint Estimator > Part 1: Problem Analysis"
+    start: int
+    end: int
+    text: str
+
+    @property
+    def search_text(self) -> str:
+        '''What BM25 and the embeddings index: the header path is part of the text for matching ("question 3", "part 2").'''
+        return f"{self.headers}\n{self.text}"
+
+
+def split_markdown(text: str, source: str, max_chars: int = 3000) -> List[Chunk]:
+    '''
+    Split a markdown document at #, ## and ### headers (not inside code fences).
+    Each chunk starts with its own header line (headers with no text of their
+    own stay with the next section); sections longer than max_chars
+    are split further at blank lines. Whitespace-only sections are dropped.
+    '''
+    sections = []
+    path: List[str] = []
+    start = 0
+    offset = 0
+    in_fence = False
+    for line in text.splitlines(keepends=True):
+        if _FENCE.match(line):
+            in_fence = not in_fence
+        match = None if in_fence else _HEADER.match(line)
+        if match:
+            # a section with nothing under its header is merged into the next one
+            if any(l.strip() and not _HEADER.match(l) for l in text[start:offset].splitlines()):
+                sections.append((" > ".join(path), start, offset))
+                start = offset
+            level = len(match.group(1))
+            path = path[:level - 1] + [match.group(2)]
+        offset += len(line)
+    sections.append((" > ".join(path), start, len(text)))
+
+    chunks = []
+    for headers, start, end in sections:
+        for piece_start, piece_end in _pieces(text, start, end, max_chars):
+            piece = text[piece_start:piece_end]
+            if piece.strip():
+                chunks.append(Chunk(source, headers, piece_start, piece_end, piece))
+    return chunks
+
+
+def _pieces(text: str, start: int, end: int, max_chars: int):
+    '''(start, end) ranges of at most ~max_chars, cut at blank lines where possible.'''
+    while end - start > max_chars:
+        cut = text.rfind("\n\n", start, start + max_chars)
+        cut = cut + 2 if cut > start else start + max_chars
+        yield start, cut
+        start = cut
+    yield start, end
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.environ['LOCAL_FILE_CACHE'], "02-HW-Variables.md")
+    with open(path) as f:
+        document = f.read()
+    for chunk in split_markdown(document, os.path.basename(path)):
+        print(f"{chunk.start:>6}-{chunk.end:<6} {chunk.headers}")
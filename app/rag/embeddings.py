@@ -0,0 +1,32 @@
+from typing import Callable, List, Optional
+
+from loguru import logger
+
+# numpy and sentence-transformers are optional; without them retrieval is BM25 only
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def load_embedding_model(model_name: str) -> Optional[Callable[[List[str]], "np.ndarray"]]:
+    '''
+    A local sentence-transformers model as a batch encoder: texts -> (n, dim) float32
+    matrix with unit-length rows, so dot products are cosine similarities.
+    Returns None if numpy or sentence-transformers isn't installed.
+    '''
+    if np is None:
+        logger.warning(f"numpy not installed, embedding model {model_name} not loaded")
+        return None
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        logger.warning(f"sentence-transformers not installed, embedding model {model_name} not loaded")
+        return None
+    model = SentenceTransformer(model_name)
+    logger.info(f"Loaded embedding model={model_name}, dim={model.get_sentence_embedding_dimension()}")
+
+    def encode(texts: List[str]) -> "np.ndarray":
+        return np.asarray(model.encode(texts, normalize_embeddings=True, batch_size=32), dtype=np.float32)
+
+    return encode
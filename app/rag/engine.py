@@ -0,0 +1,114 @@
+'''
+Embedded retrieval over markdown documents: no external service.
+
+Documents are split into sections at markdown headers (rag/chunking.py) and
+indexed with BM25 (rag/bm25.py). If an encoder is given, each section is also
+embedded into a NumPy matrix and the ranking blends BM25 with cosine
+similarity. Every search can be restricted to one source document.
+'''
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from loguru import logger
+
+if __name__=='__main__':
+    from bm25 import BM25Index
+    from chunking import Chunk, split_markdown
+    from embeddings import np
+else:
+    from .bm25 import BM25Index
+    from .chunking import Chunk, split_markdown
+    from .embeddings import np
+
+
+class SearchResult(NamedTuple):
+    chunk: Chunk
+    score: float
+
+
+class RetrievalEngine:
+
+    def __init__(
+            self,
+            chunks: List[Chunk],
+            embeddings: Optional["np.ndarray"] = None,
+            encoder: Optional[Callable[[List[str]], "np.ndarray"]] = None,
+            alpha: float = 0.5,
+            bm25: Optional[BM25Index] = None,
+            sources: Optional[Sequence[str]] = None
+        ):
+        '''
+        Args:
+            chunks: The sections to search (any sequence; an index artifact's decodes each text on access)
+            embeddings: (len(chunks), dim) matrix with unit-length rows (may be memory-mapped), or None for BM25 only
+            encoder: Embeds queries the same way as the rows of embeddings
+            alpha: Weight of cosine similarity vs. (max-normalized) BM25 when embeddings are used
+            bm25: A prebuilt index over the chunks' search_text, in chunk order; built here if None
+            sources: Each chunk's source; with bm25, lets the engine start without reading any chunk text
+        '''
+        self.chunks = chunks
+        self._embeddings = embeddings if encoder is not None else None
+        self._encoder = encoder
+        self._alpha = alpha
+        if bm25 is None:
+            bm25 = BM25Index()
+            for chunk in chunks:
+                bm25.add(chunk.search_text)
+        elif len(bm25) != len(chunks):
+            raise ValueError(f"BM25 index has {len(bm25)} documents for {len(chunks)} chunks")
+        self._bm25 = bm25
+        self._by_source: Dict[str, List[int]] = {}
+        for i, source in enumerate(sources if sources is not None else (chunk.source for chunk in chunks)):
+            self._by_source.setdefault(source, []).append(i)
+
+    @classmethod
+    def from_documents(
+            cls,
+            documents: Dict[str, str],
+            encoder: Optional[Callable[[List[str]], "np.ndarray"]] = None,
+            max_chars: int = 3000
+        ) -> "RetrievalEngine":
+        '''Chunk {source: markdown} documents, and embed the chunks if an encoder is given.'''
+        chunks = [chunk for source, text in documents.items() for chunk in split_markdown(text, source, max_chars)]
+        embeddings = None
+        if encoder is not None and np is not None and chunks:
+            embeddings = encoder([chunk.search_text for chunk in chunks])
+        logger.info(f"Retrieval index built: documents={len(documents)}, chunks={len(chunks)}, embeddings={embeddings is not None}")
+        return cls(chunks, embeddings, encoder)
+
+    @property
+    def sources(self) -> List[str]:
+        return list(self._by_source)
+
+    def source_chunks(self, source: str) -> List[Chunk]:
+        return [self.chunks[i] for i in self._by_source.get(source, [])]
+
+    def search(self, query: str, k: int = 5, source: str | None = None, threshold: float = 0.0) -> List[SearchResult]:
+        '''Top-k sections for query, best first, optionally only from one source document.'''
+        allowed = self._by_source.get(source, []) if source is not None else None
+        scores = self._bm25.scores(query, set(allowed) if allowed is not None else None)
+        if self._embeddings is not None:
+            ids = allowed if allowed is not None else list(range(len(self.chunks)))
+            if ids:
+                # rows may be a float16 memmap (rag/indexfile.py); compare in float32
+                similarities = np.asarray(self._embeddings[ids], dtype=np.float32) @ np.asarray(self._encoder([query])[0], dtype=np.float32)
+                top = max(scores.values(), default=0.0) or 1.0
+                scores = {i: self._alpha * float(similarity) + (1 - self._alpha) * scores.get(i, 0.0) / top
+                          for i, similarity in zip(ids, similarities)}
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return [SearchResult(self.chunks[i], score) for i, score in ranked[:k] if score > threshold]
+
+
+if __name__=='__main__':
+    import os
+    import sys
+    folder = os.environ['LOCAL_FILE_CACHE']
+    documents = {}
+    for filename in sorted(os.listdir(folder)):
+        if filename.endswith(".md") and ("HW" in filename or "LAB" in filename):
+            with open(os.path.join(folder, filename)) as f:
+                documents[filename[:-3]] = f.read()
+    engine = RetrievalEngine.from_documents(documents)
+    query = sys.argv[1] if len(sys.argv) > 1 else "how do I round up the number of paint cans?"
+    source = sys.argv[2] if len(sys.argv) > 2 else "02-HW-Variables"
+    for result in engine.search(query, k=3, source=source):
+        print(f"{result.score:.2f} {result.chunk.source} | {result.chunk.headers} ({len(result.chunk.text)} chars)")
@@ -0,0 +1,296 @@
+'''
+Versioned retrieval index artifact: written by the ETL, memory-mapped by the app.
+
+Layout of an index directory:
+
+    CURRENT                  name of the live version; replaced atomically (os.replace)
+    <version>/manifest.json  version, chunk count, embedding model / dtype / dimensions
+    <version>/embeddings.bin (count, dim) float16 or float32 matrix with unit-length rows
+    <version>/offsets.bin    (count + 1) int64 byte offsets of each chunk in text.bin
+    <version>/text.bin       UTF-8 chunk texts, back to back
+    <version>/chunks.jsonl   per-chunk metadata: source, headers, start, end
+    <version>/bm25_terms.json   BM25 vocabulary: term -> [start, end) rows of bm25_postings.bin
+    <version>/bm25_postings.bin (rows, 2) int32 doc id / term frequency, grouped by term
+    <version>/bm25_lengths.bin  (count,) int32 token count of each chunk
+
+A version directory is complete (written under a temporary name, then
+renamed) before CURRENT points at it, and is never modified afterwards. The
+app maps the files read-only with numpy.memmap, so every worker process on a
+host shares one page-cached copy of the texts, embeddings and BM25 postings:
+a chunk's text is only decoded when it is read (a search hit), and BM25 is
+not rebuilt per process. IndexWatcher switches to a new version
+when CURRENT changes, without a restart. Old versions are pruned by the ETL;
+a process still reading one keeps its mapping until it lets go.
+'''
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections.abc import Sequence
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+if __name__=='__main__':
+    from bm25 import BM25Index
+    from chunking import Chunk
+    from embeddings import np
+else:
+    from .bm25 import BM25Index
+    from .chunking import Chunk
+    from .embeddings import np
+
+CURRENT = "CURRENT"
+# 2 adds the BM25 files; version 1 directories still open (BM25 is then built from the texts)
+FORMAT_VERSION = 2
+READABLE_FORMATS = {1, 2}
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("numpy is required for the retrieval index artifact")
+
+
+def _fsync_write(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_current(index_dir: str) -> Optional[str]:
+    '''The live version's name, or None if no index has been published.'''
+    try:
+        with open(os.path.join(index_dir, CURRENT)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_index(
+        index_dir: str,
+        chunks: List[Chunk],
+        embeddings: Optional["np.ndarray"] = None,
+        model: str = "",
+        dtype: str = "float16",
+        keep: int = 3
+    ) -> str:
+    '''
+    Write chunks (and their embeddings, if any) as a new version and point CURRENT at it.
+
+    Args:
+        index_dir: Directory holding the versions and the CURRENT pointer
+        chunks: Chunks in index order
+        embeddings: (len(chunks), dim) matrix with unit-length rows, or None for a BM25-only index
+        model: Name of the embedding model, recorded so the app embeds queries the same way
+        dtype: "float16" (half the size, plenty for cosine ranking) or "float32"
+        keep: Number of versions to keep, including the new one
+
+    Returns:
+        The new version's name
+    '''
+    _require_numpy()
+    os.makedirs(index_dir, exist_ok=True)
+    texts = [chunk.text.encode("utf-8") for chunk in chunks]
+    digest = hashlib.sha256(b"\0".join(texts)).hexdigest()[:8]
+    version = f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')}-{digest}"
+    staging = os.path.join(index_dir, f".tmp-{version}")
+    os.makedirs(staging)
+
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(text) for text in texts])
+    _fsync_write(os.path.join(staging, "text.bin"), b"".join(texts))
+    _fsync_write(os.path.join(staging, "offsets.bin"), offsets.tobytes())
+    dim = 0
+    if embeddings is not None and chunks:
+        matrix = np.ascontiguousarray(embeddings, dtype=dtype)
+        if matrix.shape[0] != len(chunks):
+            raise ValueError(f"{matrix.shape[0]} embeddings for {len(chunks)} chunks")
+        dim = matrix.shape[1]
+        _fsync_write(os.path.join(staging, "embeddings.bin"), matrix.tobytes())
+    metadata = "".join(json.dumps({"source": c.source, "headers": c.headers, "start": c.start, "end": c.end}) + "\n" for c in chunks)
+    _fsync_write(os.path.join(staging, "chunks.jsonl"), metadata.encode("utf-8"))
+
+    bm25 = BM25Index()
+    for chunk in chunks:
+        bm25.add(chunk.search_text)
+    spans, postings, lengths = bm25.to_arrays()
+    _fsync_write(os.path.join(staging, "bm25_terms.json"), json.dumps(spans, separators=(",", ":")).encode("utf-8"))
+    _fsync_write(os.path.join(staging, "bm25_postings.bin"), np.asarray(postings, dtype=np.int32).reshape(-1, 2).tobytes())
+    _fsync_write(os.path.join(staging, "bm25_lengths.bin"), np.asarray(lengths, dtype=np.int32).tobytes())
+    manifest = {
+        "format": FORMAT_VERSION,
+        "version": version,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "count": len(chunks),
+        "sources": sorted({c.source for c in chunks}),
+        "model": model if dim else "",
+        "dtype": dtype if dim else "",
+        "dim": dim,
+        "bm25": {"k1": bm25.k1, "b": bm25.b, "terms": len(spans), "postings": len(postings)}
+    }
+    _fsync_write(os.path.join(staging, "manifest.json"), json.dumps(manifest, indent=2).encode("utf-8"))
+
+    os.rename(staging, os.path.join(index_dir, version))
+    pointer = os.path.join(index_dir, f".{CURRENT}.tmp")
+    _fsync_write(pointer, version.encode("utf-8"))
+    os.replace(pointer, os.path.join(index_dir, CURRENT))
+    logger.info(f"Published retrieval index version={version}, chunks={len(chunks)}, dim={dim}, dtype={manifest['dtype']}")
+
+    _prune(index_dir, keep)
+    return version
+
+
+def _prune(index_dir: str, keep: int):
+    current = read_current(index_dir)
+    versions = sorted(name for name in os.listdir(index_dir)
+                      if not name.startswith(".") and name != CURRENT and os.path.isdir(os.path.join(index_dir, name)))
+    for name in versions[:max(0, len(versions) - keep)]:
+        if name != current:
+            shutil.rmtree(os.path.join(index_dir, name), ignore_errors=True)
+            logger.info(f"Pruned retrieval index version={name}")
+
+
+class ArtifactChunks(Sequence):
+    '''An artifact's chunks; each one's text is decoded from the mapped text.bin when the chunk is read.'''
+
+    def __init__(self, artifact: "IndexArtifact", metadata: List[Dict]):
+        self._artifact = artifact
+        self._metadata = metadata
+
+    @property
+    def sources(self) -> List[str]:
+        return [m["source"] for m in self._metadata]
+
+    def __len__(self):
+        return len(self._metadata)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        m = self._metadata[i]
+        return Chunk(m["source"], m["headers"], m["start"], m["end"], self._artifact.text(i))
+
+
+class IndexArtifact:
+    '''One version of the index, mapped read-only.'''
+
+    def __init__(self, path: str):
+        _require_numpy()
+        with open(os.path.join(path, "manifest.json")) as f:
+            self.manifest: Dict = json.load(f)
+        if self.manifest.get("format") not in READABLE_FORMATS:
+            raise ValueError(f"Unsupported index format {self.manifest.get('format')} in {path}")
+        self.path = path
+        self.version: str = self.manifest["version"]
+        count = self.manifest["count"]
+        self._offsets = np.memmap(os.path.join(path, "offsets.bin"), dtype=np.int64, mode="r", shape=(count + 1,))
+        self._text = np.memmap(os.path.join(path, "text.bin"), dtype=np.uint8, mode="r") if self._offsets[-1] else None
+        self.embeddings = None
+        if self.manifest["dim"]:
+            self.embeddings = np.memmap(os.path.join(path, "embeddings.bin"), dtype=self.manifest["dtype"], mode="r",
+                                        shape=(count, self.manifest["dim"]))
+        with open(os.path.join(path, "chunks.jsonl")) as f:
+            self.chunks = ArtifactChunks(self, [json.loads(line) for line in f])
+        self.bm25 = self._load_bm25(count)
+        self._sources = frozenset(self.manifest.get("sources", self.chunks.sources))
+
+    @property
+    def model(self) -> str:
+        return self.manifest.get("model", "")
+
+    @property
+    def sources(self) -> frozenset:
+        '''The documents in this version.'''
+        return self._sources
+
+    @property
+    def created_ns(self) -> int:
+        '''When this version was written, in ns since the epoch (comparable with file mtimes).'''
+        return int(datetime.fromisoformat(self.manifest["created"]).timestamp() * 1_000_000_000)
+
+    def _load_bm25(self, count: int) -> Optional[BM25Index]:
+        '''The persisted BM25 index over memory-mapped postings, or None for a format 1 artifact.'''
+        settings = self.manifest.get("bm25")
+        if settings is None:
+            return None
+        with open(os.path.join(self.path, "bm25_terms.json")) as f:
+            spans = json.load(f)
+        rows = settings["postings"]
+        postings = np.memmap(os.path.join(self.path, "bm25_postings.bin"), dtype=np.int32, mode="r", shape=(rows, 2)) if rows \
+            else np.zeros((0, 2), dtype=np.int32)
+        lengths = np.memmap(os.path.join(self.path, "bm25_lengths.bin"), dtype=np.int32, mode="r", shape=(count,)) if count \
+            else np.zeros(0, dtype=np.int32)
+        return BM25Index.from_arrays(spans, postings, lengths, settings["k1"], settings["b"])
+
+    def text(self, i: int) -> str:
+        if self._text is None:
+            return ""
+        return self._text[self._offsets[i]:self._offsets[i + 1]].tobytes().decode("utf-8")
+
+    @classmethod
+    def open_current(cls, index_dir: str) -> Optional["IndexArtifact"]:
+        version = read_current(index_dir)
+        return cls(os.path.join(index_dir, version)) if version else None
+
+
+class IndexWatcher:
+    '''
+    The current artifact of an index directory, re-checked at most every
+    check_interval seconds. When CURRENT names a new version it is opened and
+    swapped in; callers holding the old artifact keep using it until they let go.
+    '''
+
+    def __init__(self, index_dir: str, check_interval: float = 30.0):
+        self.index_dir = index_dir
+        self.check_interval = check_interval
+        self._artifact: Optional[IndexArtifact] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def current(self) -> Optional[IndexArtifact]:
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return self._artifact
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.check_interval:
+                return self._artifact
+            self._checked_at = time.monotonic()
+            version = read_current(self.index_dir)
+            if version is not None and (self._artifact is None or self._artifact.version != version):
+                try:
+                    self._artifact = IndexArtifact(os.path.join(self.index_dir, version))
+                    logger.info(f"Retrieval index loaded: version={version}, chunks={len(self._artifact.chunks)}, "
+                                f"embeddings={self._artifact.embeddings is not None}")
+                except Exception as e:
+                    # keep serving the previous version
+                    logger.error(f"Failed to open retrieval index version={version}: {e}")
+            return self._artifact
+
+
+_watchers: Dict[str, IndexWatcher] = {}
+_watchers_lock = threading.Lock()
+
+def get_index_watcher(index_dir: str, check_interval: float = 30.0) -> IndexWatcher:
+    '''One watcher (and one set of mappings) per index directory in the process.'''
+    key = os.path.abspath(index_dir)
+    with _watchers_lock:
+        if key not in _watchers:
+            _watchers[key] = IndexWatcher(key, check_interval)
+        return _watchers[key]
+
+
+if __name__=='__main__':
+    import sys
+    index_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.environ['LOCAL_FILE_CACHE'], "index")
+    artifact = IndexArtifact.open_current(index_dir)
+    if artifact is None:
+        print(f"No index published in {index_dir}")
+    else:
+        print(json.dumps(artifact.manifest, indent=2))
+        for chunk in artifact.chunks[:5]:
+            print(chunk.source, "|", chunk.headers, f"({len(chunk.text)} chars)")
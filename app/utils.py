@@ -1,7 +1,7 @@
 from loguru import logger
 from streamlit_javascript import st_javascript
 import hashlib
-import random
+import io
 from time import sleep
 from datetime import datetime
 from minio import Minio
@@ -19,19 +19,19 @@ def hash_email_to_boolean(email: str) -> bool:
 
     return bool_hash
 
-def stream_text(text: str):
-    """Streams text to the Streamlit chat message container."""
-    def split_string_randomly(input_string):
-        chunks = []
-        while input_string:
-            chunk_size = random.randint(2, 6)  # Random size between 2 and 5
-            chunk = input_string[:chunk_size]  # Get the chunk
-            chunks.append(chunk)  # Add it to the list
-            input_string = input_string[chunk_size:]  # Remove the chunk from the input string
-        return chunks
-    for chunk in split_string_randomly(text):
-        yield chunk
-        sleep(random.uniform(0.01, 0.1))  # Simulate streaming delay
+def stream_text(text: str, chars_per_second: float = 0, chunk_size: int = 8):
+    """
+    Streams text to the Streamlit chat message container in fixed-size chunks.
+
+    With chars_per_second=0 (default) all chunks are yielded immediately;
+    otherwise each chunk is paced so the text streams at that rate.
+    Cost is linear in len(text).
+    """
+    delay = chunk_size / chars_per_second if chars_per_second > 0 else 0
+    for start in range(0, len(text), chunk_size):
+        yield text[start:start + chunk_size]
+        if delay:
+            sleep(delay)
 
 def generate_chat_history_export(session_state) -> str:
     """
@@ -67,32 +67,31 @@ def generate_chat_history_export(session_state) -> str:
 
     return "\n".join(lines)
 
-def generate_all_chats_export(db, email: str) -> str:
+def iter_all_chats_export(db, email: str, batch_size: int = 500):
     """
-    Generates a formatted text export of all chat sessions for the current user.
-    Queries the database to get all messages for this user.
+    Yields the formatted export of all chat sessions for a user, piece by piece.
+    Rows are streamed from the database in batches of batch_size instead of
+    being loaded all at once.
 
     Args:
         db: PostgreSQL database connection object
         email: User's email address
+        batch_size: Rows fetched per round trip
 
-    Returns:
-        Formatted string with all chat sessions grouped by session ID
+    Yields:
+        Chunks of the formatted export text
     """
-    try:
-        from sqlmodel import select
-        from dal.models import LogModel
-
-        # Query database for all user's messages using SQLModel
-        with db.get_session() as session:
-            statement = select(LogModel).where(
-                LogModel.userid == email
-            ).order_by(LogModel.timestamp)
+    from sqlmodel import select, func
+    from dal.models import LogModel
 
-            results = session.exec(statement).all()
+    with db.get_session() as session:
+        total = session.exec(
+            select(func.count()).select_from(LogModel).where(LogModel.userid == email)
+        ).one()
 
-        if not results:
-            return "No chat history found for this user."
+        if not total:
+            yield "No chat history found for this user."
+            return
 
         lines = []
         lines.append("=" * 60)
@@ -100,15 +99,21 @@ def generate_all_chats_export(db, email: str) -> str:
         lines.append("=" * 60)
         lines.append(f"User: {email}")
         lines.append(f"Export Time: {datetime.now().isoformat()}")
-        lines.append(f"Total Messages: {len(results)}")
+        lines.append(f"Total Messages: {total}")
         lines.append("=" * 60)
         lines.append("")
+        yield "\n".join(lines) + "\n"
+
+        statement = select(LogModel).where(
+            LogModel.userid == email
+        ).order_by(LogModel.timestamp).execution_options(yield_per=batch_size)
 
         # Group messages by session
         current_session = None
         message_num = 0
 
-        for log in results:
+        for log in session.exec(statement):
+            lines = []
             # New session header
             if log.sessionid != current_session:
                 if current_session is not None:
@@ -119,7 +124,7 @@ def generate_all_chats_export(db, email: str) -> str:
                 current_session = log.sessionid
                 message_num = 0
                 lines.append(f"SESSION: {log.sessionid}")
-                lines.append(f"Started: {log.timestamp}")
+                lines.append(f"Started: {log.timestamp.isoformat()}")
                 lines.append(f"Model: {log.model}")
                 lines.append(f"Context: {log.context}")
                 lines.append("-" * 60)
@@ -130,13 +135,32 @@ def generate_all_chats_export(db, email: str) -> str:
             lines.append(f"[{message_num}] {log.role.upper()}:")
             lines.append(log.content)
             lines.append("")
+            yield "\n".join(lines) + "\n"
 
-        lines.append("")
-        lines.append("=" * 60)
-        lines.append("End of Chat History")
-        lines.append("=" * 60)
+    lines = []
+    lines.append("")
+    lines.append("=" * 60)
+    lines.append("End of Chat History")
+    lines.append("=" * 60)
+    yield "\n".join(lines)
+
+def generate_all_chats_export(db, email: str) -> str:
+    """
+    Generates a formatted text export of all chat sessions for the current user.
+    Queries the database to get all messages for this user.
 
-        return "\n".join(lines)
+    Args:
+        db: PostgreSQL database connection object
+        email: User's email address
+
+    Returns:
+        Formatted string with all chat sessions grouped by session ID
+    """
+    try:
+        buffer = io.StringIO()
+        for chunk in iter_all_chats_export(db, email):
+            buffer.write(chunk)
+        return buffer.getvalue()
 
     except Exception as e:
         logger.error(f"Failed to generate all chats export: user={email}, error={e}")
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Logs Table Query Benchmark for IST256 Chatapp
+
+Fills a scratch copy of the logs table with synthetic rows (generated inside
+Postgres with generate_series) and times the queries the app runs against
+it, first without and then with the indexes declared on LogModel.
+
+The real logs table is never touched; the scratch table is dropped afterwards.
+
+Usage:
+    DATABASE_URL=postgresql://... python scripts/benchmark_log_queries.py
+    DATABASE_URL=postgresql://... python scripts/benchmark_log_queries.py --rows 1000000 10000000
+"""
+
+import argparse
+import os
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine, text
+
+TABLE = "logs_benchmark"
+
+# (label, sql) - the same shapes as the app's queries
+QUERIES = [
+    ("user history (all chats export)",
+     f"SELECT * FROM {TABLE} WHERE userid = :userid ORDER BY \"timestamp\""),
+    ("session history (analytics)",
+     f"SELECT * FROM {TABLE} WHERE sessionid = :sessionid ORDER BY \"timestamp\""),
+    ("admin export, first page by timestamp",
+     f"SELECT * FROM {TABLE} ORDER BY \"timestamp\" LIMIT 1000"),
+    ("admin export, one day (date filter)",
+     f"SELECT * FROM {TABLE} WHERE \"timestamp\" >= :day AND \"timestamp\" < :day + interval '1 day'"),
+]
+
+INDEXES = [
+    f"CREATE INDEX ix_{TABLE}_userid_timestamp ON {TABLE} (userid, \"timestamp\")",
+    f"CREATE INDEX ix_{TABLE}_sessionid_timestamp ON {TABLE} (sessionid, \"timestamp\")",
+    f"CREATE INDEX ix_{TABLE}_timestamp ON {TABLE} (\"timestamp\")",
+]
+
+
+def create_table(conn, rows: int, users: int):
+    conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+    conn.execute(text(f"""
+        CREATE TABLE {TABLE} (
+            id SERIAL PRIMARY KEY,
+            sessionid TEXT NOT NULL,
+            userid TEXT NOT NULL,
+            "timestamp" TIMESTAMPTZ NOT NULL,
+            model TEXT NOT NULL,
+            rag BOOLEAN NOT NULL,
+            context TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL
+        )
+    """))
+    # ~20 messages per session, sessions spread across users, one message per second
+    conn.execute(text(f"""
+        INSERT INTO {TABLE} (sessionid, userid, "timestamp", model, rag, context, role, content)
+        SELECT
+            'session-' || (g / 20),
+            'student' || ((g / 20) % :users) || '@syr.edu',
+            timestamptz '2025-08-25 00:00:00+00' + g * interval '1 second',
+            'gpt-4o-mini',
+            true,
+            'HW-' || lpad(((g / 20) % 13 + 1)::text, 2, '0'),
+            CASE WHEN g % 2 = 0 THEN 'user' ELSE 'assistant' END,
+            repeat('lorem ipsum ', 20)
+        FROM generate_series(1, :rows) AS g
+    """), {"rows": rows, "users": users})
+    conn.execute(text(f"ANALYZE {TABLE}"))
+
+
+def time_queries(conn, params: dict, repeat: int) -> dict:
+    results = {}
+    for label, sql in QUERIES:
+        plan = conn.execute(text("EXPLAIN " + sql), params).first()[0]
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn.execute(text(sql), params).fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+        results[label] = (min(timings), plan)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000_000, 10_000_000])
+    parser.add_argument("--users", type=int, default=5000, help="distinct synthetic users")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per query (best is reported)")
+    args = parser.parse_args()
+
+    engine = create_engine(os.environ["DATABASE_URL"].strip("'").strip('"'))
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        try:
+            for rows in args.rows:
+                print(f"\n=== {rows:,} rows ===")
+                start = time.perf_counter()
+                create_table(conn, rows, args.users)
+                print(f"generated in {time.perf_counter() - start:.1f}s")
+
+                params = {"userid": "student42@syr.edu", "sessionid": f"session-{rows // 40}", "day": datetime(2025, 8, 26, tzinfo=timezone.utc)}
+                before = time_queries(conn, params, args.repeat)
+
+                start = time.perf_counter()
+                for ddl in INDEXES:
+                    conn.execute(text(ddl))
+                conn.execute(text(f"ANALYZE {TABLE}"))
+                print(f"indexes built in {time.perf_counter() - start:.1f}s")
+                after = time_queries(conn, params, args.repeat)
+
+                print(f"{'query':<40} {'before ms':>12} {'after ms':>12}  plan after")
+                for label, _ in QUERIES:
+                    print(f"{label:<40} {before[label][0]:>12.1f} {after[label][0]:>12.1f}  {after[label][1]}")
+        finally:
+            conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+
+
+if __name__ == "__main__":
+    main()
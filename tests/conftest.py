@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# the app runs with app/ as its working directory (see Dockerfile)
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+sys.path.insert(0, APP_DIR)
+
+from fakes.chatserver import FakeChatServer
+
+
+@pytest.fixture
+def fake_chat_server():
+    '''Start a FakeChatServer for a script; every server started is shut down after the test.'''
+    servers = []
+
+    def start(script):
+        server = FakeChatServer(script).__enter__()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.__exit__(None, None, None)
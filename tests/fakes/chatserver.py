@@ -0,0 +1,132 @@
+'''
+Scripted local chat-completions server for testing the LLM clients.
+
+Speaks enough of the Azure OpenAI (/openai/deployments/<model>/chat/completions,
+SSE streaming) and Ollama (/api/chat, NDJSON streaming) protocols for the real
+SDKs to talk to it. Each request consumes the next action from the script; the
+last action repeats once the script runs out.
+
+Actions:
+    ("stream", text)               200, the text in word chunks (or one JSON body if not streaming)
+    ("status", code, headers)      error response, e.g. ("status", 429, {"Retry-After": "1"})
+    ("drop", partial_text)         200, some chunks, then the connection is closed mid-body
+    ("slow", seconds, text)        wait, then behave like "stream"
+
+Usage:
+    with FakeChatServer([("status", 503, {}), ("stream", "hello")]) as server:
+        llm = AzureOpenAILLM(server.url, "key", "2024-06-01", "gpt-4o-mini", 0.0)
+'''
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Tuple
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        action = self.server.fake.next_action()
+        ollama = self.path.startswith("/api/")
+        kind = action[0]
+        if kind == "slow":
+            time.sleep(action[1])
+            kind, action = "stream", ("stream", action[2])
+        if kind == "status":
+            self._send_json(action[1], {"error": {"message": f"fake error {action[1]}", "code": str(action[1])}}, action[2])
+        elif kind == "stream" and not body.get("stream", ollama):
+            self._send_json(200, self._message(action[1], ollama))
+        else:
+            include_usage = body.get("stream_options", {}).get("include_usage", False)
+            self._stream(action[1], ollama, drop=(kind == "drop"), include_usage=include_usage)
+
+    def _send_json(self, status: int, payload: dict, headers: dict | None = None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _message(self, text: str, ollama: bool) -> dict:
+        if ollama:
+            return {"model": "fake", "created_at": "2025-01-01T00:00:00Z", "message": {"role": "assistant", "content": text}, "done": True,
+                    "prompt_eval_count": 1, "eval_count": len(text.split(" "))}
+        return {
+            "id": "fake", "object": "chat.completion", "created": 0, "model": "fake",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, text: str, ollama: bool, drop: bool, include_usage: bool = False):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson" if ollama else "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for word in text.split(" "):
+            piece = word + " "
+            if ollama:
+                event = {"model": "fake", "created_at": "2025-01-01T00:00:00Z", "message": {"role": "assistant", "content": piece}, "done": False}
+                self._chunk((json.dumps(event) + "\n").encode())
+            else:
+                event = {"id": "fake", "object": "chat.completion.chunk", "created": 0, "model": "fake",
+                         "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                self._chunk(f"data: {json.dumps(event)}\n\n".encode())
+            time.sleep(0.01)
+        if drop:
+            # no terminating chunk: the client sees an incomplete body
+            self.close_connection = True
+            return
+        if ollama:
+            self._chunk((json.dumps({"model": "fake", "created_at": "2025-01-01T00:00:00Z", "message": {"role": "assistant", "content": ""}, "done": True,
+                                     "prompt_eval_count": 1, "eval_count": len(text.split(" "))}) + "\n").encode())
+        else:
+            if include_usage:
+                usage = {"prompt_tokens": 1, "completion_tokens": len(text.split(" ")), "total_tokens": 1 + len(text.split(" ")),
+                         "prompt_tokens_details": {"cached_tokens": 0}}
+                event = {"id": "fake", "object": "chat.completion.chunk", "created": 0, "model": "fake", "choices": [], "usage": usage}
+                self._chunk(f"data: {json.dumps(event)}\n\n".encode())
+            self._chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class FakeChatServer:
+
+    def __init__(self, script: List[Tuple], host: str = "127.0.0.1", port: int = 0):
+        self._script = list(script)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-llm-server", daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def next_action(self) -> Tuple:
+        with self._lock:
+            self.requests += 1
+            return self._script.pop(0) if len(self._script) > 1 else self._script[0]
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
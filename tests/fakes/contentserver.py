@@ -0,0 +1,100 @@
+'''
+Local static file server with ETag / Last-Modified support, for testing
+the extractor (etl/extract.py) without GitHub.
+
+Serves the files dict (path -> text) under /. Conditional GETs get a 304 when
+If-None-Match matches the current ETag (a content hash) or, without an ETag,
+when the file hasn't changed since If-Modified-Since. Edit server.files
+between runs to simulate upstream changes; remove a path to make it 404.
+
+Usage:
+    with StaticContentServer({"01-Intro/LAB-Intro.ipynb": "{...}"}) as server:
+        UrlContentExtractor().extract_all(f"{server.url}/", ["01-Intro/LAB-Intro.ipynb"], folder)
+'''
+import hashlib
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server.content
+        path = self.path.lstrip("/")
+        text = server.files.get(path)
+        with server.lock:
+            server.requests += 1
+        if text is None:
+            self._send(404, b"not found", {})
+            return
+        body = text.encode("utf-8")
+        etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+        modified = server.modified_at(path, etag)
+        headers = {"ETag": etag, "Last-Modified": formatdate(modified, usegmt=True)}
+
+        if_none_match = self.headers.get("If-None-Match")
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_none_match is not None:
+            not_modified = if_none_match == etag
+        elif if_modified_since is not None:
+            not_modified = int(modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        else:
+            not_modified = False
+        if not_modified:
+            self._send(304, b"", headers)
+            return
+        with server.lock:
+            server.bodies_sent += 1
+        self._send(200, body, headers)
+
+    def _send(self, status: int, body: bytes, headers: dict):
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if status != 304:
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(body)
+
+
+class StaticContentServer:
+
+    def __init__(self, files: Dict[str, str], host: str = "127.0.0.1", port: int = 0):
+        self.files = dict(files)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bodies_sent = 0
+        self._versions: Dict[str, tuple] = {}
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.content = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name="etl-content-server", daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def modified_at(self, path: str, etag: str) -> float:
+        '''Last-Modified of path: when its content (etag) was first served.'''
+        with self.lock:
+            version = self._versions.get(path)
+            if version is None or version[0] != etag:
+                version = self._versions[path] = (etag, time.time())
+            return version[1]
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,87 @@
+import json
+import os
+import subprocess
+import sys
+from contextlib import contextmanager
+
+from dal.chatlogger import ChatLogWriter, timestamp
+from dal.models import LogModel
+
+
+class FakeDB:
+    '''Stands in for dal.db: multi-row inserts land in rows; fail=True makes every session raise.'''
+
+    def __init__(self):
+        self.rows = []
+        self.fail = False
+
+    @contextmanager
+    def get_session(self):
+        if self.fail:
+            raise ConnectionError("database is down")
+        yield self
+
+    def execute(self, statement, rows):
+        self.rows.extend(rows)
+
+    def add(self, log):
+        self.rows.append(log.model_dump(exclude={"id"}))
+
+    def commit(self):
+        pass
+
+
+def row(content: str) -> LogModel:
+    return LogModel(sessionid="s1", userid="u@x.edu", timestamp=timestamp(), model="m", rag=False, context="HW-03", role="user", content=content)
+
+
+def write_spill(path: str, *contents: str):
+    with open(path, "w") as f:
+        for content in contents:
+            f.write(json.dumps(row(content).model_dump(mode="json", exclude={"id"})) + "\n")
+
+
+def exited_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_orphaned_and_half_replayed_files_are_recovered(tmp_path):
+    dead = exited_pid()
+    write_spill(tmp_path / f"chatlog-spill-{dead}.jsonl", "a")
+    # left behind by a writer that crashed mid-replay
+    write_spill(tmp_path / f"chatlog-spill-{dead}.jsonl.replay-{dead}-0badf00d", "b", "c")
+    # a live process replays its own file
+    live = tmp_path / f"chatlog-spill-{os.getppid()}.jsonl"
+    write_spill(live, "d")
+
+    db = FakeDB()
+    writer = ChatLogWriter(db, spill_dir=str(tmp_path))
+    writer.close()
+
+    assert sorted(r["content"] for r in db.rows) == ["a", "b", "c"]
+    assert writer.stats["recovered"] == 3
+    assert writer.stats["replayed"] == 0
+    assert os.listdir(tmp_path) == [live.name]
+
+
+def test_failed_replay_keeps_rows_spilled_meanwhile(tmp_path):
+    db = FakeDB()
+    db.fail = True
+    write_spill(tmp_path / f"chatlog-spill-{os.getpid()}.jsonl", "a")
+    writer = ChatLogWriter(db, spill_dir=str(tmp_path), flush_interval=0.01, max_retries=1)
+
+    # the replay at start fails, then a new batch spills next to the claimed file
+    writer.enqueue(row("b"))
+    writer.flush()
+    assert writer.stats["spilled"] == 1
+    assert len(os.listdir(tmp_path)) == 2
+
+    db.fail = False
+    writer.enqueue(row("c"))
+    writer.close()
+
+    assert sorted(r["content"] for r in db.rows) == ["a", "b", "c"]
+    assert writer.stats["replayed"] == 2
+    assert os.listdir(tmp_path) == []
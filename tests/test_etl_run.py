@@ -0,0 +1,81 @@
+import json
+import os
+import sys
+
+import nbformat
+import pytest
+
+from conftest import APP_DIR
+
+# the etl scripts import each other by bare name (run from app/etl)
+sys.path.insert(0, os.path.join(APP_DIR, "etl"))
+
+import run
+from fakes.contentserver import StaticContentServer
+from rag.indexfile import read_current
+
+
+def notebook(title: str) -> str:
+    cells = [nbformat.v4.new_markdown_cell(f"# {title}\n\nWhat {title} covers.")]
+    return nbformat.writes(nbformat.v4.new_notebook(cells=cells))
+
+
+FILES = {f"0{i}-Unit/HW-Unit{i}.ipynb": notebook(f"Unit {i}") for i in range(1, 3)}
+
+
+@pytest.fixture
+def folder(tmp_path, monkeypatch):
+    '''run_etl against a local content server, with the file cache (and index) in tmp_path.'''
+    monkeypatch.setenv("LOCAL_FILE_CACHE", str(tmp_path))
+    monkeypatch.setenv("ETL_TRANSFORM_WORKERS", "1")
+    monkeypatch.delenv("RAG_INDEX_DIR", raising=False)
+    monkeypatch.delenv("RAG_EMBEDDING_MODEL", raising=False)
+    with StaticContentServer(dict(FILES)) as server:
+        monkeypatch.setattr(run, "DOCUMENT_BASE", f"{server.url}/")
+        monkeypatch.setattr(run, "DOCUMENT_MANIFEST", list(FILES))
+        yield tmp_path
+
+
+def index_version(folder) -> str:
+    return read_current(os.path.join(folder, "index"))
+
+
+def index_sources(folder) -> list:
+    with open(os.path.join(folder, "index", index_version(folder), "manifest.json")) as f:
+        return json.load(f)["sources"]
+
+
+def test_unchanged_outputs_skip_the_index(folder):
+    run.run_etl()
+    version = index_version(folder)
+    assert index_sources(folder) == ["01-HW-Unit1", "02-HW-Unit2"]
+
+    run.run_etl()
+    assert index_version(folder) == version
+
+
+def test_markdown_the_pipeline_did_not_produce_rebuilds_the_index(folder):
+    run.run_etl()
+    first = index_version(folder)
+
+    # indexed by load_folder alongside the transform outputs
+    notes = folder / "course-notes.md"
+    notes.write_text("# Notes\n\nOffice hours are on Tuesday.")
+    run.run_etl()
+    second = index_version(folder)
+    assert second != first
+    assert "course-notes" in index_sources(folder)
+
+    notes.write_text("# Notes\n\nOffice hours moved to Thursday.")
+    run.run_etl()
+    assert index_version(folder) != second
+
+
+def test_notebook_dropped_from_the_manifest_leaves_markdown_and_index(folder, monkeypatch):
+    run.run_etl()
+    assert (folder / "02-HW-Unit2.md").exists()
+
+    monkeypatch.setattr(run, "DOCUMENT_MANIFEST", ["01-Unit/HW-Unit1.ipynb"])
+    run.run_etl()
+    assert not (folder / "02-HW-Unit2.md").exists()
+    assert index_sources(folder) == ["01-HW-Unit1"]
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+
+import pytest
+import requests
+
+from etl.extract import MANIFEST_FILE, UrlContentExtractor
+from fakes.contentserver import StaticContentServer
+
+FILES = {f"0{i}-Unit/HW-Unit{i}.ipynb": f'{{"cells": [], "unit": {i}}}' for i in range(1, 4)}
+
+
+@pytest.fixture
+def content_server():
+    with StaticContentServer(FILES) as server:
+        yield server
+
+
+def extract(server, folder, filenames=None):
+    results = UrlContentExtractor(max_workers=4).extract_all(f"{server.url}/", list(filenames or FILES), str(folder))
+    return {r.filename: r for r in results}
+
+
+def manifest(folder) -> dict:
+    with open(os.path.join(folder, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+def test_first_run_downloads_everything(content_server, tmp_path):
+    results = extract(content_server, tmp_path)
+    assert {r.status for r in results.values()} == {"updated"}
+    assert content_server.bodies_sent == len(FILES)
+    for filename, text in FILES.items():
+        localfile = results[filename].localfile
+        assert os.path.basename(localfile) == UrlContentExtractor.local_filename(filename)
+        with open(localfile) as f:
+            assert f.read() == text
+
+
+def test_manifest_records_validators_and_hash(content_server, tmp_path):
+    extract(content_server, tmp_path)
+    entries = manifest(tmp_path)
+    assert set(entries) == {UrlContentExtractor.local_filename(f) for f in FILES}
+    for filename in FILES:
+        entry = entries[UrlContentExtractor.local_filename(filename)]
+        assert entry["url"] == f"{content_server.url}/{filename}"
+        assert entry["etag"].startswith('"')
+        assert entry["last_modified"].endswith("GMT")
+        with open(tmp_path / UrlContentExtractor.local_filename(filename), "rb") as f:
+            assert entry["sha256"] == hashlib.sha256(f.read()).hexdigest()
+
+
+def test_200_then_304_then_changed_file(content_server, tmp_path):
+    changed = "01-Unit/HW-Unit1.ipynb"
+
+    results = extract(content_server, tmp_path)
+    assert {r.status for r in results.values()} == {"updated"}
+    assert content_server.bodies_sent == 3
+
+    results = extract(content_server, tmp_path)
+    assert {r.status for r in results.values()} == {"not-modified"}
+    assert content_server.bodies_sent == 3
+    assert content_server.requests == 6
+
+    old_etag = manifest(tmp_path)[UrlContentExtractor.local_filename(changed)]["etag"]
+    content_server.files[changed] = '{"cells": [], "unit": "changed"}'
+    results = extract(content_server, tmp_path)
+    assert results[changed].status == "updated"
+    assert {r.status for f, r in results.items() if f != changed} == {"not-modified"}
+    assert content_server.bodies_sent == 4
+    with open(results[changed].localfile) as f:
+        assert f.read() == content_server.files[changed]
+    assert manifest(tmp_path)[UrlContentExtractor.local_filename(changed)]["etag"] != old_etag
+
+
+def test_identical_content_is_not_rewritten(content_server, tmp_path):
+    results = extract(content_server, tmp_path)
+    mtimes = {f: os.stat(r.localfile).st_mtime_ns for f, r in results.items()}
+
+    # without the manifest there are no validators, so every file comes back as a 200
+    os.remove(tmp_path / MANIFEST_FILE)
+    results = extract(content_server, tmp_path)
+    assert {r.status for r in results.values()} == {"unchanged"}
+    assert content_server.bodies_sent == 6
+    assert {f: os.stat(r.localfile).st_mtime_ns for f, r in results.items()} == mtimes
+    assert set(manifest(tmp_path)) == {UrlContentExtractor.local_filename(f) for f in FILES}
+
+
+def test_locally_modified_file_is_refetched(content_server, tmp_path):
+    filename = "02-Unit/HW-Unit2.ipynb"
+    results = extract(content_server, tmp_path)
+    with open(results[filename].localfile, "w") as f:
+        f.write("edited by hand")
+
+    results = extract(content_server, tmp_path)
+    assert results[filename].status == "updated"
+    with open(results[filename].localfile) as f:
+        assert f.read() == FILES[filename]
+
+
+def test_failed_file_does_not_stop_the_others(content_server, tmp_path):
+    missing = "03-Unit/HW-Unit3.ipynb"
+    results = extract(content_server, tmp_path)
+    entry = manifest(tmp_path)[UrlContentExtractor.local_filename(missing)]
+
+    del content_server.files[missing]
+    content_server.files["01-Unit/HW-Unit1.ipynb"] = '{"cells": [], "unit": "changed"}'
+    results = extract(content_server, tmp_path)
+    assert results[missing].status == "failed"
+    assert "404" in results[missing].error
+    assert results["01-Unit/HW-Unit1.ipynb"].status == "updated"
+    assert results["02-Unit/HW-Unit2.ipynb"].status == "not-modified"
+
+    # the previous copy and its manifest entry are kept
+    with open(results[missing].localfile) as f:
+        assert f.read() == FILES[missing]
+    assert manifest(tmp_path)[UrlContentExtractor.local_filename(missing)] == entry
+
+
+def test_unreachable_server_fails_every_file(tmp_path):
+    with StaticContentServer(FILES) as server:
+        base = f"{server.url}/"
+    # a plain session: the pooled one would back off and retry the refused connections first
+    extractor = UrlContentExtractor(max_workers=2, timeout=2.0, session=requests.Session())
+    results = extractor.extract_all(base, list(FILES), str(tmp_path))
+    assert {r.status for r in results} == {"failed"}
+    assert all(r.error for r in results)
+    assert manifest(tmp_path) == {}
@@ -0,0 +1,104 @@
+import json
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from rag.bm25 import BM25Index
+from rag.chunking import split_markdown
+from rag.engine import RetrievalEngine
+from rag.indexfile import ArtifactChunks, IndexArtifact, read_current, write_index
+
+DOCUMENTS = {
+    "02-HW-Paint": "# Paint Estimator\n\n## Problem Analysis\n\nWork out how many cans of paint a room needs.\n\n"
+                   "## Code\n\nUse math.ceil to round up to the nearest whole can.\n",
+    "03-LAB-Loops": "# Loops\n\n## For loops\n\nA for loop repeats code for each item in a list.\n\n"
+                    "## While loops\n\nA while loop repeats until its condition is false.\n",
+}
+
+
+def chunks():
+    return [chunk for source, text in sorted(DOCUMENTS.items()) for chunk in split_markdown(text, source)]
+
+
+@pytest.fixture
+def artifact(tmp_path):
+    embeddings = np.eye(len(chunks()), 4, dtype=np.float32)
+    version = write_index(str(tmp_path), chunks(), embeddings, model="fake-model")
+    return IndexArtifact(os.path.join(str(tmp_path), version))
+
+
+def test_chunk_text_is_decoded_on_access(artifact, monkeypatch):
+    decoded = []
+    original = IndexArtifact.text
+    monkeypatch.setattr(IndexArtifact, "text", lambda self, i: decoded.append(i) or original(self, i))
+
+    assert isinstance(artifact.chunks, ArtifactChunks)
+    assert len(artifact.chunks) == len(chunks())
+    assert artifact.chunks.sources == [c.source for c in chunks()]
+    assert decoded == []
+    assert artifact.chunks[1] == chunks()[1]
+    assert artifact.chunks[-1] == chunks()[-1]
+    assert artifact.chunks[:2] == chunks()[:2]
+    assert list(artifact.chunks) == chunks()
+
+
+def test_bm25_postings_are_persisted_and_mapped(artifact):
+    assert isinstance(artifact.bm25._flat, np.memmap)
+    assert isinstance(artifact.bm25._lengths, np.memmap)
+    assert artifact.manifest["format"] == 2
+    built = BM25Index()
+    for chunk in chunks():
+        built.add(chunk.search_text)
+    assert artifact.bm25.to_arrays() == built.to_arrays()
+    for query in ["round up paint cans", "while loop condition", "nothing matches zzz"]:
+        assert artifact.bm25.scores(query) == pytest.approx(built.scores(query))
+        assert artifact.bm25.scores(query, {0, 1}) == pytest.approx(built.scores(query, {0, 1}))
+
+
+def test_engine_from_artifact_reads_only_the_hits(artifact, monkeypatch):
+    decoded = []
+    original = IndexArtifact.text
+    monkeypatch.setattr(IndexArtifact, "text", lambda self, i: decoded.append(i) or original(self, i))
+
+    engine = RetrievalEngine(artifact.chunks, bm25=artifact.bm25, sources=artifact.chunks.sources)
+    assert decoded == []
+    results = engine.search("how do I round up to a whole can", k=1, source="02-HW-Paint")
+    assert [r.chunk.headers for r in results] == ["Paint Estimator > Code"]
+    assert len(decoded) == 1
+
+    rebuilt = RetrievalEngine(chunks())
+    assert [r.chunk for r in rebuilt.search("while loop", k=2)] == [r.chunk for r in engine.search("while loop", k=2)]
+
+
+def test_engine_rejects_mismatched_bm25(artifact):
+    with pytest.raises(ValueError):
+        RetrievalEngine(chunks()[:1], bm25=artifact.bm25)
+
+
+def test_format_1_artifact_still_opens(tmp_path):
+    version = write_index(str(tmp_path), chunks())
+    path = os.path.join(str(tmp_path), version)
+    # what a version written before the BM25 files looks like
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+    manifest["format"] = 1
+    del manifest["bm25"]
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+    for name in ("bm25_terms.json", "bm25_postings.bin", "bm25_lengths.bin"):
+        os.remove(os.path.join(path, name))
+
+    artifact = IndexArtifact(path)
+    assert artifact.bm25 is None
+    engine = RetrievalEngine(artifact.chunks, bm25=artifact.bm25, sources=artifact.chunks.sources)
+    assert engine.search("for loop", k=1)[0].chunk.headers == "Loops > For loops"
+
+
+def test_empty_index(tmp_path):
+    version = write_index(str(tmp_path), [])
+    assert read_current(str(tmp_path)) == version
+    artifact = IndexArtifact(os.path.join(str(tmp_path), version))
+    engine = RetrievalEngine(artifact.chunks, bm25=artifact.bm25, sources=artifact.chunks.sources)
+    assert engine.search("anything") == []
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import sys
+import threading
+
+from conftest import APP_DIR
+
+# the chat modules import each other by bare name (streamlit runs app/chat/app.py)
+sys.path.insert(0, os.path.join(APP_DIR, "chat"))
+
+from llm.llmbase import LLMBase
+from llm.tokens import count_message_tokens
+from llmapi import LLMAPI
+from ragapi import ContextRetriever
+
+SECTIONS = "Problem Analysis: " + "the paint calculator rounds up to whole cans " * 40
+
+
+class EchoLLM(LLMBase):
+
+    def __init__(self):
+        self.requests = []
+        self.last_usage = None
+
+    @property
+    def model(self):
+        return "echo"
+
+    @property
+    def temperature(self):
+        return 0.0
+
+    def generate_stream(self, messages, model=None, temperature=None):
+        self.requests.append(messages)
+        yield "Use math.ceil."
+
+    def generate_text(self, messages, model=None, temperature=None):
+        return "".join(self.generate_stream(messages, model, temperature))
+
+    async def agenerate_stream(self, messages, model=None, temperature=None):
+        for chunk in self.generate_stream(messages, model, temperature):
+            yield chunk
+
+
+class FakeRAG:
+    '''Stands in for RAGAPI: records each search query and the thread it ran on.'''
+
+    def __init__(self):
+        self.queries = []
+        self.threads = []
+
+    def relevant_sections(self, query, source, n_results):
+        self.queries.append(query)
+        self.threads.append(threading.current_thread())
+        return SECTIONS
+
+    def document_version(self, source):
+        return 1
+
+
+def chat(rag, **kwargs) -> LLMAPI:
+    return LLMAPI(EchoLLM(), system_prompt="You are a tutor.", retriever=ContextRetriever(rag, "02-HW-Paint", 4, history_turns=2), **kwargs)
+
+
+def ask(api: LLMAPI, question: str, **kwargs) -> str:
+    '''One turn, recorded in the history the way the chat page does it.'''
+    answer = "".join(api.stream_response(question, **kwargs))
+    api.record_response(answer)
+    return answer
+
+
+def test_search_query_includes_recent_questions():
+    retriever = ContextRetriever(FakeRAG(), "02-HW-Paint", 4, history_turns=2)
+    assert retriever.search_query("can you explain more?", ["q1", "q2", "q3"]) == "q2\nq3\ncan you explain more?"
+    assert retriever.search_query("first question") == "first question"
+    assert ContextRetriever(FakeRAG(), "02-HW-Paint", 4, history_turns=0).search_query("q", ["earlier"]) == "q"
+
+
+def test_follow_up_retrieves_with_the_earlier_question():
+    rag = FakeRAG()
+    api = chat(rag, use_async=False)
+    ask(api, "How do I round up to the nearest can of paint?")
+    ask(api, "can you explain more?")
+    assert rag.queries[-1] == "How do I round up to the nearest can of paint?\ncan you explain more?"
+    # the stored history keeps the plain question
+    assert api.history[-2]["content"] == "can you explain more?"
+
+
+def test_ignore_history_retrieves_with_the_question_alone():
+    rag = FakeRAG()
+    api = chat(rag, use_async=False)
+    ask(api, "How do I round up?")
+    ask(api, "What is a variable?", ignore_history=True)
+    assert rag.queries[-1] == "What is a variable?"
+
+
+def test_async_retrieval_runs_off_the_event_loop():
+    rag = FakeRAG()
+    api = chat(rag)
+
+    async def ask():
+        loop_thread = threading.current_thread()
+        chunks = [chunk async for chunk in api.astream_response("How do I round up?")]
+        return loop_thread, chunks
+
+    loop_thread, chunks = asyncio.run(ask())
+    assert "".join(chunks) == "Use math.ceil."
+    assert rag.threads and rag.threads[0] is not loop_thread
+    assert SECTIONS in api._llm.requests[-1][-1]["content"]
+
+
+def test_retrieved_sections_count_against_the_budget():
+    rag = FakeRAG()
+    section_tokens = count_message_tokens({"role": "user", "content": SECTIONS})
+    budget = section_tokens + 80
+    api = chat(rag, use_async=False, max_prompt_tokens=budget)
+    evicted = 0
+    for question in ["How do I round up to the nearest can of paint?", "What about two coats?", "can you explain more?", "and for three walls?"]:
+        ask(api, question)
+        sent = api._llm.requests[-1]
+        assert sum(count_message_tokens(m) for m in sent) <= budget
+        assert api.last_request["prompt_tokens"] <= budget
+        evicted += api.last_request["evicted_messages"]
+        # the plain history alone fits comfortably: only the sections push turns out
+        assert api.prompt_tokens < budget - section_tokens // 2
+    assert evicted > 0
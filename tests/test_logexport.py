@@ -0,0 +1,67 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from dal.logexport import LOG_COLUMNS, log_select, write_csv, write_ndjson, write_parquet
+from dal.models import LogFilterModel
+
+ROWS = [
+    (1, "s1", "Student@Syr.edu", datetime(2025, 3, 1, 14, 0, tzinfo=timezone.utc), "gpt-4o-mini", False,
+     "02-HW-Paint", "user", "How do I round up?", None, None, None, None),
+    (2, "s1", "Student@Syr.edu", datetime(2025, 3, 1, 14, 0, 2, tzinfo=timezone.utc), "azure/gpt-4o-mini", True,
+     "02-HW-Paint", "assistant", "Use math.ceil.", 812, 45, 768, 431.7),
+]
+
+
+def batches():
+    # two batches, so the writers see more than one
+    return iter([ROWS[:1], ROWS[1:]])
+
+
+def test_rows_match_log_columns():
+    assert all(len(row) == len(LOG_COLUMNS) for row in ROWS)
+    assert LOG_COLUMNS[-1] == "ttft_ms"
+
+
+def test_parquet_export_keeps_usage_columns():
+    pq = pytest.importorskip("pyarrow.parquet")
+    out = io.BytesIO()
+    assert write_parquet(batches(), out) == 2
+    table = pq.read_table(io.BytesIO(out.getvalue()))
+    assert table.column_names == LOG_COLUMNS
+    assert str(table.schema.field("ttft_ms").type) == "double"
+    rows = table.to_pylist()
+    assert rows[0]["ttft_ms"] is None
+    assert rows[1]["ttft_ms"] == pytest.approx(431.7)
+    assert (rows[1]["prompt_tokens"], rows[1]["completion_tokens"], rows[1]["cached_tokens"]) == (812, 45, 768)
+    assert rows[1]["timestamp"] == ROWS[1][3]
+
+
+def test_ndjson_export():
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode="wb") as gz:
+        assert write_ndjson(batches(), gz) == 2
+    lines = gzip.decompress(out.getvalue()).decode("utf-8").splitlines()
+    record = json.loads(lines[1])
+    assert record["ttft_ms"] == 431.7
+    assert record["timestamp"] == "2025-03-01T14:00:02+00:00"
+
+
+def test_csv_export():
+    out = io.BytesIO()
+    assert write_csv(batches(), out) == 2
+    rows = list(csv.reader(io.StringIO(out.getvalue().decode("utf-8"))))
+    assert rows[0] == LOG_COLUMNS
+    assert rows[2][LOG_COLUMNS.index("ttft_ms")] == "431.7"
+
+
+def test_userid_filter_ignores_case():
+    compiled = log_select(LogFilterModel(userid=" Student@Syr.edu")).compile(dialect=postgresql.dialect())
+    # userid holds the email as MSAL returned it, mixed case included
+    assert "lower(logs.userid) = %(lower_1)s" in str(compiled)
+    assert compiled.params["lower_1"] == "student@syr.edu"
@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+
+import pytest
+
+from conftest import APP_DIR
+
+pytest.importorskip("numpy")
+# the chat modules import each other by bare name (streamlit runs app/chat/app.py)
+sys.path.insert(0, os.path.join(APP_DIR, "chat"))
+
+from docloader import FileCacheDocLoader
+from ragapi import RAGAPI
+from rag.chunking import split_markdown
+from rag.indexfile import write_index
+
+OLD = "# Old Homework\n\n## Problem Analysis\n\nCount the vowels in a word.\n"
+NEW = "# New Homework\n\n## Code\n\nUse math.ceil to round up to whole paint cans.\n"
+
+
+def write_doc(folder, source, text, age: float = 0.0):
+    path = os.path.join(folder, source + ".md")
+    with open(path, "w") as f:
+        f.write(text)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def folders(tmp_path):
+    cache, index = tmp_path / "cache", tmp_path / "index"
+    cache.mkdir()
+    # the ETL wrote 01-HW-Old an hour ago and published an index with it
+    write_doc(str(cache), "01-HW-Old", OLD, age=3600)
+    write_index(str(index), split_markdown(OLD, "01-HW-Old"))
+    return str(cache), str(index)
+
+
+def rag(cache, index) -> RAGAPI:
+    return RAGAPI(FileCacheDocLoader(cache, check_interval=0), index_dir=index)
+
+
+def test_indexed_document_is_served_from_the_artifact(folders):
+    api = rag(*folders)
+    assert "vowels" in api.relevant_sections("how do I count vowels?", "01-HW-Old")
+    assert api.engine("01-HW-Old") is api.engine()
+    assert api.document_version("01-HW-Old") == api._artifact().version
+
+
+def test_document_missing_from_the_artifact_falls_back_to_the_file_cache(folders):
+    cache, index = folders
+    write_doc(cache, "02-HW-New", NEW)
+    api = rag(cache, index)
+    assert "math.ceil" in api.relevant_sections("how do I round up?", "02-HW-New")
+    # nothing matches: still the document's opening section, not nothing
+    assert api.relevant_sections("zzz", "02-HW-New") != ""
+    assert api.engine("02-HW-New") is not api.engine()
+    assert api.document_version("02-HW-New") == FileCacheDocLoader(cache).document_version("02-HW-New")
+
+
+def test_document_edited_after_publishing_falls_back_to_the_file_cache(folders):
+    cache, index = folders
+    write_doc(cache, "01-HW-Old", OLD.replace("vowels", "consonants"))
+    api = rag(cache, index)
+    sections = api.relevant_sections("how do I count consonants?", "01-HW-Old")
+    assert "consonants" in sections and "vowels" not in sections
+
+
+def test_document_in_neither_returns_nothing(folders):
+    api = rag(*folders)
+    assert api.relevant_sections("anything", "99-HW-Missing") == ""
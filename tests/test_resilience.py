@@ -0,0 +1,212 @@
+import asyncio
+import itertools
+import time
+
+import pytest
+
+from llm.azureopenaillm import AzureOpenAILLM
+from llm.ollamallm import OllamaLLM
+from llm.resilience import CircuitOpenError, ResilientLLM, RetryPolicy
+
+MESSAGES = [{"role": "user", "content": "What is the capital of New York?"}]
+
+_names = itertools.count()
+
+
+def resilient(server, **policy) -> ResilientLLM:
+    '''ResilientLLM over an Azure client pointed at the fake server, with its own breaker.'''
+    policy = RetryPolicy(**{"max_attempts": 4, "base_delay": 0.01, "max_delay": 0.1, **policy})
+    llm = AzureOpenAILLM(server.url, "fake-key", "2024-06-01", "gpt-4o-mini", 0.0)
+    return ResilientLLM(llm, policy, name=f"test-{next(_names)}")
+
+
+@pytest.mark.parametrize("status", [429, 500, 502, 503, 504])
+def test_retries_retryable_status(fake_chat_server, status):
+    server = fake_chat_server([("status", status, {}), ("stream", "Albany is the capital.")])
+    llm = resilient(server)
+    assert "".join(llm.generate_stream(MESSAGES)).strip() == "Albany is the capital."
+    assert server.requests == 2
+    assert llm.breaker.state == "closed"
+
+
+def test_retries_until_success(fake_chat_server):
+    server = fake_chat_server([("status", 429, {}), ("status", 503, {}), ("stream", "Albany.")])
+    llm = resilient(server)
+    assert llm.generate_text(MESSAGES) == "Albany."
+    assert server.requests == 3
+
+
+def test_gives_up_after_max_attempts(fake_chat_server):
+    server = fake_chat_server([("status", 503, {})])
+    llm = resilient(server, max_attempts=3)
+    with pytest.raises(Exception) as info:
+        llm.generate_text(MESSAGES)
+    assert getattr(info.value, "status_code", None) == 503
+    assert server.requests == 3
+
+
+def test_does_not_retry_client_errors(fake_chat_server):
+    server = fake_chat_server([("status", 400, {}), ("stream", "never sent")])
+    llm = resilient(server)
+    with pytest.raises(Exception) as info:
+        llm.generate_text(MESSAGES)
+    assert getattr(info.value, "status_code", None) == 400
+    assert server.requests == 1
+    assert llm.breaker.stats["consecutive_failures"] == 0
+
+
+def test_honours_retry_after(fake_chat_server):
+    server = fake_chat_server([("status", 429, {"Retry-After": "1"}), ("stream", "Albany.")])
+    llm = resilient(server, max_delay=5.0)
+    start = time.perf_counter()
+    assert "".join(llm.generate_stream(MESSAGES)).strip() == "Albany."
+    assert time.perf_counter() - start >= 1.0
+    assert server.requests == 2
+
+
+def test_retry_after_is_capped_by_max_delay(fake_chat_server):
+    server = fake_chat_server([("status", 429, {"Retry-After": "30"}), ("stream", "Albany.")])
+    llm = resilient(server, max_delay=0.2)
+    start = time.perf_counter()
+    assert llm.generate_text(MESSAGES) == "Albany."
+    assert time.perf_counter() - start < 5.0
+
+
+def test_no_retry_after_first_chunk(fake_chat_server):
+    server = fake_chat_server([("drop", "Albany is"), ("stream", "never sent")])
+    llm = resilient(server)
+    received = []
+    with pytest.raises(Exception):
+        for chunk in llm.generate_stream(MESSAGES):
+            received.append(chunk)
+    assert "".join(received).strip() == "Albany is"
+    assert server.requests == 1
+
+
+def test_async_stream_retries_before_first_chunk(fake_chat_server):
+    server = fake_chat_server([("status", 503, {}), ("stream", "Albany.")])
+    llm = resilient(server)
+
+    async def collect():
+        return "".join([chunk async for chunk in llm.agenerate_stream(MESSAGES)])
+
+    assert asyncio.run(collect()).strip() == "Albany."
+    assert server.requests == 2
+
+
+def test_async_no_retry_after_first_chunk(fake_chat_server):
+    server = fake_chat_server([("drop", "Albany is"), ("stream", "never sent")])
+    llm = resilient(server)
+
+    async def collect(received):
+        async for chunk in llm.agenerate_stream(MESSAGES):
+            received.append(chunk)
+
+    received = []
+    with pytest.raises(Exception):
+        asyncio.run(collect(received))
+    assert "".join(received).strip() == "Albany is"
+    assert server.requests == 1
+
+
+def test_retries_ollama_stream(fake_chat_server):
+    server = fake_chat_server([("status", 503, {}), ("stream", "Albany.")])
+    policy = RetryPolicy(max_attempts=2, base_delay=0.01, max_delay=0.1)
+    llm = ResilientLLM(OllamaLLM(server.url, "llama3", 0.0), policy, name=f"test-{next(_names)}")
+    assert "".join(llm.generate_stream(MESSAGES)).strip() == "Albany."
+    assert server.requests == 2
+
+
+def test_breaker_opens_and_rejects_without_calling(fake_chat_server):
+    server = fake_chat_server([("status", 500, {})])
+    llm = resilient(server, max_attempts=1, failure_threshold=2, reset_timeout=30.0)
+    for _ in range(2):
+        with pytest.raises(Exception) as info:
+            llm.generate_text(MESSAGES)
+        assert not isinstance(info.value, CircuitOpenError)
+    assert llm.breaker.state == "open"
+
+    with pytest.raises(CircuitOpenError):
+        llm.generate_text(MESSAGES)
+    with pytest.raises(CircuitOpenError):
+        list(llm.generate_stream(MESSAGES))
+    assert server.requests == 2
+    assert llm.breaker.stats["opened"] == 1
+    assert llm.breaker.stats["rejected"] == 2
+
+
+def test_breaker_half_open_trial_closes_on_success(fake_chat_server):
+    server = fake_chat_server([("status", 500, {}), ("status", 500, {}), ("stream", "Albany.")])
+    llm = resilient(server, max_attempts=1, failure_threshold=2, reset_timeout=0.2)
+    for _ in range(2):
+        with pytest.raises(Exception):
+            llm.generate_text(MESSAGES)
+    assert llm.breaker.state == "open"
+
+    time.sleep(0.25)
+    assert llm.breaker.state == "half-open"
+    assert "".join(llm.generate_stream(MESSAGES)).strip() == "Albany."
+    assert llm.breaker.state == "closed"
+    assert server.requests == 3
+
+
+def test_breaker_half_open_trial_failure_reopens(fake_chat_server):
+    server = fake_chat_server([("status", 500, {}), ("status", 500, {}), ("status", 503, {}), ("stream", "Albany.")])
+    llm = resilient(server, max_attempts=1, failure_threshold=2, reset_timeout=0.2)
+    for _ in range(2):
+        with pytest.raises(Exception):
+            llm.generate_text(MESSAGES)
+
+    time.sleep(0.25)
+    with pytest.raises(Exception) as info:
+        llm.generate_text(MESSAGES)
+    assert not isinstance(info.value, CircuitOpenError)
+    # the failed trial restarts the timeout
+    assert llm.breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        llm.generate_text(MESSAGES)
+    assert server.requests == 3
+
+    time.sleep(0.25)
+    assert llm.generate_text(MESSAGES) == "Albany."
+    assert llm.breaker.state == "closed"
+
+
+def test_breaker_half_open_allows_a_single_trial():
+    from llm.resilience import CircuitBreaker
+    breaker = CircuitBreaker("test-single-trial", failure_threshold=1, reset_timeout=0.1)
+    breaker.record_failure()
+    time.sleep(0.15)
+    breaker.allow()
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.abandon()
+    breaker.allow()
+
+
+def test_cancelled_half_open_trial_frees_the_slot(fake_chat_server):
+    server = fake_chat_server([("status", 500, {}), ("slow", 2.0, "too late"), ("stream", "Albany.")])
+    llm = resilient(server, max_attempts=1, failure_threshold=1, reset_timeout=0.2)
+    with pytest.raises(Exception):
+        llm.generate_text(MESSAGES)
+    time.sleep(0.25)
+    assert llm.breaker.state == "half-open"
+
+    # a health probe's timeout cancels the trial
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(asyncio.wait_for(llm.agenerate_text(MESSAGES), 0.3))
+    assert llm.breaker.state == "half-open"
+    assert not llm.breaker._trial_in_flight
+
+    assert llm.generate_text(MESSAGES) == "Albany."
+    assert llm.breaker.state == "closed"
+
+
+def test_retried_call_counts_as_one_failure(fake_chat_server):
+    server = fake_chat_server([("status", 503, {})])
+    llm = resilient(server, max_attempts=3, failure_threshold=2)
+    with pytest.raises(Exception):
+        llm.generate_text(MESSAGES)
+    assert server.requests == 3
+    assert llm.breaker.stats["consecutive_failures"] == 1
+    assert llm.breaker.state == "closed"
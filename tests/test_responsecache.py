@@ -0,0 +1,75 @@
+import asyncio
+import os
+import sys
+import threading
+
+from conftest import APP_DIR
+
+sys.path.insert(0, os.path.join(APP_DIR, "chat"))
+
+from llmapi import LLMAPI
+from responsecache import ResponseCache
+from test_llmapi_retrieval import EchoLLM
+
+OLD_PROMPT = "You are a tutor for HW-03."
+NEW_PROMPT = "You are a patient tutor for HW-03."
+
+
+def test_sessions_on_old_and_new_prompt_keep_their_entries():
+    cache = ResponseCache()
+    cache.put("Tutor", "HW-03", OLD_PROMPT, "What does question 3 want?", "old answer", "m")
+    cache.put("Tutor", "HW-03", NEW_PROMPT, "What does question 3 want?", "new answer", "m")
+    # a session still on the old prompt asks again: neither side wipes the other
+    assert cache.get("Tutor", "HW-03", OLD_PROMPT, "What does question 3 want?").text == "old answer"
+    assert cache.get("Tutor", "HW-03", NEW_PROMPT, "What does question 3 want?").text == "new answer"
+    assert cache.stats["invalidations"] == 0
+
+
+def test_old_prompt_entries_age_out_through_lru():
+    cache = ResponseCache(max_entries=2, similarity_threshold=0.5)
+    cache.put("Tutor", "HW-03", OLD_PROMPT, "What does question 3 want?", "old answer", "m")
+    cache.put("Tutor", "HW-03", NEW_PROMPT, "What does question 3 want?", "new answer", "m")
+    cache.put("Tutor", "HW-03", NEW_PROMPT, "What does question 4 want?", "another answer", "m")
+    assert cache.get("Tutor", "HW-03", OLD_PROMPT, "What does question 3 want?") is None
+    assert cache.stats["evictions"] == 1
+    # the old prompt's TF-IDF counts went with its last entry
+    assert len(cache._df) == 1
+
+
+def test_embedder_runs_without_the_cache_lock():
+    held = []
+
+    def embedder(text):
+        held.append(cache._lock.locked())
+        return [1.0, float(len(text))]
+
+    cache = ResponseCache(similarity_threshold=0.9, embedder=embedder)
+    cache.put("Tutor", "HW-03", OLD_PROMPT, "What does question 3 want?", "answer", "m")
+    assert cache.get("Tutor", "HW-03", OLD_PROMPT, "what does question 3 want me to do") is not None
+    # an exact hit needs no embedding
+    cache.get("Tutor", "HW-03", OLD_PROMPT, "What does question 3 want?")
+    assert held == [False, False]
+
+
+def test_async_path_uses_the_cache_off_the_event_loop():
+    threads = []
+
+    def embedder(text):
+        threads.append(threading.current_thread())
+        return [1.0, 0.0]
+
+    cache = ResponseCache(similarity_threshold=0.9, embedder=embedder)
+    api = LLMAPI(EchoLLM(), system_prompt=OLD_PROMPT, response_cache=cache, cache_scope=("Tutor", "HW-03"))
+
+    async def ask():
+        chunks = [chunk async for chunk in api.astream_response("How do I round up?")]
+        return threading.current_thread(), "".join(chunks)
+
+    loop_thread, answer = asyncio.run(ask())
+    assert answer == "Use math.ceil."
+    assert threads and all(thread is not loop_thread for thread in threads)
+    assert cache.stats["stores"] == 1
+
+    again = LLMAPI(EchoLLM(), system_prompt=OLD_PROMPT, response_cache=cache, cache_scope=("Tutor", "HW-03"))
+    assert "".join(again.stream_response("How do I round up?")) == "Use math.ceil."
+    assert again.last_request["model"] == "cache/echo"
@@ -0,0 +1,126 @@
+import asyncio
+import itertools
+import time
+
+import pytest
+
+import llm.routingllm as routingllm
+from llm.azureopenaillm import AzureOpenAILLM
+from llm.ollamallm import OllamaLLM
+from llm.resilience import ResilientLLM, RetryPolicy
+from llm.routingllm import Route, RoutingLLM, check_routes, get_backend_health, start_health_checks
+
+MESSAGES = [{"role": "user", "content": "What is the capital of New York?"}]
+
+_names = itertools.count()
+
+
+def unique(name: str) -> str:
+    '''Health and breakers are process-wide by name, so every test uses its own.'''
+    return f"{name}-{next(_names)}"
+
+
+def azure_route(server, weight: float = 1.0) -> Route:
+    name = unique("azure")
+    llm = AzureOpenAILLM(server.url, "fake-key", "2024-06-01", "gpt-4o-mini", 0.0)
+    return Route(name, ResilientLLM(llm, RetryPolicy(max_attempts=1), name=name), weight)
+
+
+def ollama_route(server, weight: float = 1.0) -> Route:
+    name = unique("ollama")
+    return Route(name, ResilientLLM(OllamaLLM(server.url, "llama3", 0.0), RetryPolicy(max_attempts=1), name=name), weight)
+
+
+def test_throttled_route_fails_over_without_waiting(fake_chat_server):
+    azure = fake_chat_server([("status", 429, {"Retry-After": "20"})])
+    ollama = fake_chat_server([("stream", "Albany, from Ollama.")])
+    router = RoutingLLM([azure_route(azure, weight=2.0), ollama_route(ollama)],
+                        policy=RetryPolicy(max_attempts=3, base_delay=0.01, max_delay=20.0))
+    start = time.perf_counter()
+    assert "".join(router.generate_stream(MESSAGES)).strip() == "Albany, from Ollama."
+    assert time.perf_counter() - start < 5.0
+    assert azure.requests == 1
+    assert router.last_route.startswith("ollama")
+
+
+def test_retries_across_routes_once_all_failed(fake_chat_server):
+    azure = fake_chat_server([("status", 503, {}), ("stream", "Albany, from Azure.")])
+    ollama = fake_chat_server([("status", 503, {})])
+    router = RoutingLLM([azure_route(azure), ollama_route(ollama)],
+                        policy=RetryPolicy(max_attempts=2, base_delay=0.01, max_delay=0.1))
+    assert router.generate_text(MESSAGES) == "Albany, from Azure."
+    assert (azure.requests, ollama.requests) == (2, 1)
+
+
+def test_gives_up_after_max_attempts_passes(fake_chat_server):
+    azure = fake_chat_server([("status", 503, {})])
+    ollama = fake_chat_server([("status", 503, {})])
+    router = RoutingLLM([azure_route(azure), ollama_route(ollama)],
+                        policy=RetryPolicy(max_attempts=2, base_delay=0.01, max_delay=0.1))
+    with pytest.raises(Exception):
+        list(router.generate_stream(MESSAGES))
+    assert (azure.requests, ollama.requests) == (2, 2)
+
+
+def test_no_failover_after_first_chunk(fake_chat_server):
+    azure = fake_chat_server([("drop", "Albany is")])
+    ollama = fake_chat_server([("stream", "never sent")])
+    router = RoutingLLM([azure_route(azure, weight=2.0), ollama_route(ollama)],
+                        policy=RetryPolicy(max_attempts=3, base_delay=0.01, max_delay=0.1))
+
+    async def collect(received):
+        async for chunk in router.agenerate_stream(MESSAGES):
+            received.append(chunk)
+
+    received = []
+    with pytest.raises(Exception):
+        asyncio.run(collect(received))
+    assert "".join(received).strip() == "Albany is"
+    assert (azure.requests, ollama.requests) == (1, 0)
+
+
+def test_untried_route_is_ranked_by_weight(fake_chat_server):
+    azure = fake_chat_server([("stream", "Albany.")])
+    ollama = fake_chat_server([("stream", "Albany.")])
+    primary, secondary = azure_route(azure, weight=2.0), ollama_route(ollama, weight=1.0)
+    router = RoutingLLM([secondary, primary])
+    assert router._ranked()[0] is primary
+
+    get_backend_health(primary.name).record_latency(100.0)
+    # the untried route is scored at the others' average latency, so weight still wins
+    assert [r.name for r in router._ranked()] == [primary.name, secondary.name]
+
+    get_backend_health(secondary.name).record_latency(20.0)
+    assert router._ranked()[0] is secondary
+
+
+def test_health_checks_probe_every_router(fake_chat_server, monkeypatch):
+    monkeypatch.setattr(routingllm, "_probe_routes", {})
+    monkeypatch.setattr(routingllm, "_health_task", object())
+    first = fake_chat_server([("stream", "OK")])
+    second = fake_chat_server([("stream", "OK")])
+    route_a, route_b = azure_route(first), ollama_route(second)
+    start_health_checks([route_a], interval=60)
+    start_health_checks([route_b], interval=60)
+    assert set(routingllm._probe_routes) == {route_a.name, route_b.name}
+
+    get_backend_health(route_b.name).record_failure(Exception("down"), failover=False)
+    results = asyncio.run(check_routes(list(routingllm._probe_routes.values())))
+    assert results == {route_a.name: True, route_b.name: True}
+    assert get_backend_health(route_b.name).healthy
+    assert (first.requests, second.requests) == (1, 1)
+
+
+def test_probes_leave_the_served_backend_and_latency_alone(fake_chat_server):
+    server = fake_chat_server([("stream", "Albany."), ("stream", "OK")])
+    served = azure_route(server)
+    probe = Route(served.name, AzureOpenAILLM(server.url, "fake-key", "2024-06-01", "gpt-4o-mini", 0.0))
+    router = RoutingLLM([served])
+    assert "".join(router.generate_stream(MESSAGES)).strip() == "Albany."
+    usage, latency = router.last_usage, get_backend_health(served.name).latency_ms
+
+    assert asyncio.run(check_routes([probe])) == {served.name: True}
+    assert router.last_usage is usage
+    health = get_backend_health(served.name).stats
+    assert health["latency_ms"] == round(latency, 1)
+    assert (health["requests"], health["probes"]) == (1, 1)